@@ -4,12 +4,13 @@ Weekly check-in module for tracking therapy progress
 Provides scheduled weekly assessments and manual progress evaluation
 """
 
+import asyncio
 import os
-import json
 import random
 import hashlib
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional, Any
+import orjson
 import pandas as pd
 from telebot import types
 from openpyxl import load_workbook, Workbook
@@ -17,7 +18,7 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 # Import LLM client for summaries
-from openrouter import OpenRouterClient
+from openrouter import get_client
 from config import MODEL_SIMPLE, TEMPERATURE, TOP_P, TOP_K
 
 # Path to Excel file for saving check-in results
@@ -179,7 +180,7 @@ def get_user_insights_last_week(user_id: int) -> List[str]:
             if 'Final Answers' in recent.columns:
                 for answers_json in recent['Final Answers'].dropna():
                     try:
-                        answers = json.loads(answers_json) if isinstance(answers_json, str) else answers_json
+                        answers = orjson.loads(answers_json) if isinstance(answers_json, str) else answers_json
                         if isinstance(answers, dict) and 'insight' in answers:
                             insights.append(answers['insight'])
                     except:
@@ -205,7 +206,7 @@ def get_problem_dynamics(user_id: int) -> Dict[str, List[int]]:
         for _, row in user_rows.iterrows():
             if pd.notna(row['Problems Ratings']):
                 try:
-                    ratings = json.loads(row['Problems Ratings'])
+                    ratings = orjson.loads(row['Problems Ratings'])
                     for problem, rating in ratings.items():
                         if problem not in dynamics:
                             dynamics[problem] = []
@@ -455,7 +456,9 @@ async def handle_goal_progress(bot, callback_query, progress: int):
 async def generate_weekly_summary(user_id: int, responses: Dict, user_name: str) -> str:
     """Generate weekly summary using LLM"""
     try:
-        # Get insights from exercises
+        # Get insights from exercises (write buffered exercise rows first)
+        from exercise import flush_exercises_excel
+        flush_exercises_excel()
         insights = get_user_insights_last_week(user_id)
 
         # Get problem dynamics
@@ -467,8 +470,8 @@ async def generate_weekly_summary(user_id: int, responses: Dict, user_name: str)
             'insights': insights,
             'dynamics': dynamics
         }
-        data_str = json.dumps(cache_data, ensure_ascii=False, sort_keys=True)
-        data_hash = hashlib.md5(data_str.encode()).hexdigest()[:8]
+        data_bytes = orjson.dumps(cache_data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        data_hash = hashlib.md5(data_bytes).hexdigest()[:8]
         cache_key = get_cache_key(user_id, 'weekly_summary', data_hash)
 
         # Check cache
@@ -515,12 +518,13 @@ async def generate_weekly_summary(user_id: int, responses: Dict, user_name: str)
 {dynamics_text}
 
 Текущие оценки проблем:
-{json.dumps(responses['problem_ratings'], ensure_ascii=False, indent=2)}
+{orjson.dumps(responses['problem_ratings'], option=orjson.OPT_INDENT_2).decode()}
 
 Создай поддерживающее саммари на неделю."""
 
-        client = OpenRouterClient()
-        response, usage = client.get_simple_response(
+        # Blocking HTTP call (with retry backoff) - run it in a worker thread so other chats aren't stalled
+        response, usage = await asyncio.to_thread(
+            get_client().get_simple_response,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
             model=MODEL_SIMPLE,
@@ -692,22 +696,21 @@ def save_check_in_results(user_id: int, username: str, user_name: str, responses
         wb = load_workbook(CHECKIN_FILE)
         ws = wb.active
 
-        # Find next empty row
-        next_row = ws.max_row + 1
-
-        # Add data
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'C{next_row}'] = user_name
-        ws[f'D{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws[f'E{next_row}'] = days_since_start
-        ws[f'F{next_row}'] = responses['q1_response']
-        ws[f'G{next_row}'] = responses['q2_response']
-        ws[f'H{next_row}'] = json.dumps(responses['problem_ratings'], ensure_ascii=False)
-        ws[f'I{next_row}'] = responses['goal_progress']
-        # Weekly summary will be added later
-        ws[f'K{next_row}'] = False  # Crisis detected (default)
-        ws[f'L{next_row}'] = ''  # Crisis type
+        # Add data as the next row
+        ws.append({
+            'A': user_id,
+            'B': username,
+            'C': user_name,
+            'D': datetime.now().isoformat(sep=' ', timespec='seconds'),
+            'E': days_since_start,
+            'F': responses['q1_response'],
+            'G': responses['q2_response'],
+            'H': orjson.dumps(responses['problem_ratings']).decode(),
+            'I': responses['goal_progress'],
+            # Weekly summary (J) will be added later
+            'K': False,  # Crisis detected (default)
+            'L': ''  # Crisis type
+        })
 
         wb.save(CHECKIN_FILE)
         print(f"Check-in saved for {username} (ID: {user_id})")
@@ -4,6 +4,8 @@ Diary module for emotion and thought recording
 Allows users to record free-form emotional reflections and saves to Excel
 """
 
+import atexit
+import csv
 import os
 from datetime import datetime
 from telebot import types
@@ -12,6 +14,9 @@ from openpyxl import load_workbook, Workbook
 # Path to the diary data file
 DIARY_FILE = 'diary.xlsx'
 
+# New entries are appended here (O(1) per entry) and moved to DIARY_FILE on demand
+DIARY_CSV_FILE = 'diary.csv'
+
 # Store user diary states
 # Format: {user_id: {'awaiting_entry': bool, 'user_name': str, 'username': str}}
 user_diary_states = {}
@@ -42,7 +47,7 @@ def init_diary_file():
 
 def save_diary_entry(user_id, username, user_name, entry_text, progress_rating=None):
     """
-    Save diary entry to Excel file
+    Save diary entry (appended to the CSV sidecar, moved to Excel by flush_diary_csv)
 
     Args:
         user_id (int): Telegram user ID
@@ -52,29 +57,50 @@ def save_diary_entry(user_id, username, user_name, entry_text, progress_rating=N
         progress_rating (int/str): User's progress rating (0-10), optional
     """
     try:
+        with open(DIARY_CSV_FILE, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow([
+                user_id,
+                username,
+                user_name,
+                'diary_entry',
+                entry_text,
+                progress_rating if progress_rating else '',
+                datetime.now().isoformat(sep=' ', timespec='seconds')
+            ])
+        print(f"Diary entry saved for user {username}: {entry_text[:50]}...")
+
+    except Exception as e:
+        print(f"Error saving diary entry: {e}")
+
+
+def flush_diary_csv():
+    """Append diary entries from the CSV sidecar to the Excel file and empty the sidecar"""
+    try:
+        if not os.path.exists(DIARY_CSV_FILE) or os.path.getsize(DIARY_CSV_FILE) == 0:
+            return
+
+        with open(DIARY_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+
         if not os.path.exists(DIARY_FILE):
             init_diary_file()
 
         wb = load_workbook(DIARY_FILE)
         ws = wb.active
+        for user_id, *values in rows:
+            ws.append([int(user_id) if user_id else None, *values])
+        wb.save(DIARY_FILE)
 
-        # Find next empty row
-        next_row = ws.max_row + 1
+        # Entries are in the workbook now - start a new sidecar
+        open(DIARY_CSV_FILE, 'w').close()
+        print(f"Diary entries flushed to Excel: {len(rows)} row(s)")
 
-        # Add diary entry
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'C{next_row}'] = user_name
-        ws[f'D{next_row}'] = 'diary_entry'
-        ws[f'E{next_row}'] = entry_text
-        ws[f'F{next_row}'] = progress_rating if progress_rating else ''
-        ws[f'G{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    except Exception as e:
+        print(f"Error flushing diary entries: {e}")
 
-        wb.save(DIARY_FILE)
-        print(f"Diary entry saved for user {username}: {entry_text[:50]}...")
 
-    except Exception as e:
-        print(f"Error saving diary entry: {e}")
+# Don't leave diary entries only in the sidecar on shutdown
+atexit.register(flush_diary_csv)
 
 
 async def show_diary_prompt(bot, chat_id, user_id, username, user_name):
@@ -369,3 +395,11 @@ async def handle_diary_back(bot, callback_query):
 
     except Exception as e:
         print(f"Error handling diary back: {e}")
+
+
+# Diary button action (callback data after "diary:") -> handler
+DIARY_ACTIONS = {
+    'confirm': handle_diary_confirm,
+    'edit': handle_diary_edit,
+    'back': handle_diary_back
+}
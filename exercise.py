@@ -5,27 +5,100 @@ Handles exercise recommendations based on selected problems
 """
 
 import asyncio
+import atexit
 import os
 import re
+from dataclasses import dataclass, field
 from datetime import datetime
 from telebot import types
 from openpyxl import load_workbook, Workbook
 from difflib import SequenceMatcher
+from functools import lru_cache
+# These modules don't import exercise at load time, so there is no import cycle
+from greeting import user_states
+from safety_check import check_text_safety, show_crisis_support, log_crisis_detection
+from universal_menu import get_menu_button, show_main_menu
 
 # File paths
 PROTOCOL_MAP_FILE = 'protocol_and_interventions_map.md'
 INTERVENTIONS_FILE = 'interventions.md'
 EXERCISES_EXCEL_FILE = 'exercises.xlsx'
 
+# Buffered writes to exercises.xlsx, applied in order by flush_exercises_excel
+# Format: [('append', {column: value}) | ('update', user_id, exercise_name, {column: value})]
+exercises_excel_pending = []
+EXERCISES_FLUSH_INTERVAL = 5  # seconds
+
+# exercises.xlsx workbook kept in memory between flushes (see get_exercises_workbook)
+# Format: {'wb': Workbook, 'mtime': float of the file as last saved/loaded by us}
+exercises_workbook = {'wb': None, 'mtime': None}
+
+# Regex patterns used on every lookup, compiled once
+STEP_NUMBER_RE = re.compile(r'^(\d+)\.\s+(.+)')  # "1. Step text"
+WHITESPACE_RE = re.compile(r'\s+')
+LETTER_RE = re.compile(r'[^\W\d_]')  # Any letter (Latin or Cyrillic)
+HEADER_NUMBER_RE = re.compile(r'^[^\w\u0400-\u04FF]*\d+[\.)\]]\s*')  # Leading emoji and "12." / "12)" in headers
+ABBREVIATION_RE = re.compile(r'\(([^)]+)\)')  # "(PST)"
+GOAL_TIME_RE = re.compile(r'\s*Время:\s*\d+–\d+\s*мин\.?')
+GOAL_TIME_TAIL_RE = re.compile(r'\s*Время:\s*[\d\w\s–]+\.?$')
+EXERCISE_TIME_RE = re.compile(r'\s*·\s*Время:\s*\d+–\d+\s*мин\.')
+# Protocol map lines that matter: "### header" (group 1, whole line) or "* exercise" (group 2, text after the star)
+PROTOCOL_MAP_LINE_RE = re.compile(r'^([^\S\n]*###.*)$|^[^\S\n]*\*(.*)$', re.M)
+
+# Shortest search term allowed to match an intervention header by plain substring
+MIN_SUBSTRING_MATCH_LENGTH = 5
+
 # List of emojis for different exercises
 EXERCISE_EMOJIS = [
     '✍️', '🧠', '📈', '💬', '🎯', '💪',
     '🌟', '📊', '🎨', '🔥', '💡', '🚀'
 ]
 
+# Questions asked after an exercise
+FINAL_QUESTIONS = (
+    "Какой инсайт ты получил?",
+    "Что было полезно?",
+    "Что вызвало трудность?"
+)
+
+
+@dataclass(slots=True)
+class ExerciseState:
+    """Per-user state of exercise selection and execution"""
+    exercises: list = field(default_factory=list)  # recommended exercise names
+    problems: dict = field(default_factory=dict)  # {problem display name: rating}
+    username: str = 'Unknown'
+    selected_exercise: str = None
+    completed_exercises: set = field(default_factory=set)
+    # Step-by-step execution
+    steps: list = field(default_factory=list)  # [(step_num, step_text)]
+    current_step_idx: int = 0
+    step_results: dict = field(default_factory=dict)  # {step_idx: result text}
+    awaiting_step_input: bool = False
+    pending_step_result: str = None
+    # Free-form result (exercises without steps)
+    awaiting_exercise_text: bool = False
+    pending_exercise_text: str = None
+    # Final questions
+    current_final_question: int = 0
+    final_answers: dict = field(default_factory=dict)  # {question_idx: answer}
+    awaiting_final_answer: bool = False
+    pending_final_answer: str = None
+
+
 # Store user exercise states
+# Format: {user_id: ExerciseState}
 user_exercise_states = {}
 
+# Parsed protocol map (see load_protocol_map) and exercises already looked up per problem
+# Format: {'mtime': float, 'sections': [(header_line, [exercise, ...])], 'by_problem': {problem_name: (exercise, ...) or None}}
+protocol_map_cache = {'mtime': None, 'sections': [], 'by_problem': {}}
+
+# Parsed interventions.md (see load_interventions)
+# Format: {'mtime': float, 'lines': [str], 'headers': [(line_idx, main_part_lower, abbreviation_lower)],
+#          'exact_headers': {name_lower: line_idx}}
+interventions_cache = {'mtime': None, 'lines': [], 'headers': [], 'exact_headers': {}}
+
 
 def init_exercises_excel():
     """Initialize exercises Excel file with headers"""
@@ -50,26 +123,88 @@ def init_exercises_excel():
         wb.save(EXERCISES_EXCEL_FILE)
 
 
-def save_exercise_selection_to_excel(user_id, username, exercise_name, problem, rating):
-    """Save exercise selection to exercises.xlsx"""
-    try:
-        if not os.path.exists(EXERCISES_EXCEL_FILE):
-            init_exercises_excel()
+def get_exercises_workbook():
+    """
+    Return the in-memory exercises.xlsx workbook, loading it only when needed
+    Reloaded if the file changed on disk since our last save (e.g. safety log entries)
+    """
+    if not os.path.exists(EXERCISES_EXCEL_FILE):
+        init_exercises_excel()
+
+    mtime = os.path.getmtime(EXERCISES_EXCEL_FILE)
+    if exercises_workbook['wb'] is None or exercises_workbook['mtime'] != mtime:
+        exercises_workbook['wb'] = load_workbook(EXERCISES_EXCEL_FILE)
+        exercises_workbook['mtime'] = mtime
+
+    return exercises_workbook['wb']
+
+
+def flush_exercises_excel():
+    """
+    Apply buffered writes to exercises.xlsx with a single load and save
+    Runs in the event loop thread (and at exit), so it never interleaves with other workbook writers
+    """
+    if not exercises_excel_pending:
+        return
 
-        wb = load_workbook(EXERCISES_EXCEL_FILE)
+    operations = exercises_excel_pending[:]
+    exercises_excel_pending.clear()
+
+    try:
+        wb = get_exercises_workbook()
         ws = wb.active
 
-        next_row = ws.max_row + 1
+        for operation in operations:
+            if operation[0] == 'append':
+                ws.append(operation[1])
+            else:
+                # Update the last row for this user/exercise
+                _, user_id, exercise_name, values = operation
+                for row in range(ws.max_row, 0, -1):
+                    if ws[f'A{row}'].value == user_id and ws[f'C{row}'].value == exercise_name:
+                        for column, value in values.items():
+                            ws[f'{column}{row}'] = value
+                        break
+
+        # Save to a temporary file and atomically replace the workbook, so a crash mid-save
+        # leaves the previous file intact instead of a truncated one
+        tmp_file = EXERCISES_EXCEL_FILE + '.tmp'
+        wb.save(tmp_file)
+        os.replace(tmp_file, EXERCISES_EXCEL_FILE)
+        exercises_workbook['mtime'] = os.path.getmtime(EXERCISES_EXCEL_FILE)
+        print(f"Exercises Excel flushed: {len(operations)} write(s)")
+
+    except Exception as e:
+        print(f"Error flushing exercises to Excel: {e}")
+        # In-memory workbook may be partially updated: reload it and retry all writes next time
+        exercises_workbook['wb'] = None
+        exercises_excel_pending[:0] = operations
 
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'C{next_row}'] = exercise_name
-        ws[f'D{next_row}'] = problem
-        ws[f'E{next_row}'] = rating
-        ws[f'F{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws[f'H{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        wb.save(EXERCISES_EXCEL_FILE)
+# Don't lose buffered writes on shutdown
+atexit.register(flush_exercises_excel)
+
+
+async def run_exercises_excel_flusher():
+    """Background task: flush buffered exercise writes every EXERCISES_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(EXERCISES_FLUSH_INTERVAL)
+        flush_exercises_excel()
+
+
+def save_exercise_selection_to_excel(user_id, username, exercise_name, problem, rating):
+    """Save exercise selection to exercises.xlsx (buffered, see flush_exercises_excel)"""
+    try:
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        exercises_excel_pending.append(('append', {
+            'A': user_id,
+            'B': username,
+            'C': exercise_name,
+            'D': problem,
+            'E': rating,
+            'F': now,
+            'H': now
+        }))
         print(f"Exercise selection saved: {username} - {exercise_name}")
 
     except Exception as e:
@@ -94,7 +229,7 @@ def extract_steps_from_description(full_description):
             # Look for lines starting with number and dot (e.g., "1.", "2.")
             if stripped and stripped[0].isdigit() and '.' in stripped[:3]:
                 # Extract step number
-                match = re.match(r'^(\d+)\.\s+(.+)', stripped)
+                match = STEP_NUMBER_RE.match(stripped)
                 if match:
                     step_num = int(match.group(1))
                     step_text = match.group(2).strip()
@@ -109,29 +244,22 @@ def extract_steps_from_description(full_description):
 
 
 def save_exercise_step_to_excel(user_id, username, exercise_name, problem, rating, step_num, step_text, step_result):
-    """Save exercise step data to exercises.xlsx (all in one row)"""
+    """Save exercise step data to exercises.xlsx (all in one row, buffered)"""
     try:
-        if not os.path.exists(EXERCISES_EXCEL_FILE):
-            init_exercises_excel()
-
-        wb = load_workbook(EXERCISES_EXCEL_FILE)
-        ws = wb.active
-
-        next_row = ws.max_row + 1
-
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'C{next_row}'] = exercise_name
-        ws[f'D{next_row}'] = problem
-        ws[f'E{next_row}'] = rating
-        ws[f'F{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws[f'G{next_row}'] = step_num
-        ws[f'H{next_row}'] = step_text
-        ws[f'I{next_row}'] = step_result
-        ws[f'J{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws[f'N{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        wb.save(EXERCISES_EXCEL_FILE)
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        exercises_excel_pending.append(('append', {
+            'A': user_id,
+            'B': username,
+            'C': exercise_name,
+            'D': problem,
+            'E': rating,
+            'F': now,
+            'G': step_num,
+            'H': step_text,
+            'I': step_result,
+            'J': now,
+            'N': now
+        }))
         print(f"Exercise step saved: {username} - {exercise_name} - Step {step_num}")
 
     except Exception as e:
@@ -139,24 +267,14 @@ def save_exercise_step_to_excel(user_id, username, exercise_name, problem, ratin
 
 
 def save_exercise_final_answers_to_excel(user_id, username, exercise_name, problem, rating, insight, useful, difficulty):
-    """Save final answers (insight, useful, difficulty) to exercises.xlsx"""
+    """Save final answers (insight, useful, difficulty) to exercises.xlsx (buffered)"""
     try:
-        if not os.path.exists(EXERCISES_EXCEL_FILE):
-            init_exercises_excel()
-
-        wb = load_workbook(EXERCISES_EXCEL_FILE)
-        ws = wb.active
-
-        # Find the last row for this user/exercise and update it
-        for row in range(ws.max_row, 0, -1):
-            if (ws[f'A{row}'].value == user_id and
-                ws[f'C{row}'].value == exercise_name):
-                ws[f'K{row}'] = insight
-                ws[f'L{row}'] = useful
-                ws[f'M{row}'] = difficulty
-                break
-
-        wb.save(EXERCISES_EXCEL_FILE)
+        # Applied to the last row for this user/exercise on flush
+        exercises_excel_pending.append(('update', user_id, exercise_name, {
+            'K': insight,
+            'L': useful,
+            'M': difficulty
+        }))
         print(f"Exercise final answers saved: {username} - {exercise_name}")
 
     except Exception as e:
@@ -164,142 +282,208 @@ def save_exercise_final_answers_to_excel(user_id, username, exercise_name, probl
 
 
 def save_exercise_text_to_excel(user_id, username, exercise_name, exercise_text):
-    """Save exercise text input to exercises.xlsx"""
+    """Save exercise text input to exercises.xlsx (buffered)"""
     try:
-        if not os.path.exists(EXERCISES_EXCEL_FILE):
-            init_exercises_excel()
-
-        wb = load_workbook(EXERCISES_EXCEL_FILE)
-        ws = wb.active
-
-        for row in range(ws.max_row, 0, -1):
-            if ws[f'A{row}'].value == user_id and ws[f'C{row}'].value == exercise_name:
-                ws[f'G{row}'] = exercise_text
-                break
-
-        wb.save(EXERCISES_EXCEL_FILE)
+        # Applied to the last row for this user/exercise on flush
+        exercises_excel_pending.append(('update', user_id, exercise_name, {'G': exercise_text}))
         print(f"Exercise text saved: {username} - {exercise_name}")
 
     except Exception as e:
         print(f"Error saving exercise text to Excel: {e}")
 
 
+def load_protocol_map():
+    """
+    Parse protocol_and_interventions_map.md into (header, exercises) sections
+    Parsed once and re-read only when the file modification time changes
+    (the mtime check is the only file system call on a cache hit; raises FileNotFoundError if missing)
+    """
+    mtime = os.path.getmtime(PROTOCOL_MAP_FILE)
+    if protocol_map_cache['mtime'] == mtime:
+        return protocol_map_cache['sections']
+
+    with open(PROTOCOL_MAP_FILE, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    sections = []
+    # One regex scan finds headers and bullets, all other lines are skipped by the regex engine
+    for header, bullet in PROTOCOL_MAP_LINE_RE.findall(content):
+        if header:
+            sections.append((header, []))
+        elif sections:
+            exercise_text = bullet.lstrip('*').strip()
+            exercise_text = WHITESPACE_RE.sub(' ', exercise_text)
+            if LETTER_RE.search(exercise_text):
+                sections[-1][1].append(exercise_text)
+
+    protocol_map_cache['sections'] = sections
+    protocol_map_cache['by_problem'] = {}
+    protocol_map_cache['mtime'] = mtime
+    return sections
+
+
 def extract_exercises_for_problem(problem_name):
     """
     Extract exercises for a given problem from protocol_and_interventions_map.md
     """
     try:
-        if not os.path.exists(PROTOCOL_MAP_FILE):
+        try:
+            sections = load_protocol_map()
+        except FileNotFoundError:
             print(f"Error: {PROTOCOL_MAP_FILE} not found")
             return []
 
-        with open(PROTOCOL_MAP_FILE, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-        problem_section_start = None
-
-        for idx, line in enumerate(lines):
-            if line.startswith('###') and problem_name in line:
-                problem_section_start = idx
-                break
+        by_problem = protocol_map_cache['by_problem']
+        if problem_name not in by_problem:
+            by_problem[problem_name] = next(
+                (tuple(exercises[:6]) for header, exercises in sections if problem_name in header),
+                None
+            )
 
-        if problem_section_start is None:
+        exercises = by_problem[problem_name]
+        if exercises is None:
             print(f"Problem '{problem_name}' not found in {PROTOCOL_MAP_FILE}")
             return []
 
-        exercises = []
-        for idx in range(problem_section_start + 1, len(lines)):
-            line = lines[idx].strip()
-
-            if line.startswith('###'):
-                break
-
-            if line.startswith('*'):
-                exercise_text = line.lstrip('*').strip()
-                exercise_text = re.sub(r'\s+', ' ', exercise_text)
-                if exercise_text and any(c.isalpha() for c in exercise_text):
-                    exercises.append(exercise_text)
-
-        return exercises[:6]
+        return list(exercises)
 
     except Exception as e:
         print(f"Error extracting exercises: {e}")
         return []
 
 
+def load_interventions():
+    """
+    Read interventions.md and index its section headers for matching
+    Returns (lines, headers, exact_headers) where headers is [(line_idx, main_part_lower, abbreviation_lower)]
+    and exact_headers maps a lowercase name/abbreviation to the first header line index having it
+    Parsed once and re-read only when the file modification time changes
+    (the mtime check is the only file system call on a cache hit; raises FileNotFoundError if missing)
+    """
+    mtime = os.path.getmtime(INTERVENTIONS_FILE)
+    if interventions_cache['mtime'] == mtime:
+        return interventions_cache['lines'], interventions_cache['headers'], interventions_cache['exact_headers']
+
+    with open(INTERVENTIONS_FILE, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    lines = content.split('\n')
+    headers = []
+    exact_headers = {}
+
+    # Index only section headers (lines starting with ##)
+    for idx, line in enumerate(lines):
+        if line.startswith('##'):
+            line_clean = line.replace('##', '').strip()
+            # Remove number with either . or ) after it
+            line_clean = HEADER_NUMBER_RE.sub('', line_clean)
+
+            # Check both the full name and abbreviation in parentheses
+            # Extract main part (before parentheses)
+            main_part = line_clean.split('(')[0].strip()
+
+            # Extract abbreviation if exists (e.g., PST from "(PST)")
+            abbreviation = None
+            if '(' in line_clean and ')' in line_clean:
+                # Extract content between parentheses
+                abbreviation_match = ABBREVIATION_RE.search(line_clean)
+                if abbreviation_match:
+                    abbreviation = abbreviation_match.group(1).strip().lower()
+
+            headers.append((idx, main_part.lower(), abbreviation))
+            exact_headers.setdefault(main_part.lower(), idx)
+            if abbreviation:
+                exact_headers.setdefault(abbreviation, idx)
+
+    interventions_cache['lines'] = lines
+    interventions_cache['headers'] = headers
+    interventions_cache['exact_headers'] = exact_headers
+    interventions_cache['mtime'] = mtime
+    return lines, headers, exact_headers
+
+
+def find_intervention_section(exercise_name, headers, exact_headers):
+    """
+    Find the header line index of an exercise in interventions.md using fuzzy matching
+    Returns None if no header is similar enough
+    """
+    # Handle "Exercise · Other" format - take only first part
+    if '·' in exercise_name:
+        exercise_name = exercise_name.split('·')[0].strip()
+
+    search_term = exercise_name.split('(')[0].strip()
+    search_term = search_term.rstrip('.!?,;:')
+    search_term_lower = search_term.lower()
+
+    # Exact name or abbreviation match - no fuzzy scoring needed
+    if search_term_lower in exact_headers:
+        idx = exact_headers[search_term_lower]
+        print(f"Found '{search_term}' with score 1.00 at line {idx}")
+        return idx
+
+    # A single header containing the search term is taken as is
+    # (short terms are skipped: they occur in too many unrelated headers)
+    if len(search_term_lower) >= MIN_SUBSTRING_MATCH_LENGTH:
+        substring_hits = [idx for idx, main_part, _ in headers if search_term_lower in main_part]
+        if len(substring_hits) == 1:
+            print(f"Found '{search_term}' as substring at line {substring_hits[0]}")
+            return substring_hits[0]
+
+    # Find best match using fuzzy matching
+    best_match_idx = None
+    best_match_score = 0
+    MATCH_THRESHOLD = 0.8  # 80% similarity threshold
+
+    for idx, main_part, abbreviation in headers:
+        # Calculate similarity score for main part
+        # (cheap upper bounds first: skip headers that can't reach the threshold or beat the best score)
+        score_main = 0
+        matcher = SequenceMatcher(None, search_term_lower, main_part)
+        min_score = max(best_match_score, MATCH_THRESHOLD)
+        if matcher.real_quick_ratio() >= min_score and matcher.quick_ratio() >= min_score:
+            score_main = matcher.ratio()
+
+        # Calculate similarity score for abbreviation if it exists
+        score_abbr = 0
+        if abbreviation:
+            matcher = SequenceMatcher(None, search_term_lower, abbreviation)
+            if matcher.real_quick_ratio() >= min_score and matcher.quick_ratio() >= min_score:
+                score_abbr = matcher.ratio()
+
+        # Use the better score
+        score = max(score_main, score_abbr)
+
+        # Update best match if score is better
+        if score > best_match_score:
+            best_match_score = score
+            best_match_idx = idx
+
+            # If we find an exact match, stop searching
+            if score == 1.0:
+                break
+
+    # Use the best match if it meets the threshold
+    if best_match_idx is not None and best_match_score >= MATCH_THRESHOLD:
+        print(f"Found '{search_term}' with score {best_match_score:.2f} at line {best_match_idx}")
+        return best_match_idx
+
+    print(f"Exercise '{search_term}' not found in {INTERVENTIONS_FILE} (best score: {best_match_score:.2f})")
+    return None
+
+
 def extract_exercise_goal(exercise_name):
     """
     Extract exercise goal from interventions.md using fuzzy matching
     """
     try:
-        if not os.path.exists(INTERVENTIONS_FILE):
+        try:
+            lines, headers, exact_headers = load_interventions()
+        except FileNotFoundError:
             print(f"Error: {INTERVENTIONS_FILE} not found")
             return None
 
-        with open(INTERVENTIONS_FILE, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-
-        # Handle "Exercise · Other" format - take only first part
-        if '·' in exercise_name:
-            exercise_name = exercise_name.split('·')[0].strip()
-
-        search_term = exercise_name.split('(')[0].strip()
-        search_term = search_term.rstrip('.!?,;:')
-        search_term_lower = search_term.lower()
-
-        # Find best match using fuzzy matching
-        best_match_idx = None
-        best_match_score = 0
-        MATCH_THRESHOLD = 0.8  # 80% similarity threshold
-
-        # Search only in section headers (lines starting with ##)
-        for idx, line in enumerate(lines):
-            if line.startswith('##'):
-                line_clean = line.replace('##', '').strip()
-                # Remove number with either . or ) after it
-                line_clean = re.sub(r'^[^\w\u0400-\u04FF]*\d+[\.)\]]\s*', '', line_clean)
-
-                # Check both the full name and abbreviation in parentheses
-                # Extract main part (before parentheses)
-                main_part = line_clean.split('(')[0].strip()
-
-                # Extract abbreviation if exists (e.g., PST from "(PST)")
-                abbreviation = None
-                if '(' in line_clean and ')' in line_clean:
-                    # Extract content between parentheses
-                    abbreviation_match = re.search(r'\(([^)]+)\)', line_clean)
-                    if abbreviation_match:
-                        abbreviation = abbreviation_match.group(1).strip()
-
-                # Calculate similarity score for main part
-                score_main = SequenceMatcher(None, search_term_lower, main_part.lower()).ratio()
-
-                # Calculate similarity score for abbreviation if it exists
-                score_abbr = 0
-                if abbreviation:
-                    score_abbr = SequenceMatcher(None, search_term_lower, abbreviation.lower()).ratio()
-
-                # Use the better score
-                score = max(score_main, score_abbr)
-
-                # Update best match if score is better
-                if score > best_match_score:
-                    best_match_score = score
-                    best_match_idx = idx
-
-                    # If we find an exact match, stop searching
-                    if score == 1.0:
-                        break
-
-        # Use the best match if it meets the threshold
-        if best_match_idx is not None and best_match_score >= MATCH_THRESHOLD:
-            exercise_section_idx = best_match_idx
-            print(f"Found '{search_term}' with score {best_match_score:.2f} at line {exercise_section_idx}")
-        else:
-            print(f"Exercise '{search_term}' not found in {INTERVENTIONS_FILE} (best score: {best_match_score:.2f})")
+        exercise_section_idx = find_intervention_section(exercise_name, headers, exact_headers)
+        if exercise_section_idx is None:
             return None
 
         # Extract goal from the found section
@@ -307,8 +491,8 @@ def extract_exercise_goal(exercise_name):
             if 'Цель:' in lines[idx]:
                 goal_text = lines[idx].replace('Цель:', '').strip()
                 # Remove time information if present
-                goal_text = re.sub(r'\s*Время:\s*\d+–\d+\s*мин\.?', '', goal_text)
-                goal_text = re.sub(r'\s*Время:\s*[\d\w\s–]+\.?$', '', goal_text)
+                goal_text = GOAL_TIME_RE.sub('', goal_text)
+                goal_text = GOAL_TIME_TAIL_RE.sub('', goal_text)
                 return goal_text.strip()
 
         return None
@@ -324,73 +508,14 @@ def extract_exercise_full_description(exercise_name):
     Returns all text from the exercise section until the next section marker
     """
     try:
-        if not os.path.exists(INTERVENTIONS_FILE):
+        try:
+            lines, headers, exact_headers = load_interventions()
+        except FileNotFoundError:
             print(f"Error: {INTERVENTIONS_FILE} not found")
             return None
 
-        with open(INTERVENTIONS_FILE, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        lines = content.split('\n')
-
-        # Handle "Exercise · Other" format - take only first part
-        if '·' in exercise_name:
-            exercise_name = exercise_name.split('·')[0].strip()
-
-        search_term = exercise_name.split('(')[0].strip()
-        search_term = search_term.rstrip('.!?,;:')
-        search_term_lower = search_term.lower()
-
-        # Find best match using fuzzy matching
-        best_match_idx = None
-        best_match_score = 0
-        MATCH_THRESHOLD = 0.8  # 80% similarity threshold
-
-        # Find exercise section header (##) using fuzzy matching
-        for idx, line in enumerate(lines):
-            if line.startswith('##'):
-                line_clean = line.replace('##', '').strip()
-                # Remove number with either . or ) after it
-                line_clean = re.sub(r'^[^\w\u0400-\u04FF]*\d+[\.)\]]\s*', '', line_clean)
-
-                # Check both the full name and abbreviation in parentheses
-                # Extract main part (before parentheses)
-                main_part = line_clean.split('(')[0].strip()
-
-                # Extract abbreviation if exists (e.g., PST from "(PST)")
-                abbreviation = None
-                if '(' in line_clean and ')' in line_clean:
-                    # Extract content between parentheses
-                    abbreviation_match = re.search(r'\(([^)]+)\)', line_clean)
-                    if abbreviation_match:
-                        abbreviation = abbreviation_match.group(1).strip()
-
-                # Calculate similarity score for main part
-                score_main = SequenceMatcher(None, search_term_lower, main_part.lower()).ratio()
-
-                # Calculate similarity score for abbreviation if it exists
-                score_abbr = 0
-                if abbreviation:
-                    score_abbr = SequenceMatcher(None, search_term_lower, abbreviation.lower()).ratio()
-
-                # Use the better score
-                score = max(score_main, score_abbr)
-
-                # Update best match if score is better
-                if score > best_match_score:
-                    best_match_score = score
-                    best_match_idx = idx
-
-                    # If we find an exact match, stop searching
-                    if score == 1.0:
-                        break
-
-        # Use the best match if it meets the threshold
-        if best_match_idx is not None and best_match_score >= MATCH_THRESHOLD:
-            exercise_section_idx = best_match_idx
-            print(f"Found '{search_term}' with score {best_match_score:.2f} at line {exercise_section_idx}")
-        else:
-            print(f"Exercise '{search_term}' not found in {INTERVENTIONS_FILE} (best score: {best_match_score:.2f})")
+        exercise_section_idx = find_intervention_section(exercise_name, headers, exact_headers)
+        if exercise_section_idx is None:
             return None
 
         # Extract content from exercise section until next section marker (*** or ##)
@@ -399,36 +524,34 @@ def extract_exercise_full_description(exercise_name):
 
         for idx in range(exercise_section_idx + 1, len(lines)):
             line = lines[idx]
+            stripped = line.strip()
 
             # Skip the empty "##" header that comes right after the title
-            if skip_empty_header and line.strip() == '##':
+            if skip_empty_header and stripped == '##':
                 skip_empty_header = False
                 continue
 
-            # Stop at next section marker (but not empty ##)
-            if line.strip().startswith('***'):
-                break
-
-            # Stop at next numbered section header (## followed by number)
-            if line.strip().startswith('##') and len(line.strip()) > 2:
-                # Check if it's a numbered section (has digit after ##)
-                header_content = line.replace('##', '').strip()
-                if header_content and (header_content[0].isdigit() or header_content.startswith('0)')):
+            if stripped.startswith(('***', '##')):
+                # Stop at next section marker (but not empty ##)
+                if stripped.startswith('***'):
                     break
 
+                # Stop at next numbered section header (## followed by number)
+                if len(stripped) > 2:
+                    # Check if it's a numbered section (has digit after ##)
+                    header_content = line.replace('##', '').strip()
+                    if header_content and (header_content[0].isdigit() or header_content.startswith('0)')):
+                        break
+
             # Skip empty lines at the beginning
-            if not description_lines and not line.strip():
+            if not description_lines and not stripped:
                 continue
 
             description_lines.append(line)
 
-        # Join and clean up
+        # Join and clean up (strip also drops trailing empty lines)
         description = '\n'.join(description_lines).strip()
 
-        # Remove trailing empty lines
-        while description.endswith('\n\n'):
-            description = description[:-1]
-
         return description if description else None
 
     except Exception as e:
@@ -436,6 +559,66 @@ def extract_exercise_full_description(exercise_name):
         return None
 
 
+def get_interventions_mtime():
+    """Modification time of interventions.md (None if missing), part of memoized lookup keys"""
+    try:
+        return os.path.getmtime(INTERVENTIONS_FILE)
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=512)
+def load_exercise_goal(exercise_name, interventions_mtime):
+    """
+    Exercise goal, memoized per interventions.md version
+    (interventions_mtime is part of the cache key so edits to the file take effect)
+    """
+    return extract_exercise_goal(exercise_name)
+
+
+def get_exercise_goal(exercise_name):
+    """
+    Get exercise goal, shared between all users (recommendation lists repeat the same exercises)
+    """
+    return load_exercise_goal(exercise_name, get_interventions_mtime())
+
+
+@lru_cache(maxsize=512)
+def load_exercise_card_goal(exercise_name, interventions_mtime):
+    """
+    Exercise goal as shown on a recommendation card ("Время: X–Y мин." removed), memoized per interventions.md version
+    """
+    goal = load_exercise_goal(exercise_name, interventions_mtime)
+    if not goal:
+        return ''
+    return EXERCISE_TIME_RE.sub('', goal).strip()
+
+
+def get_exercise_card_goal(exercise_name):
+    """
+    Get recommendation card goal text of an exercise ('' if there is none)
+    """
+    return load_exercise_card_goal(exercise_name, get_interventions_mtime())
+
+
+@lru_cache(maxsize=256)
+def load_exercise_content(exercise_name, interventions_mtime):
+    """
+    Full description and steps of an exercise, memoized per interventions.md version
+    (interventions_mtime is part of the cache key so edits to the file take effect)
+    """
+    full_description = extract_exercise_full_description(exercise_name)
+    return full_description, tuple(extract_steps_from_description(full_description))
+
+
+def get_exercise_content(exercise_name):
+    """
+    Get (full_description, steps) for an exercise, shared between all users
+    """
+    full_description, steps = load_exercise_content(exercise_name, get_interventions_mtime())
+    return full_description, list(steps)
+
+
 async def show_exercise_recommendations(bot, chat_id, user_id, username, problems_with_ratings):
     """
     Show exercise recommendations based on selected problems
@@ -475,13 +658,11 @@ async def show_exercise_recommendations(bot, chat_id, user_id, username, problem
             )
             return
 
-        user_exercise_states[user_id] = {
-            'exercises': exercises,
-            'problems': problems_with_ratings,
-            'selected_exercise': None,
-            'username': username,
-            'completed_exercises': []  # Track completed exercises
-        }
+        user_exercise_states[user_id] = ExerciseState(
+            exercises=exercises,
+            problems=problems_with_ratings,
+            username=username
+        )
 
         header_text = "На основе твоих ответов рекомендую начать с этих упражнений:"
         await bot.send_message(chat_id, header_text)
@@ -490,17 +671,9 @@ async def show_exercise_recommendations(bot, chat_id, user_id, username, problem
         await asyncio.sleep(2)
 
         for idx, exercise in enumerate(exercises):
-            goal = extract_exercise_goal(exercise)
+            goal_clean = get_exercise_card_goal(exercise)
             emoji = EXERCISE_EMOJIS[idx % len(EXERCISE_EMOJIS)]
-
-            # Remove "Время: X–Y мин." from goal
-            if goal:
-                # Remove the time part (e.g., "Время: 5–8 мин.")
-                goal_clean = re.sub(r'\s*·\s*Время:\s*\d+–\d+\s*мин\.', '', goal)
-                goal_clean = goal_clean.strip()
-                card_text = f"{emoji} {exercise}\n{goal_clean}" if goal_clean else f"{emoji} {exercise}"
-            else:
-                card_text = f"{emoji} {exercise}"
+            card_text = f"{emoji} {exercise}\n{goal_clean}" if goal_clean else f"{emoji} {exercise}"
 
             markup = types.InlineKeyboardMarkup()
             btn_select = types.InlineKeyboardButton(
@@ -512,7 +685,6 @@ async def show_exercise_recommendations(bot, chat_id, user_id, username, problem
             await bot.send_message(chat_id, card_text, reply_markup=markup)
 
         # After all exercise cards, add menu button
-        from universal_menu import get_menu_button
         menu_markup = get_menu_button()
         await bot.send_message(chat_id, "Выбери упражнение или вернись в меню", reply_markup=menu_markup)
 
@@ -536,25 +708,25 @@ async def handle_exercise_select(bot, callback_query, exercise_idx):
         state = user_exercise_states[user_id]
         exercise_idx = int(exercise_idx)
 
-        if exercise_idx >= len(state['exercises']):
+        if exercise_idx >= len(state.exercises):
             await bot.answer_callback_query(callback_query.id)
             return
 
-        selected_exercise = state['exercises'][exercise_idx]
-        state['selected_exercise'] = selected_exercise
+        selected_exercise = state.exercises[exercise_idx]
+        state.selected_exercise = selected_exercise
 
         # Reset exercise execution state for new exercise
-        state['steps'] = []
-        state['current_step_idx'] = 0
-        state['step_results'] = {}
-        state['current_final_question'] = 0
-        state['final_answers'] = {}
-        state['awaiting_exercise_text'] = False
-        state['awaiting_step_input'] = False
-        state['awaiting_final_answer'] = False
-
-        first_problem = list(state['problems'].keys())[0]
-        first_rating = state['problems'][first_problem]
+        state.steps = []
+        state.current_step_idx = 0
+        state.step_results = {}
+        state.current_final_question = 0
+        state.final_answers = {}
+        state.awaiting_exercise_text = False
+        state.awaiting_step_input = False
+        state.awaiting_final_answer = False
+
+        first_problem = list(state.problems.keys())[0]
+        first_rating = state.problems[first_problem]
         save_exercise_selection_to_excel(user_id, username, selected_exercise, first_problem, first_rating)
 
         await bot.answer_callback_query(callback_query.id)
@@ -600,22 +772,19 @@ async def handle_exercise_start(bot, callback_query):
             return
 
         state = user_exercise_states[user_id]
-        selected_exercise = state['selected_exercise']
+        selected_exercise = state.selected_exercise
 
         if not selected_exercise:
             await bot.answer_callback_query(callback_query.id)
             return
 
-        # Extract full description from interventions.md
-        full_description = extract_exercise_full_description(selected_exercise)
-
-        # Extract steps from full description
-        steps = extract_steps_from_description(full_description)
+        # Full description and steps from interventions.md (cached after first use)
+        full_description, steps = get_exercise_content(selected_exercise)
 
         if not steps:
             # No steps found, show full description as before
             await bot.answer_callback_query(callback_query.id)
-            exercise_idx = state['exercises'].index(selected_exercise)
+            exercise_idx = state.exercises.index(selected_exercise)
             emoji = EXERCISE_EMOJIS[exercise_idx % len(EXERCISE_EMOJIS)]
 
             if full_description:
@@ -624,21 +793,20 @@ async def handle_exercise_start(bot, callback_query):
                 exercise_text = f"{emoji} {selected_exercise}"
 
             await bot.send_message(chat_id, exercise_text)
-            from universal_menu import get_menu_button
             markup = get_menu_button()
             await bot.send_message(chat_id, "Поделись результатом упражнения:", reply_markup=markup)
-            state['awaiting_exercise_text'] = True
+            state.awaiting_exercise_text = True
             return
 
         # Store steps and initialize step navigation
-        state['steps'] = steps
-        state['current_step_idx'] = 0
-        state['step_results'] = {}
+        state.steps = steps
+        state.current_step_idx = 0
+        state.step_results = {}
 
         await bot.answer_callback_query(callback_query.id)
 
         # Show exercise header
-        exercise_idx = state['exercises'].index(selected_exercise)
+        exercise_idx = state.exercises.index(selected_exercise)
         emoji = EXERCISE_EMOJIS[exercise_idx % len(EXERCISE_EMOJIS)]
         await bot.send_message(chat_id, f"{emoji} {selected_exercise}")
 
@@ -659,8 +827,8 @@ async def show_exercise_step(bot, chat_id, user_id):
             return
 
         state = user_exercise_states[user_id]
-        current_idx = state['current_step_idx']
-        steps = state['steps']
+        current_idx = state.current_step_idx
+        steps = state.steps
 
         if current_idx >= len(steps):
             # All steps completed - show final questions
@@ -673,12 +841,11 @@ async def show_exercise_step(bot, chat_id, user_id):
         step_message = f"Шаг {current_idx + 1} из {len(steps)}:\n\n{step_text}"
         await bot.send_message(chat_id, step_message)
 
-        from universal_menu import get_menu_button
         markup = get_menu_button()
         await bot.send_message(chat_id, "Поделись результатом для этого шага:", reply_markup=markup)
 
         # Mark that we're awaiting step input
-        state['awaiting_step_input'] = True
+        state.awaiting_step_input = True
 
     except Exception as e:
         print(f"Error showing exercise step: {e}")
@@ -695,18 +862,15 @@ async def show_final_questions(bot, chat_id, user_id):
         state = user_exercise_states[user_id]
         
         # Check for crisis indicators in all step results
-        from safety_check import check_text_safety, show_crisis_support, log_crisis_detection
-        from greeting import user_states
-        
         # Combine all step results for safety check
         all_step_results = []
-        for step_result in state.get('step_results', {}).values():
+        for step_result in state.step_results.values():
             if step_result:
                 all_step_results.append(step_result)
         
         # Also check pending step result if exists
-        if state.get('pending_step_result'):
-            all_step_results.append(state['pending_step_result'])
+        if state.pending_step_result:
+            all_step_results.append(state.pending_step_result)
         
         if all_step_results:
             combined_text = " ".join(all_step_results)
@@ -718,7 +882,7 @@ async def show_final_questions(bot, chat_id, user_id):
             
             if crisis_detected and crisis_type:
                 # Log crisis detection
-                username = state.get('username', 'Unknown')
+                username = state.username
                 await log_crisis_detection(
                     user_id=user_id,
                     username=username,
@@ -744,8 +908,8 @@ async def show_final_questions(bot, chat_id, user_id):
                 )
                 return
         
-        state['current_final_question'] = 0
-        state['final_answers'] = {}
+        state.current_final_question = 0
+        state.final_answers = {}
 
         # Show first question
         await show_final_question(bot, chat_id, user_id)
@@ -763,25 +927,18 @@ async def show_final_question(bot, chat_id, user_id):
             return
 
         state = user_exercise_states[user_id]
-        question_idx = state['current_final_question']
+        question_idx = state.current_final_question
 
-        questions = [
-            "Какой инсайт ты получил?",
-            "Что было полезно?",
-            "Что вызвало трудность?"
-        ]
-
-        if question_idx >= len(questions):
+        if question_idx >= len(FINAL_QUESTIONS):
             # All questions answered - show completion options
             await show_exercise_completion_options(bot, chat_id, user_id)
             return
 
-        question = questions[question_idx]
-        from universal_menu import get_menu_button
+        question = FINAL_QUESTIONS[question_idx]
         markup = get_menu_button()
         await bot.send_message(chat_id, question, reply_markup=markup)
 
-        state['awaiting_final_answer'] = True
+        state.awaiting_final_answer = True
 
     except Exception as e:
         print(f"Error showing final question: {e}")
@@ -822,22 +979,19 @@ async def finish_exercise(bot, chat_id, user_id):
             return
 
         state = user_exercise_states[user_id]
-        username = state.get('username', 'Unknown')
-        selected_exercise = state['selected_exercise']
-        first_problem = list(state['problems'].keys())[0]
-        first_rating = state['problems'][first_problem]
+        username = state.username
+        selected_exercise = state.selected_exercise
+        first_problem = list(state.problems.keys())[0]
+        first_rating = state.problems[first_problem]
 
-        insight = state['final_answers'].get(0, '')
-        useful = state['final_answers'].get(1, '')
-        difficulty = state['final_answers'].get(2, '')
+        insight = state.final_answers.get(0, '')
+        useful = state.final_answers.get(1, '')
+        difficulty = state.final_answers.get(2, '')
 
         # Save final answers
         save_exercise_final_answers_to_excel(user_id, username, selected_exercise, first_problem, first_rating, insight, useful, difficulty)
 
         # Check for crisis indicators in final answers
-        from safety_check import check_text_safety, show_crisis_support, log_crisis_detection
-        from greeting import user_states
-
         # Combine all final answers for safety check
         all_answers = f"{insight} {useful} {difficulty}"
 
@@ -896,19 +1050,15 @@ async def show_next_exercise_options(bot, chat_id, user_id):
             return
 
         state = user_exercise_states[user_id]
-        exercises = state.get('exercises', [])
-        current_exercise = state.get('selected_exercise')
-
-        # Track completed exercises in state
-        if 'completed_exercises' not in state:
-            state['completed_exercises'] = []
+        exercises = state.exercises
+        current_exercise = state.selected_exercise
 
         # Mark current exercise as completed
-        if current_exercise and current_exercise not in state['completed_exercises']:
-            state['completed_exercises'].append(current_exercise)
+        if current_exercise:
+            state.completed_exercises.add(current_exercise)
 
         # Find remaining exercises
-        remaining_exercises = [ex for ex in exercises if ex not in state['completed_exercises']]
+        remaining_exercises = [ex for ex in exercises if ex not in state.completed_exercises]
 
         if remaining_exercises:
             # Show remaining exercises
@@ -919,18 +1069,11 @@ async def show_next_exercise_options(bot, chat_id, user_id):
 
             # Display each remaining exercise with selection button
             for idx, exercise in enumerate(exercises):
-                if exercise not in state['completed_exercises']:
-                    # Get exercise goal
-                    goal = extract_exercise_goal(exercise)
+                if exercise not in state.completed_exercises:
+                    # Create card text (same as on the recommendation cards)
+                    goal_clean = get_exercise_card_goal(exercise)
                     emoji = EXERCISE_EMOJIS[exercises.index(exercise) % len(EXERCISE_EMOJIS)]
-
-                    # Create card text
-                    if goal:
-                        goal_clean = re.sub(r'\s*·\s*Время:\s*\d+–\d+\s*мин\.', '', goal)
-                        goal_clean = goal_clean.strip()
-                        card_text = f"{emoji} {exercise}\n{goal_clean}" if goal_clean else f"{emoji} {exercise}"
-                    else:
-                        card_text = f"{emoji} {exercise}"
+                    card_text = f"{emoji} {exercise}\n{goal_clean}" if goal_clean else f"{emoji} {exercise}"
 
                     # Create button
                     markup = types.InlineKeyboardMarkup()
@@ -990,7 +1133,7 @@ def validate_exercise_text(text):
         else:
             return False, "Спасибо за ответ! 🙏 Но давай углубимся. Расскажи подробнее:\n• Что делал(а)?\n• Что почувствовал(а)?\n• Какие выводы?"
 
-    meaningful_chars = sum(1 for c in text if c.isalpha())
+    meaningful_chars = len(LETTER_RE.findall(text))
     if meaningful_chars < 10:
         return False, "Твой ответ кажется очень коротким 📝 Давай расширим:\n• Как прошло упражнение?\n• Что изменилось в ощущениях?\n• Есть ли результат?"
 
@@ -1012,18 +1155,18 @@ async def handle_exercise_text_input(bot, message):
         state = user_exercise_states[user_id]
 
         # Check if awaiting step input
-        if state.get('awaiting_step_input'):
+        if state.awaiting_step_input:
             await handle_step_input(bot, message, user_id, username, text, state)
             return
 
         # Check if awaiting final answer
-        if state.get('awaiting_final_answer'):
+        if state.awaiting_final_answer:
             await handle_final_answer_input(bot, message, user_id, username, text, state)
             return
 
         # Legacy: handle exercise text input (backward compatibility)
-        if state.get('awaiting_exercise_text'):
-            selected_exercise = state['selected_exercise']
+        if state.awaiting_exercise_text:
+            selected_exercise = state.selected_exercise
 
             # Validate input
             is_valid, feedback = validate_exercise_text(text)
@@ -1033,7 +1176,7 @@ async def handle_exercise_text_input(bot, message):
                 return
 
             # Store text temporarily
-            state['pending_exercise_text'] = text
+            state.pending_exercise_text = text
 
             # Show preview
             preview_text = f"📝 Вот что ты написал(а):\n\n{text}\n\nВсё верно?"
@@ -1077,15 +1220,11 @@ async def handle_step_input(bot, message, user_id, username, text, state):
         is_valid, feedback = validate_exercise_text(text)
 
         if not is_valid:
-            from universal_menu import get_menu_button
             markup = get_menu_button()
             await bot.send_message(message.chat.id, feedback, reply_markup=markup)
             return
 
         # Check for crisis indicators in step input
-        from safety_check import check_text_safety, show_crisis_support, log_crisis_detection
-        from greeting import user_states
-
         crisis_detected, crisis_type, confidence = await check_text_safety(
             text=text,
             context="exercise"
@@ -1119,7 +1258,7 @@ async def handle_step_input(bot, message, user_id, username, text, state):
             return
 
         # Store step result temporarily
-        state['pending_step_result'] = text
+        state.pending_step_result = text
 
         # Show preview
         preview_text = f"📝 Вот что ты написал(а):\n\n{text}\n\nВсё верно?"
@@ -1163,15 +1302,11 @@ async def handle_final_answer_input(bot, message, user_id, username, text, state
         is_valid, feedback = validate_exercise_text(text)
 
         if not is_valid:
-            from universal_menu import get_menu_button
             markup = get_menu_button()
             await bot.send_message(message.chat.id, feedback, reply_markup=markup)
             return
 
         # Check for crisis indicators in final answer
-        from safety_check import check_text_safety, show_crisis_support, log_crisis_detection
-        from greeting import user_states
-
         crisis_detected, crisis_type, confidence = await check_text_safety(
             text=text,
             context="exercise"
@@ -1205,7 +1340,7 @@ async def handle_final_answer_input(bot, message, user_id, username, text, state
             return
 
         # Store answer temporarily
-        state['pending_final_answer'] = text
+        state.pending_final_answer = text
 
         # Show preview
         preview_text = f"📝 Вот что ты написал(а):\n\n{text}\n\nВсё верно?"
@@ -1249,11 +1384,11 @@ async def handle_exercise_text_confirm(bot, callback_query, action):
             return
 
         state = user_exercise_states[user_id]
-        pending_text = state.get('pending_exercise_text')
+        pending_text = state.pending_exercise_text
 
         if action == "yes":
             # Save the text
-            selected_exercise = state['selected_exercise']
+            selected_exercise = state.selected_exercise
             save_exercise_text_to_excel(user_id, username, selected_exercise, pending_text)
 
             await bot.answer_callback_query(callback_query.id, "Спасибо! Сохранено.")
@@ -1265,8 +1400,6 @@ async def handle_exercise_text_confirm(bot, callback_query, action):
             )
 
             # Show main menu
-            from universal_menu import show_main_menu
-            from greeting import user_states
 
             user_name = 'User'
             form_of_address = 'ты'
@@ -1280,7 +1413,7 @@ async def handle_exercise_text_confirm(bot, callback_query, action):
 
         elif action == "edit":
             # Ask to re-enter
-            state['pending_exercise_text'] = None
+            state.pending_exercise_text = None
             await bot.answer_callback_query(callback_query.id)
             await bot.send_message(
                 chat_id,
@@ -1292,8 +1425,6 @@ async def handle_exercise_text_confirm(bot, callback_query, action):
             await bot.answer_callback_query(callback_query.id)
             del user_exercise_states[user_id]
 
-            from universal_menu import show_main_menu
-            from greeting import user_states
 
             user_name = 'User'
             form_of_address = 'ты'
@@ -1322,17 +1453,17 @@ async def handle_step_confirm(bot, callback_query, action):
             return
 
         state = user_exercise_states[user_id]
-        pending_result = state.get('pending_step_result')
+        pending_result = state.pending_step_result
 
         if action == "yes":
             # Save the step result to Excel
-            current_idx = state['current_step_idx']
-            steps = state['steps']
+            current_idx = state.current_step_idx
+            steps = state.steps
             step_num, step_text = steps[current_idx]
 
-            selected_exercise = state['selected_exercise']
-            first_problem = list(state['problems'].keys())[0]
-            first_rating = state['problems'][first_problem]
+            selected_exercise = state.selected_exercise
+            first_problem = list(state.problems.keys())[0]
+            first_rating = state.problems[first_problem]
 
             save_exercise_step_to_excel(
                 user_id, username, selected_exercise, first_problem, first_rating,
@@ -1340,21 +1471,21 @@ async def handle_step_confirm(bot, callback_query, action):
             )
 
             # Store step result for safety checking
-            state['step_results'][current_idx] = pending_result
+            state.step_results[current_idx] = pending_result
 
             await bot.answer_callback_query(callback_query.id, "Спасибо! Сохранено.")
 
             # Move to next step
-            state['current_step_idx'] += 1
-            state['awaiting_step_input'] = False
-            state['pending_step_result'] = None
+            state.current_step_idx += 1
+            state.awaiting_step_input = False
+            state.pending_step_result = None
 
             # Show next step or final questions
             await show_exercise_step(bot, chat_id, user_id)
 
         elif action == "edit":
             # Ask to re-enter
-            state['pending_step_result'] = None
+            state.pending_step_result = None
             await bot.answer_callback_query(callback_query.id)
             await bot.send_message(
                 chat_id,
@@ -1363,28 +1494,27 @@ async def handle_step_confirm(bot, callback_query, action):
 
         elif action == "back":
             # Go back to previous step
-            if state['current_step_idx'] > 0:
-                state['current_step_idx'] -= 1
-                state['awaiting_step_input'] = False
-                state['pending_step_result'] = None
+            if state.current_step_idx > 0:
+                state.current_step_idx -= 1
+                state.awaiting_step_input = False
+                state.pending_step_result = None
 
                 await bot.answer_callback_query(callback_query.id)
                 await show_exercise_step(bot, chat_id, user_id)
             else:
                 # No previous step - return to exercise selection
                 await bot.answer_callback_query(callback_query.id)
-                state['selected_exercise'] = None
-                state['awaiting_step_input'] = False
+                state.selected_exercise = None
+                state.awaiting_step_input = False
 
                 # Re-show exercise recommendations
-                from greeting import user_states
                 user_name = user_states.get(user_id, {}).get('user_name', 'User')
 
                 header_text = "Выбери другое упражнение:"
                 await bot.send_message(chat_id, header_text)
 
-                for idx, exercise in enumerate(state['exercises']):
-                    goal = extract_exercise_goal(exercise)
+                for idx, exercise in enumerate(state.exercises):
+                    goal = get_exercise_goal(exercise)
                     emoji = EXERCISE_EMOJIS[idx % len(EXERCISE_EMOJIS)]
 
                     if goal:
@@ -1420,26 +1550,26 @@ async def handle_answer_confirm(bot, callback_query, action):
             return
 
         state = user_exercise_states[user_id]
-        pending_answer = state.get('pending_final_answer')
-        question_idx = state['current_final_question']
+        pending_answer = state.pending_final_answer
+        question_idx = state.current_final_question
 
         if action == "yes":
             # Save the answer
-            state['final_answers'][question_idx] = pending_answer
+            state.final_answers[question_idx] = pending_answer
 
             await bot.answer_callback_query(callback_query.id, "Спасибо! Записано.")
 
             # Move to next final question
-            state['current_final_question'] += 1
-            state['awaiting_final_answer'] = False
-            state['pending_final_answer'] = None
+            state.current_final_question += 1
+            state.awaiting_final_answer = False
+            state.pending_final_answer = None
 
             # Show next question or finish
             await show_final_question(bot, chat_id, user_id)
 
         elif action == "edit":
             # Ask to re-enter
-            state['pending_final_answer'] = None
+            state.pending_final_answer = None
             await bot.answer_callback_query(callback_query.id)
             await bot.send_message(
                 chat_id,
@@ -1487,15 +1617,15 @@ async def handle_exercise_change_select(bot, callback_query):
             return
 
         state = user_exercise_states[user_id]
-        state['selected_exercise'] = None
+        state.selected_exercise = None
 
         await bot.answer_callback_query(callback_query.id)
 
         header_text = "Выбери другое упражнение:"
         await bot.send_message(chat_id, header_text)
 
-        for idx, exercise in enumerate(state['exercises']):
-            goal = extract_exercise_goal(exercise)
+        for idx, exercise in enumerate(state.exercises):
+            goal = get_exercise_goal(exercise)
             emoji = EXERCISE_EMOJIS[idx % len(EXERCISE_EMOJIS)]
 
             if goal:
@@ -1533,26 +1663,24 @@ async def handle_exercise_continue_after_safety(bot, callback_query):
         await bot.answer_callback_query(callback_query.id)
 
         # Determine where to continue based on current state
-        if state.get('awaiting_step_input'):
+        if state.awaiting_step_input:
             # Continue with current step
-            current_idx = state.get('current_step_idx', 0)
-            steps = state.get('steps', [])
+            current_idx = state.current_step_idx
+            steps = state.steps
             if current_idx < len(steps):
                 step_num, step_text = steps[current_idx]
                 step_message = f"Шаг {current_idx + 1} из {len(steps)}:\n\n{step_text}"
                 await bot.send_message(chat_id, step_message)
                 
-                from universal_menu import get_menu_button
                 markup = get_menu_button()
                 await bot.send_message(chat_id, "Поделись результатом для этого шага:", reply_markup=markup)
         
-        elif state.get('awaiting_final_answer'):
+        elif state.awaiting_final_answer:
             # Continue with final questions
             await show_final_question(bot, chat_id, user_id)
         
-        elif state.get('awaiting_exercise_text'):
+        elif state.awaiting_exercise_text:
             # Continue with exercise text input
-            from universal_menu import get_menu_button
             markup = get_menu_button()
             await bot.send_message(chat_id, "Поделись результатом упражнения:", reply_markup=markup)
         
@@ -1561,8 +1689,8 @@ async def handle_exercise_continue_after_safety(bot, callback_query):
             header_text = "Выбери упражнение:"
             await bot.send_message(chat_id, header_text)
 
-            for idx, exercise in enumerate(state.get('exercises', [])):
-                goal = extract_exercise_goal(exercise)
+            for idx, exercise in enumerate(state.exercises):
+                goal = get_exercise_goal(exercise)
                 emoji = EXERCISE_EMOJIS[idx % len(EXERCISE_EMOJIS)]
 
                 if goal:
@@ -7,6 +7,7 @@ Handles 3-step goal and problem identification process
 import os
 import re
 from datetime import datetime
+from functools import lru_cache
 from telebot import types
 from openpyxl import load_workbook, Workbook
 
@@ -38,6 +39,51 @@ PROBLEMS = [
     ("➕ Другая проблема", "other"),
 ]
 
+# Problem id -> display name (callback data carries the id)
+PROBLEM_NAMES_BY_ID = {problem_id: display_name for display_name, problem_id in PROBLEMS}
+
+# Problem selection buttons are immutable - built once, markups are assembled from them
+# Format: ((display_name, plain_button, selected_button), ...)
+PROBLEM_BUTTONS = tuple(
+    (
+        display_name,
+        types.InlineKeyboardButton(display_name, callback_data=f"prob_select:{problem_id}"),
+        types.InlineKeyboardButton(f"✅ {display_name}", callback_data=f"prob_select:{problem_id}")
+    )
+    for display_name, problem_id in PROBLEMS
+)
+BTN_PROBLEMS_CONTINUE = types.InlineKeyboardButton("➡️ Продолжить", callback_data="prob_done:proceed")
+BTN_MENU = types.InlineKeyboardButton("📱 Главное меню", callback_data="menu:show")
+
+
+# Problem display name -> bit in the selection mask
+PROBLEM_BITS = {display_name: 1 << i for i, (display_name, _) in enumerate(PROBLEMS)}
+
+
+@lru_cache(maxsize=512)
+def build_problem_selection_markup_for_mask(selected_mask):
+    """Problem selection keyboard for a bitmask of selected problems (cached - markups are shared)"""
+    # Problem buttons one per row for clarity, then continue and menu buttons
+    keyboard = [
+        [selected_button if selected_mask & (1 << i) else plain_button]
+        for i, (_, plain_button, selected_button) in enumerate(PROBLEM_BUTTONS)
+    ]
+    keyboard.append([BTN_PROBLEMS_CONTINUE])
+    keyboard.append([BTN_MENU])
+    return types.InlineKeyboardMarkup(keyboard=keyboard)
+
+
+def build_problem_selection_markup(selected_problems=()):
+    """Problem selection keyboard with checkmarks for selected problems"""
+    selected_mask = 0
+    for problem in selected_problems:
+        selected_mask |= PROBLEM_BITS.get(problem, 0)
+    return build_problem_selection_markup_for_mask(selected_mask)
+
+
+# Initial problem selection keyboard never changes - shared by all users
+PROBLEM_SELECTION_MARKUP = build_problem_selection_markup()
+
 
 def save_goal_results_to_excel(user_id, username, goal, problems, ratings):
     """Save goal-setting results to Excel file"""
@@ -66,7 +112,7 @@ def save_goal_results_to_excel(user_id, username, goal, problems, ratings):
 
         ws[f'D{next_row}'] = f"Problems: {'; '.join(problems_with_ratings)}"
         ws[f'E{next_row}'] = 'goal_setting'
-        ws[f'G{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ws[f'G{next_row}'] = datetime.now().isoformat(sep=' ', timespec='seconds')
 
         wb.save(EXCEL_FILE)
         print(f"Goal setting saved: {username} - Goal: {goal}, Problems: {len(problems)}")
@@ -365,31 +411,7 @@ async def show_problem_selection(bot, chat_id, user_id):
 
         text = "Выбери проблемы, над которыми хочешь работать (можно несколько):"
 
-        markup = types.InlineKeyboardMarkup()
-
-        # Add problem buttons one per row for clarity
-        for display_name, problem_id in PROBLEMS:
-            btn = types.InlineKeyboardButton(
-                display_name,
-                callback_data=f"prob_select:{problem_id}"
-            )
-            markup.add(btn)
-
-        # Add continue button
-        btn_continue = types.InlineKeyboardButton(
-            "➡️ Продолжить",
-            callback_data="prob_done:proceed"
-        )
-        markup.add(btn_continue)
-
-        # Add menu button for accessibility
-        btn_menu = types.InlineKeyboardButton(
-            "📱 Главное меню",
-            callback_data="menu:show"
-        )
-        markup.add(btn_menu)
-
-        await bot.send_message(chat_id, text, reply_markup=markup)
+        await bot.send_message(chat_id, text, reply_markup=PROBLEM_SELECTION_MARKUP)
 
     except Exception as e:
         print(f"Error showing problem selection: {e}")
@@ -428,11 +450,7 @@ async def handle_problem_selection(bot, callback_query, problem_id):
             return
 
         # Find the problem display name
-        problem_display = None
-        for display_name, p_id in PROBLEMS:
-            if p_id == problem_id:
-                problem_display = display_name
-                break
+        problem_display = PROBLEM_NAMES_BY_ID.get(problem_id)
 
         if problem_display is None:
             return
@@ -450,33 +468,8 @@ async def handle_problem_selection(bot, callback_query, problem_id):
             for prob in state['problems']:
                 text += f"• {prob}\n"
 
-        markup = types.InlineKeyboardMarkup()
-
-        # Add problem buttons with checkmarks for selected ones
-        for display_name, p_id in PROBLEMS:
-            if display_name in state['problems']:
-                btn_text = f"✅ {display_name}"
-            else:
-                btn_text = display_name
-            btn = types.InlineKeyboardButton(
-                btn_text,
-                callback_data=f"prob_select:{p_id}"
-            )
-            markup.add(btn)
-
-        # Add continue button
-        btn_continue = types.InlineKeyboardButton(
-            "➡️ Продолжить",
-            callback_data="prob_done:proceed"
-        )
-        markup.add(btn_continue)
-
-        # Add menu button
-        btn_menu = types.InlineKeyboardButton(
-            "📱 Главное меню",
-            callback_data="menu:show"
-        )
-        markup.add(btn_menu)
+        # Problem buttons with checkmarks for selected ones
+        markup = build_problem_selection_markup(state['problems'])
 
         # Update the message with new markup
         await bot.edit_message_text(
@@ -598,11 +591,12 @@ async def handle_problem_rating(bot, callback_query, problem_idx, rating):
             return
 
         state = user_goal_states[user_id]
+        problem_idx = int(problem_idx)
 
-        if state['step'] != 3 or state['current_problem_idx'] != int(problem_idx):
+        if state['step'] != 3 or state['current_problem_idx'] != problem_idx:
             return
 
-        problem = state['problems'][int(problem_idx)]
+        problem = state['problems'][problem_idx]
         rating_value = int(rating)
 
         # Store rating
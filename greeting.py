@@ -71,15 +71,14 @@ def save_form_of_address_to_excel(user_id, username, form_of_address):
             wb = load_workbook(EXCEL_FILE)
             ws = wb.active
 
-        # Find next empty row
-        next_row = ws.max_row + 1
-
-        # Add form of address data
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'F{next_row}'] = form_of_address
-        ws[f'E{next_row}'] = 'form_of_address_choice'
-        ws[f'H{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Add form of address data as the next row
+        ws.append({
+            'A': user_id,
+            'B': username,
+            'E': 'form_of_address_choice',
+            'F': form_of_address,
+            'H': datetime.now().isoformat(sep=' ', timespec='seconds')
+        })
 
         # Save workbook
         wb.save(EXCEL_FILE)
@@ -123,7 +122,7 @@ def save_user_name_to_excel(user_id, username, user_name):
                 ws[f'C{row}'] = user_name
                 ws[f'D{row}'] = f"User provided name: {user_name}"
                 ws[f'E{row}'] = 'name_input'
-                ws[f'H{row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                ws[f'H{row}'] = datetime.now().isoformat(sep=' ', timespec='seconds')
                 break
 
         # Save workbook
@@ -412,3 +411,11 @@ def reset_user_greeting_state(user_id):
     if user_id in user_states:
         del user_states[user_id]
     print(f"User greeting state reset for user ID: {user_id}")
+
+
+def get_user_name_and_form(user_id):
+    """User's name and form of address from the greeting state ('Друг' and 'ты' until they are chosen)"""
+    state = user_states.get(user_id)
+    if not state:
+        return 'Друг', 'ты'
+    return state.get('user_name', 'Друг'), state.get('form', 'ты')
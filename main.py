@@ -1,8 +1,16 @@
 import asyncio
+import atexit
+import csv
+import logging
+import logging.handlers
 import os
 import io
+import queue
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from telebot.async_telebot import AsyncTeleBot
+from telebot import asyncio_helper
 from telebot import types
 import speech_recognition as sr
 from pydub import AudioSegment
@@ -15,6 +23,7 @@ from greeting import (
     handle_consent_confirmation,
     handle_ready_to_start,
     reset_user_greeting_state,
+    get_user_name_and_form,
     user_states,
     update_excel_headers
 )
@@ -23,9 +32,36 @@ import universal_menu
 from diary import init_diary_file, handle_diary_entry
 from config import TELEGRAM_API_KEY
 
+# libuv-based event loop (not available on Windows - stock asyncio loop is used there)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Load environment variables
 load_dotenv()
 
+# Telegram HTTP pool: telebot sends every request through one shared aiohttp session
+TELEGRAM_CONNECTION_LIMIT = 100
+TELEGRAM_KEEPALIVE_TIMEOUT = 75  # seconds an idle connection stays open for reuse
+TELEGRAM_DNS_CACHE_TTL = 300  # seconds
+
+
+class TelegramSessionManager(asyncio_helper.SessionManager):
+    """telebot's session manager with a larger pool and longer-lived keep-alive connections"""
+
+    async def create_session(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=TELEGRAM_CONNECTION_LIMIT,
+            keepalive_timeout=TELEGRAM_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=TELEGRAM_DNS_CACHE_TTL,
+            ssl=self.ssl_context
+        ))
+        return self.session
+
+
+asyncio_helper.session_manager = TelegramSessionManager()
+
 # Initialize bot
 bot = AsyncTeleBot(TELEGRAM_API_KEY)
 
@@ -35,6 +71,20 @@ recognizer = sr.Recognizer()
 # Excel file path
 EXCEL_FILE = 'messages.xlsx'
 
+# Incoming messages are appended to a CSV log (cheap per message) and moved into EXCEL_FILE periodically
+MESSAGES_CSV_FILE = 'messages.csv'
+MESSAGES_ROLLUP_INTERVAL = 300  # seconds
+messages_csv_file = None
+messages_csv_writer = None
+
+
+# Columns A-H of messages.xlsx
+MESSAGES_HEADERS = (
+    'User ID', 'Username', 'User Name', 'Message Text', 'Message Type',
+    'Form of Address',  # 'ты' or 'Вы'
+    'Protocol Choice', 'Date Time'
+)
+
 
 def init_excel_file():
     """Initialize Excel file with headers if it doesn't exist"""
@@ -42,47 +92,117 @@ def init_excel_file():
         wb = Workbook()
         ws = wb.active
         ws.title = 'Messages'
-        ws['A1'] = 'User ID'
-        ws['B1'] = 'Username'
-        ws['C1'] = 'User Name'
-        ws['D1'] = 'Message Text'
-        ws['E1'] = 'Message Type'
-        ws['F1'] = 'Form of Address'  # 'ты' or 'Вы'
-        ws['G1'] = 'Protocol Choice'
-        ws['H1'] = 'Date Time'
+        ws.append(MESSAGES_HEADERS)
         wb.save(EXCEL_FILE)
     else:
         # Update headers if file exists but doesn't have new columns
         update_excel_headers()
 
 
+def get_messages_csv_writer():
+    """Open the messages CSV log for appending (once) and return its writer"""
+    global messages_csv_file, messages_csv_writer
+    if messages_csv_file is None:
+        # Line buffered: every message reaches the file immediately
+        messages_csv_file = open(MESSAGES_CSV_FILE, 'a', buffering=1, encoding='utf-8', newline='')
+        messages_csv_writer = csv.writer(messages_csv_file)
+    return messages_csv_writer
+
+
 def save_message_to_excel(username, text, user_id=None, message_type='user_message'):
-    """Save message to Excel file"""
+    """
+    Save message to the messages log
+    Appends one CSV line; rows are moved into messages.xlsx by rollup_messages_to_excel
+    """
     try:
-        # Load existing workbook or create new one
+        get_messages_csv_writer().writerow([
+            user_id if user_id is not None else '',
+            username,
+            text,
+            message_type,
+            datetime.now().isoformat(sep=' ', timespec='seconds')
+        ])
+        print(f"Message logged to {MESSAGES_CSV_FILE}: {username} - {text[:50]}...")
+    except Exception as e:
+        print(f"Error logging message to {MESSAGES_CSV_FILE}: {e}")
+
+
+def rollup_messages_to_excel():
+    """Append messages collected in the CSV log to messages.xlsx and empty the log"""
+    global messages_csv_file, messages_csv_writer
+    try:
+        if not os.path.exists(MESSAGES_CSV_FILE) or os.path.getsize(MESSAGES_CSV_FILE) == 0:
+            return
+
+        if messages_csv_file is not None:
+            messages_csv_file.close()
+            messages_csv_file = None
+            messages_csv_writer = None
+
+        with open(MESSAGES_CSV_FILE, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.reader(f))
+
+        if not os.path.exists(EXCEL_FILE):
+            init_excel_file()
+
+        wb = load_workbook(EXCEL_FILE)
+        ws = wb.active
+        for user_id, username, text, message_type, date_time in rows:
+            ws.append({
+                'A': int(user_id) if user_id else None,
+                'B': username,
+                'D': text,
+                'E': message_type,
+                'H': date_time
+            })
+        wb.save(EXCEL_FILE)
+
+        # Rows are in the workbook now - start a new log
+        open(MESSAGES_CSV_FILE, 'w').close()
+        print(f"Messages rolled up to Excel: {len(rows)} row(s)")
+
+    except Exception as e:
+        print(f"Error rolling up messages to Excel: {e}")
+
+
+# Don't leave logged messages only in the CSV on shutdown
+atexit.register(rollup_messages_to_excel)
+
+
+def export_messages_to_xlsx(output_path):
+    """
+    Write all messages (messages.xlsx rows plus messages not rolled up yet) to a new xlsx file
+    Both workbooks are streamed (read-only / write-only), so memory use doesn't grow with the number of rows
+    """
+    try:
+        export_wb = Workbook(write_only=True)
+        export_ws = export_wb.create_sheet('Messages')
+
         if os.path.exists(EXCEL_FILE):
-            wb = load_workbook(EXCEL_FILE)
-            ws = wb.active
+            source_wb = load_workbook(EXCEL_FILE, read_only=True)
+            for row in source_wb.active.iter_rows(values_only=True):
+                export_ws.append(row)
+            source_wb.close()
         else:
-            init_excel_file()
-            wb = load_workbook(EXCEL_FILE)
-            ws = wb.active
+            export_ws.append(MESSAGES_HEADERS)
 
-        # Find next empty row
-        next_row = ws.max_row + 1
+        if os.path.exists(MESSAGES_CSV_FILE):
+            with open(MESSAGES_CSV_FILE, 'r', encoding='utf-8', newline='') as f:
+                for user_id, username, text, message_type, date_time in csv.reader(f):
+                    export_ws.append([int(user_id) if user_id else None, username, None, text, message_type, None, None, date_time])
 
-        # Add message data with new columns
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'D{next_row}'] = text
-        ws[f'E{next_row}'] = message_type
-        ws[f'H{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        export_wb.save(output_path)
+        print(f"Messages exported to {output_path}")
 
-        # Save workbook
-        wb.save(EXCEL_FILE)
-        print(f"Message saved to Excel: {username} - {text[:50]}...")
     except Exception as e:
-        print(f"Error saving message to Excel: {e}")
+        print(f"Error exporting messages: {e}")
+
+
+async def run_messages_rollup():
+    """Background task: move logged messages into messages.xlsx every MESSAGES_ROLLUP_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(MESSAGES_ROLLUP_INTERVAL)
+        rollup_messages_to_excel()
 
 
 async def process_voice_message(message):
@@ -128,12 +248,7 @@ async def menu_command(message):
     username = message.from_user.username or 'Unknown'
 
     # Get user name and form of address from greeting state or use default
-    from greeting import user_states
-    user_name = 'Друг'
-    form_of_address = 'ты'
-    if user_id in user_states:
-        user_name = user_states[user_id].get('user_name', 'Друг')
-        form_of_address = user_states[user_id].get('form', 'ты')
+    user_name, form_of_address = get_user_name_and_form(user_id)
 
     # Show universal menu
     await universal_menu.show_main_menu(bot, message.chat.id, user_id, username, user_name, form_of_address)
@@ -148,7 +263,9 @@ async def handle_text(message):
     username = message.from_user.username or 'Unknown'
 
     # Check if user is in greeting process (awaiting name input) - MUST BE FIRST
-    if user_id in user_states and user_states[user_id].get('stage') == 'awaiting_name':
+    greeting_state = user_states.get(user_id)
+    awaiting_name = bool(greeting_state) and greeting_state.get('stage') == 'awaiting_name'
+    if awaiting_name:
         # Handle name input for greeting
         success = await handle_name_input(bot, message, user_id, username)
         if success:
@@ -156,22 +273,23 @@ async def handle_text(message):
 
     # Check if user is in diary entry mode
     from diary import user_diary_states
-    if user_id in user_diary_states and user_diary_states[user_id].get('stage') == 'awaiting_text':
+    diary_state = user_diary_states.get(user_id)
+    if diary_state and diary_state.get('stage') == 'awaiting_text':
         # Handle diary entry
         await handle_diary_entry(bot, message)
         return
 
     # Check if user is in "other problem" flow
-    from other_problem import user_other_problem_states, handle_other_problem_text
-    if user_id in user_other_problem_states:
-        handled = await handle_other_problem_text(bot, message)
-        if handled:
-            return
+    # (handle_other_problem_text returns False if the user has no active flow)
+    from other_problem import handle_other_problem_text
+    handled = await handle_other_problem_text(bot, message)
+    if handled:
+        return
 
     # Check if user is in check-in process (steps 1-2)
     from check_in import user_checkin_states, handle_checkin_text_input
-    if user_id in user_checkin_states:
-        state = user_checkin_states[user_id]
+    state = user_checkin_states.get(user_id)
+    if state:
         if state.get('step') in [1, 2]:
             # Handle check-in text input
             await handle_checkin_text_input(bot, message)
@@ -179,9 +297,10 @@ async def handle_text(message):
 
     # Check if user is in goal setting (step 1) - only if not awaiting name
     from goal import user_goal_states
-    if user_id in user_goal_states and user_goal_states[user_id].get('step') == 1:
+    goal_state = user_goal_states.get(user_id)
+    if goal_state and goal_state.get('step') == 1:
         # Make sure we're not in the middle of greeting flow
-        if user_id not in user_states or user_states[user_id].get('stage') != 'awaiting_name':
+        if not awaiting_name:
             print(f"DEBUG: Handling goal text input for user {username}, text: {text}")
             # Handle goal text input
             await goal.handle_goal_text_input(bot, message)
@@ -191,9 +310,9 @@ async def handle_text(message):
 
     # Check if user is in exercise execution mode
     from exercise import user_exercise_states
-    if user_id in user_exercise_states:
-        state = user_exercise_states[user_id]
-        if state.get('awaiting_exercise_text') or state.get('awaiting_step_input') or state.get('awaiting_final_answer'):
+    state = user_exercise_states.get(user_id)
+    if state is not None:
+        if state.awaiting_exercise_text or state.awaiting_step_input or state.awaiting_final_answer:
             # Handle exercise/step/answer text input
             import exercise
             await exercise.handle_exercise_text_input(bot, message)
@@ -201,9 +320,9 @@ async def handle_text(message):
 
     # Check if user is in mindfulness practice mode
     from mvst import user_mvst_states
-    if user_id in user_mvst_states:
-        state = user_mvst_states[user_id]
-        if state.get('awaiting_practice_input') or state.get('awaiting_final_answer'):
+    state = user_mvst_states.get(user_id)
+    if state is not None:
+        if state.awaiting_practice_input or state.awaiting_final_answer:
             # Handle mindfulness practice/answer text input
             import mvst
             await mvst.handle_practice_text_input(bot, message)
@@ -460,64 +579,121 @@ async def handle_exercise_continue(call):
 
 
 # Other problem callbacks
-@bot.callback_query_handler(func=lambda call: call.data.startswith('other_suggest:'))
-async def handle_other_suggest(call):
-    """Handle selection of suggested problem from LLM"""
-    problem_id = call.data.replace('other_suggest:', '')
-    from other_problem import handle_other_problem_callback
-    await handle_other_problem_callback(bot, call, 'other_suggest', problem_id)
+# One handler for the whole flow: the action is the callback data prefix
+OTHER_PROBLEM_CALLBACK_PREFIXES = ('other_suggest:', 'other_custom:', 'other_another:', 'other_done:', 'other_confirm_selected:')
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('other_custom:'))
-async def handle_other_custom(call):
-    """Handle custom problem name request"""
-    data = call.data.replace('other_custom:', '')
+@bot.callback_query_handler(func=lambda call: call.data.startswith(OTHER_PROBLEM_CALLBACK_PREFIXES))
+async def handle_other_problem_buttons(call):
+    """Handle other problem flow buttons (suggestion toggle, custom name, another, done, confirm selected)"""
+    action, _, data = call.data.partition(':')
     from other_problem import handle_other_problem_callback
-    await handle_other_problem_callback(bot, call, 'other_custom', data)
+    await handle_other_problem_callback(bot, call, action, data)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('other_another:'))
-async def handle_other_another(call):
-    """Handle request to add another problem"""
-    data = call.data.replace('other_another:', '')
-    from other_problem import handle_other_problem_callback
-    await handle_other_problem_callback(bot, call, 'other_another', data)
+# Diary callbacks
+@bot.callback_query_handler(func=lambda call: call.data.startswith('diary:'))
+async def handle_diary_callback(call):
+    """Handle diary button clicks"""
+    action = call.data.replace('diary:', '')
+    from diary import DIARY_ACTIONS
 
+    handler = DIARY_ACTIONS.get(action)
+    if handler:
+        await handler(bot, call)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('other_done:'))
-async def handle_other_done(call):
-    """Handle completion of other problem flow"""
-    data = call.data.replace('other_done:', '')
-    from other_problem import handle_other_problem_callback
-    await handle_other_problem_callback(bot, call, 'other_done', data)
 
+def setup_logging():
+    """Route logging records through a queue so formatting and output happen off the event loop"""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('other_confirm_selected:'))
-async def handle_other_confirm_selected(call):
-    """Handle confirmation of selected problem suggestions"""
-    data = call.data.replace('other_confirm_selected:', '')
-    from other_problem import handle_other_problem_callback
-    await handle_other_problem_callback(bot, call, 'other_confirm_selected', data)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
 
 
-# Diary callbacks
-@bot.callback_query_handler(func=lambda call: call.data.startswith('diary:'))
-async def handle_diary_callback(call):
-    """Handle diary button clicks"""
-    action = call.data.replace('diary:', '')
-    from diary import handle_diary_confirm, handle_diary_edit, handle_diary_back
+async def start_metrics_server():
+    """
+    Serve Prometheus metrics on /metrics if METRICS_PORT is set
+    """
+    port = os.getenv('METRICS_PORT')
+    if not port:
+        return
+
+    try:
+        from aiohttp import web
+        import prometheus_client
+
+        async def metrics(request):
+            return web.Response(
+                body=prometheus_client.generate_latest(),
+                headers={'Content-Type': prometheus_client.CONTENT_TYPE_LATEST}
+            )
+
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', int(port)).start()
+        print(f"Metrics server started on port {port}")
+    except Exception as e:
+        print(f"Error starting metrics server: {e}")
+
+
+# Updates the webhook handler has accepted but not processed yet (keeps references to the tasks)
+pending_webhook_updates = set()
+
+
+async def start_webhook_server(webhook_url, secret_token):
+    """
+    Receive updates from Telegram on POST /<secret_token> instead of polling getUpdates
+    Each update is acknowledged right away and processed in the background, so Telegram doesn't retry it
+    """
+    from aiohttp import web
 
-    if action == 'confirm':
-        await handle_diary_confirm(bot, call)
-    elif action == 'edit':
-        await handle_diary_edit(bot, call)
-    elif action == 'back':
-        await handle_diary_back(bot, call)
+    async def handle_update(request):
+        if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return web.Response(status=403)
+
+        try:
+            update = types.Update.de_json(await request.json())
+        except Exception as e:
+            print(f"Error parsing webhook update: {e}")
+            return web.Response(status=400)
+
+        task = asyncio.create_task(bot.process_new_updates([update]))
+        pending_webhook_updates.add(task)
+        task.add_done_callback(pending_webhook_updates.discard)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(f'/{secret_token}', handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = int(os.getenv('WEBHOOK_PORT', '8443'))
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+
+    await bot.set_webhook(url=f"{webhook_url.rstrip('/')}/{secret_token}", secret_token=secret_token)
+    print(f"Webhook server started on port {port}")
+    return runner
 
 
 async def main():
     """Main function to run the bot"""
-    print("Starting bot in polling mode...")
+    setup_logging()
+    # Webhook mode if WEBHOOK_URL (public https address of this server) and WEBHOOK_SECRET are set
+    webhook_url = os.getenv('WEBHOOK_URL')
+    webhook_secret = os.getenv('WEBHOOK_SECRET')
+    print(f"Starting bot in {'webhook' if webhook_url and webhook_secret else 'polling'} mode...")
+
+    # Blocking LLM calls run via asyncio.to_thread and can hold a thread for tens of seconds
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=32))
+
     init_excel_file()
     init_diary_file()
 
@@ -543,8 +719,37 @@ async def main():
     from safety_check import register_safety_handlers
     register_safety_handlers(bot)
 
-    await bot.infinity_polling()
+    # Flush buffered exercise writes and logged messages to Excel in the background
+    # (keep references so the tasks aren't garbage-collected while polling)
+    from exercise import run_exercises_excel_flusher
+    excel_flusher = asyncio.create_task(run_exercises_excel_flusher())
+    messages_rollup = asyncio.create_task(run_messages_rollup())
+
+    # Move logged crisis detections into their Excel files in the background
+    from safety_check import run_crisis_log_flusher
+    crisis_log_flusher = asyncio.create_task(run_crisis_log_flusher())
+
+    # Drop abandoned mindfulness practice sessions
+    from mvst import run_mvst_state_sweeper
+    mvst_sweeper = asyncio.create_task(run_mvst_state_sweeper())
+
+    await start_metrics_server()
+
+    if webhook_url and webhook_secret:
+        webhook_runner = await start_webhook_server(webhook_url, webhook_secret)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await bot.remove_webhook()
+            await webhook_runner.cleanup()
+    else:
+        # A webhook left over from an earlier run would make getUpdates fail
+        await bot.remove_webhook()
+        await bot.infinity_polling()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
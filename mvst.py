@@ -5,11 +5,17 @@ Provides guided mindfulness practices for users with tracking and feedback
 """
 
 import asyncio
+import atexit
+import logging
 import os
+import time
+from dataclasses import dataclass, field
 from datetime import datetime
 from telebot import types
 from openpyxl import load_workbook, Workbook
 
+logger = logging.getLogger(__name__)
+
 # File paths
 MVST_EXCEL_FILE = 'mvst.xlsx'
 
@@ -59,9 +65,96 @@ PRACTICES = [
     }
 ]
 
+# Practice id (callback data) -> practice
+PRACTICES_BY_ID = {practice['id']: practice for practice in PRACTICES}
+
+
+def build_practice_card(practice):
+    """Build (card text, start button markup) for a practice"""
+    card_text = f"{practice['emoji']} {practice['name']}\n{practice['short_name']}\n\n{practice['description']}"
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(
+        f"Начать: {practice['name']}",
+        callback_data=f"mvst_select:{practice['id']}"
+    ))
+    return card_text, markup
+
+
+# Practice cards are static - build them once
+# Format: {practice_id: (card_text, markup)}
+PRACTICE_CARDS = {practice['id']: build_practice_card(practice) for practice in PRACTICES}
+
+# Questions asked after a practice
+FINAL_QUESTIONS = (
+    "Что ты заметил(а) в ходе практики?",
+    "Что было полезно?",
+    "Что вызвало сложности?"
+)
+
+
+def build_preview_markup(callback_prefix, menu_text, with_edit):
+    """Confirm / edit (only when there is text) / menu keyboard shown under an input preview"""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"{callback_prefix}:yes"))
+    if with_edit:
+        markup.add(types.InlineKeyboardButton("✏️ Изменить", callback_data=f"{callback_prefix}:edit"))
+    markup.add(types.InlineKeyboardButton(menu_text, callback_data="menu:show"))
+    return markup
+
+
+# Static keyboards - built once and shared
+# Preview keyboards format: {with_edit: markup}
+PRACTICE_INPUT_PREVIEW_MARKUPS = {
+    with_edit: build_preview_markup("mvst_input_confirm", "📍 Главное меню", with_edit)
+    for with_edit in (True, False)
+}
+FINAL_ANSWER_PREVIEW_MARKUPS = {
+    with_edit: build_preview_markup("mvst_answer_confirm", "📍 Меню", with_edit)
+    for with_edit in (True, False)
+}
+MENU_MARKUP = types.InlineKeyboardMarkup()
+MENU_MARKUP.add(types.InlineKeyboardButton("📍 Главное меню", callback_data="menu:show"))
+
+
+@dataclass(slots=True)
+class MvstState:
+    """Per-user state of a mindfulness practice session"""
+    practices: list = field(default_factory=lambda: PRACTICES)
+    selected_practice: dict = None
+    username: str = 'Unknown'
+    completed_practices: set = field(default_factory=set)  # practice ids
+    current_step: str = 'selection'  # selection, practice, questions, completion
+    # Input during practice
+    awaiting_practice_input: bool = False
+    pending_practice_input: str = None
+    # Final questions
+    current_final_question: int = 0
+    final_answers: dict = field(default_factory=dict)  # {question_idx: answer}
+    awaiting_final_answer: bool = False
+    pending_final_answer: str = None
+    last_touch: float = field(default_factory=time.monotonic)  # time of last user action
+
+
 # Store user mindfulness states
+# Format: {user_id: MvstState}
 user_mvst_states = {}
 
+# Sessions are never closed explicitly - abandoned ones are evicted after MVST_STATE_TTL
+MVST_STATE_TTL = 1800  # seconds
+MVST_SWEEP_INTERVAL = 300  # seconds
+
+
+async def run_mvst_state_sweeper():
+    """Background task: evict practice sessions without user actions for MVST_STATE_TTL"""
+    while True:
+        await asyncio.sleep(MVST_SWEEP_INTERVAL)
+        now = time.monotonic()
+        expired = [user_id for user_id, state in user_mvst_states.items() if now - state.last_touch > MVST_STATE_TTL]
+        for user_id in expired:
+            del user_mvst_states[user_id]
+        if expired:
+            logger.info("Evicted %d inactive mindfulness session(s)", len(expired))
+
 
 def init_mvst_excel():
     """Initialize MVST Excel file with headers"""
@@ -91,20 +184,21 @@ def save_practice_to_excel(user_id, username, practice_name, practice_type):
         wb = load_workbook(MVST_EXCEL_FILE)
         ws = wb.active
 
-        next_row = ws.max_row + 1
-
-        ws[f'A{next_row}'] = user_id
-        ws[f'B{next_row}'] = username
-        ws[f'C{next_row}'] = practice_name
-        ws[f'D{next_row}'] = practice_type
-        ws[f'E{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ws[f'J{next_row}'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        now = datetime.now().isoformat(sep=' ', timespec='seconds')
+        ws.append({
+            'A': user_id,
+            'B': username,
+            'C': practice_name,
+            'D': practice_type,
+            'E': now,
+            'J': now
+        })
 
         wb.save(MVST_EXCEL_FILE)
-        print(f"Practice saved: {username} - {practice_name}")
+        logger.info("Practice saved: %s - %s", username, practice_name)
 
-    except Exception as e:
-        print(f"Error saving practice to Excel: {e}")
+    except Exception:
+        logger.exception("Error saving practice to Excel")
 
 
 def save_practice_user_input_to_excel(user_id, practice_name, user_input):
@@ -124,10 +218,10 @@ def save_practice_user_input_to_excel(user_id, practice_name, user_input):
                 break
 
         wb.save(MVST_EXCEL_FILE)
-        print(f"Practice user input saved: {practice_name}")
+        logger.info("Practice user input saved: %s", practice_name)
 
-    except Exception as e:
-        print(f"Error saving practice user input to Excel: {e}")
+    except Exception:
+        logger.exception("Error saving practice user input to Excel")
 
 
 def save_practice_final_answers_to_excel(user_id, practice_name, noticed, useful, difficult):
@@ -149,10 +243,49 @@ def save_practice_final_answers_to_excel(user_id, practice_name, noticed, useful
                 break
 
         wb.save(MVST_EXCEL_FILE)
-        print(f"Practice final answers saved: {practice_name}")
+        logger.info("Practice final answers saved: %s", practice_name)
+
+    except Exception:
+        logger.exception("Error saving practice final answers to Excel")
+
+
+# Excel writes go through one background writer: handlers don't wait for openpyxl,
+# and appends/updates of mvst.xlsx never run concurrently
+# Format: (save_function, args)
+mvst_excel_queue = None
+mvst_excel_writer = None
+
 
-    except Exception as e:
-        print(f"Error saving practice final answers to Excel: {e}")
+def queue_mvst_excel_write(save_function, *args):
+    """Queue an mvst.xlsx write (runs in order in a worker thread)"""
+    global mvst_excel_queue, mvst_excel_writer
+    if mvst_excel_queue is None:
+        mvst_excel_queue = asyncio.Queue()
+        mvst_excel_writer = asyncio.create_task(run_mvst_excel_writer())
+    mvst_excel_queue.put_nowait((save_function, args))
+
+
+async def run_mvst_excel_writer():
+    """Background task: perform queued mvst.xlsx writes one at a time"""
+    while True:
+        save_function, args = await mvst_excel_queue.get()
+        # save_* functions catch and print their own errors
+        await asyncio.to_thread(save_function, *args)
+        mvst_excel_queue.task_done()
+
+
+def drain_mvst_excel_queue():
+    """Perform writes still queued when the bot stops (the writer task is cancelled on shutdown)"""
+    if mvst_excel_queue is None:
+        return
+    while not mvst_excel_queue.empty():
+        save_function, args = mvst_excel_queue.get_nowait()
+        save_function(*args)
+        mvst_excel_queue.task_done()
+
+
+# Don't lose queued practice records on shutdown
+atexit.register(drain_mvst_excel_queue)
 
 
 async def show_mindfulness_practices(bot, chat_id, user_id, username):
@@ -161,13 +294,7 @@ async def show_mindfulness_practices(bot, chat_id, user_id, username):
     """
     try:
         # Initialize user state
-        user_mvst_states[user_id] = {
-            'practices': PRACTICES,
-            'selected_practice': None,
-            'username': username,
-            'completed_practices': [],
-            'current_step': 'selection'  # selection, practice, questions, completion
-        }
+        user_mvst_states[user_id] = MvstState(username=username)
 
         header_text = "🌙 Майндфулнесс-практика (MBCT)\n\nВыбери практику для начала:"
         await bot.send_message(chat_id, header_text)
@@ -176,17 +303,7 @@ async def show_mindfulness_practices(bot, chat_id, user_id, username):
         await asyncio.sleep(1)
 
         # Show practice cards
-        for practice in PRACTICES:
-            emoji = practice['emoji']
-            card_text = f"{emoji} {practice['name']}\n{practice['short_name']}\n\n{practice['description']}"
-
-            markup = types.InlineKeyboardMarkup()
-            btn_start = types.InlineKeyboardButton(
-                f"Начать: {practice['name']}",
-                callback_data=f"mvst_select:{practice['id']}"
-            )
-            markup.add(btn_start)
-
+        for card_text, markup in PRACTICE_CARDS.values():
             await bot.send_message(chat_id, card_text, reply_markup=markup)
 
         # Add menu button
@@ -194,8 +311,8 @@ async def show_mindfulness_practices(bot, chat_id, user_id, username):
         menu_markup = get_menu_button()
         await bot.send_message(chat_id, "Выбери практику или вернись в меню", reply_markup=menu_markup)
 
-    except Exception as e:
-        print(f"Error showing mindfulness practices: {e}")
+    except Exception:
+        logger.exception("Error showing mindfulness practices")
 
 
 async def handle_practice_select(bot, callback_query, practice_id):
@@ -212,49 +329,39 @@ async def handle_practice_select(bot, callback_query, practice_id):
             return
 
         state = user_mvst_states[user_id]
+        state.last_touch = time.monotonic()
         practice_id = int(practice_id)
 
         # Find selected practice
-        selected_practice = None
-        for practice in state['practices']:
-            if practice['id'] == practice_id:
-                selected_practice = practice
-                break
+        selected_practice = PRACTICES_BY_ID.get(practice_id)
 
         if not selected_practice:
             await bot.answer_callback_query(callback_query.id)
             return
 
-        state['selected_practice'] = selected_practice
-        state['current_step'] = 'practice'
+        state.selected_practice = selected_practice
+        state.current_step = 'practice'
 
         # Save practice selection
-        save_practice_to_excel(user_id, username, selected_practice['name'], selected_practice['short_name'])
+        queue_mvst_excel_write(save_practice_to_excel, user_id, username, selected_practice['name'], selected_practice['short_name'])
 
         await bot.answer_callback_query(callback_query.id)
 
-        # Show practice description
+        # Show practice description and prompt for user input in one message
         emoji = selected_practice['emoji']
-        practice_text = f"{emoji} {selected_practice['name']}\n\n{selected_practice['description']}"
-        await bot.send_message(chat_id, practice_text)
-
-        # Pause for 1 second
-        await asyncio.sleep(1)
-
-        # Show prompt for user input
+        practice_text = (
+            f"{emoji} {selected_practice['name']}\n\n{selected_practice['description']}\n\n"
+            "Поделись, что ты замечаешь во время практики, или просто начни — я помогу тебе дальше:"
+        )
         from universal_menu import get_menu_button
         markup = get_menu_button()
-        await bot.send_message(
-            chat_id,
-            "Поделись, что ты замечаешь во время практики, или просто начни — я помогу тебе дальше:",
-            reply_markup=markup
-        )
+        await bot.send_message(chat_id, practice_text, reply_markup=markup)
 
         # Mark that we're awaiting practice input
-        state['awaiting_practice_input'] = True
+        state.awaiting_practice_input = True
 
-    except Exception as e:
-        print(f"Error handling practice selection: {e}")
+    except Exception:
+        logger.exception("Error handling practice selection")
         await bot.answer_callback_query(callback_query.id)
 
 
@@ -267,15 +374,15 @@ async def show_final_questions(bot, chat_id, user_id):
             return
 
         state = user_mvst_states[user_id]
-        state['current_final_question'] = 0
-        state['final_answers'] = {}
-        state['current_step'] = 'questions'
+        state.current_final_question = 0
+        state.final_answers = {}
+        state.current_step = 'questions'
 
         # Show first question
         await show_final_question(bot, chat_id, user_id)
 
-    except Exception as e:
-        print(f"Error showing final questions: {e}")
+    except Exception:
+        logger.exception("Error showing final questions")
 
 
 async def show_final_question(bot, chat_id, user_id):
@@ -287,28 +394,22 @@ async def show_final_question(bot, chat_id, user_id):
             return
 
         state = user_mvst_states[user_id]
-        question_idx = state['current_final_question']
-
-        questions = [
-            "Что ты заметил(а) в ходе практики?",
-            "Что было полезно?",
-            "Что вызвало сложности?"
-        ]
+        question_idx = state.current_final_question
 
-        if question_idx >= len(questions):
+        if question_idx >= len(FINAL_QUESTIONS):
             # All questions answered - show completion options
             await show_practice_completion_options(bot, chat_id, user_id)
             return
 
-        question = questions[question_idx]
+        question = FINAL_QUESTIONS[question_idx]
         from universal_menu import get_menu_button
         markup = get_menu_button()
         await bot.send_message(chat_id, question, reply_markup=markup)
 
-        state['awaiting_final_answer'] = True
+        state.awaiting_final_answer = True
 
-    except Exception as e:
-        print(f"Error showing final question: {e}")
+    except Exception:
+        logger.exception("Error showing final question")
 
 
 async def show_practice_completion_options(bot, chat_id, user_id):
@@ -331,8 +432,8 @@ async def show_practice_completion_options(bot, chat_id, user_id):
         markup.add(btn_mark_complete)
         await bot.send_message(chat_id, "Отлично! Ты выполнил(а) практику.", reply_markup=markup)
 
-    except Exception as e:
-        print(f"Error showing practice completion options: {e}")
+    except Exception:
+        logger.exception("Error showing practice completion options")
 
 
 async def finish_practice(bot, chat_id, user_id):
@@ -344,21 +445,21 @@ async def finish_practice(bot, chat_id, user_id):
             return
 
         state = user_mvst_states[user_id]
-        username = state.get('username', 'Unknown')
-        selected_practice = state['selected_practice']
+        username = state.username
+        selected_practice = state.selected_practice
 
-        noticed = state['final_answers'].get(0, '')
-        useful = state['final_answers'].get(1, '')
-        difficult = state['final_answers'].get(2, '')
+        noticed = state.final_answers.get(0, '')
+        useful = state.final_answers.get(1, '')
+        difficult = state.final_answers.get(2, '')
 
         # Save final answers
-        save_practice_final_answers_to_excel(user_id, selected_practice['name'], noticed, useful, difficult)
+        queue_mvst_excel_write(save_practice_final_answers_to_excel, user_id, selected_practice['name'], noticed, useful, difficult)
 
         # Show next practice options
         await show_next_practice_options(bot, chat_id, user_id)
 
-    except Exception as e:
-        print(f"Error finishing practice: {e}")
+    except Exception:
+        logger.exception("Error finishing practice")
 
 
 async def show_next_practice_options(bot, chat_id, user_id):
@@ -370,19 +471,15 @@ async def show_next_practice_options(bot, chat_id, user_id):
             return
 
         state = user_mvst_states[user_id]
-        practices = state.get('practices', [])
-        current_practice = state.get('selected_practice')
-
-        # Track completed practices in state
-        if 'completed_practices' not in state:
-            state['completed_practices'] = []
+        practices = state.practices
+        current_practice = state.selected_practice
 
         # Mark current practice as completed
-        if current_practice and current_practice['id'] not in state['completed_practices']:
-            state['completed_practices'].append(current_practice['id'])
+        if current_practice:
+            state.completed_practices.add(current_practice['id'])
 
         # Find remaining practices
-        remaining_practices = [p for p in practices if p['id'] not in state['completed_practices']]
+        remaining_practices = [p for p in practices if p['id'] not in state.completed_practices]
 
         if remaining_practices:
             # Show remaining practices
@@ -393,49 +490,26 @@ async def show_next_practice_options(bot, chat_id, user_id):
 
             # Display each remaining practice with selection button
             for practice in practices:
-                if practice['id'] not in state['completed_practices']:
-                    emoji = practice['emoji']
-                    card_text = f"{emoji} {practice['name']}\n{practice['short_name']}\n\n{practice['description']}"
-
-                    # Create button
-                    markup = types.InlineKeyboardMarkup()
-                    btn_select = types.InlineKeyboardButton(
-                        f"Начать: {practice['name']}",
-                        callback_data=f"mvst_select:{practice['id']}"
-                    )
-                    markup.add(btn_select)
-
+                if practice['id'] not in state.completed_practices:
+                    card_text, markup = PRACTICE_CARDS[practice['id']]
                     await bot.send_message(chat_id, card_text, reply_markup=markup)
 
             # Add final menu button
-            markup_final = types.InlineKeyboardMarkup()
-            btn_menu = types.InlineKeyboardButton(
-                "📍 Главное меню",
-                callback_data="menu:show"
-            )
-            markup_final.add(btn_menu)
             await bot.send_message(
                 chat_id,
                 "Или вернись в главное меню:",
-                reply_markup=markup_final
+                reply_markup=MENU_MARKUP
             )
         else:
             # All practices completed
-            markup = types.InlineKeyboardMarkup()
-            btn_menu = types.InlineKeyboardButton(
-                "📍 Главное меню",
-                callback_data="menu:show"
-            )
-            markup.add(btn_menu)
-
             await bot.send_message(
                 chat_id,
                 "Поздравляю! 🎉 Ты выполнил(а) все практики!",
-                reply_markup=markup
+                reply_markup=MENU_MARKUP
             )
 
-    except Exception as e:
-        print(f"Error showing next practice options: {e}")
+    except Exception:
+        logger.exception("Error showing next practice options")
 
 
 def validate_practice_input(text):
@@ -466,19 +540,20 @@ async def handle_practice_text_input(bot, message):
             return
 
         state = user_mvst_states[user_id]
+        state.last_touch = time.monotonic()
 
         # Check if awaiting practice input
-        if state.get('awaiting_practice_input'):
+        if state.awaiting_practice_input:
             await handle_practice_input(bot, message, user_id, username, text, state)
             return
 
         # Check if awaiting final answer
-        if state.get('awaiting_final_answer'):
+        if state.awaiting_final_answer:
             await handle_final_answer_input(bot, message, user_id, username, text, state)
             return
 
-    except Exception as e:
-        print(f"Error handling practice text input: {e}")
+    except Exception:
+        logger.exception("Error handling practice text input")
 
 
 async def handle_practice_input(bot, message, user_id, username, text, state):
@@ -496,35 +571,17 @@ async def handle_practice_input(bot, message, user_id, username, text, state):
             return
 
         # Store text temporarily
-        state['pending_practice_input'] = text
+        state.pending_practice_input = text
 
         # Show preview
         preview_text = f"📝 Вот что ты написал(а):\n\n{text}\n\nВсё верно?" if text else "Готов(а) продолжить?"
 
-        markup = types.InlineKeyboardMarkup()
-
-        btn_confirm = types.InlineKeyboardButton(
-            "✅ Подтвердить",
-            callback_data="mvst_input_confirm:yes"
-        )
-        btn_edit = types.InlineKeyboardButton(
-            "✏️ Изменить",
-            callback_data="mvst_input_confirm:edit"
-        )
-        btn_menu = types.InlineKeyboardButton(
-            "📍 Главное меню",
-            callback_data="menu:show"
-        )
-
-        markup.add(btn_confirm)
-        if text:
-            markup.add(btn_edit)
-        markup.add(btn_menu)
+        markup = PRACTICE_INPUT_PREVIEW_MARKUPS[bool(text)]
 
         await bot.send_message(message.chat.id, preview_text, reply_markup=markup)
 
-    except Exception as e:
-        print(f"Error handling practice input: {e}")
+    except Exception:
+        logger.exception("Error handling practice input")
 
 
 async def handle_practice_input_confirm(bot, callback_query, action):
@@ -541,33 +598,34 @@ async def handle_practice_input_confirm(bot, callback_query, action):
             return
 
         state = user_mvst_states[user_id]
-        pending_input = state.get('pending_practice_input', '')
+        state.last_touch = time.monotonic()
+        pending_input = state.pending_practice_input or ''
 
         if action == "yes":
             # Save the input if provided
-            selected_practice = state['selected_practice']
+            selected_practice = state.selected_practice
             if pending_input:
-                save_practice_user_input_to_excel(user_id, selected_practice['name'], pending_input)
+                queue_mvst_excel_write(save_practice_user_input_to_excel, user_id, selected_practice['name'], pending_input)
 
             await bot.answer_callback_query(callback_query.id, "Спасибо! Продолжаем.")
 
-            state['awaiting_practice_input'] = False
-            state['pending_practice_input'] = None
+            state.awaiting_practice_input = False
+            state.pending_practice_input = None
 
             # Move to final questions
             await show_final_questions(bot, chat_id, user_id)
 
         elif action == "edit":
             # Ask to re-enter
-            state['pending_practice_input'] = None
+            state.pending_practice_input = None
             await bot.answer_callback_query(callback_query.id)
             await bot.send_message(
                 chat_id,
                 "Окей, введи свой ответ заново или нажми подтвердить для продолжения:"
             )
 
-    except Exception as e:
-        print(f"Error handling practice input confirm: {e}")
+    except Exception:
+        logger.exception("Error handling practice input confirm")
         await bot.answer_callback_query(callback_query.id)
 
 
@@ -586,35 +644,17 @@ async def handle_final_answer_input(bot, message, user_id, username, text, state
             return
 
         # Store answer temporarily
-        state['pending_final_answer'] = text
+        state.pending_final_answer = text
 
         # Show preview
         preview_text = f"📝 Вот что ты написал(а):\n\n{text}\n\nВсё верно?" if text else "Готов(а) продолжить?"
 
-        markup = types.InlineKeyboardMarkup()
-
-        btn_confirm = types.InlineKeyboardButton(
-            "✅ Подтвердить",
-            callback_data="mvst_answer_confirm:yes"
-        )
-        btn_edit = types.InlineKeyboardButton(
-            "✏️ Изменить",
-            callback_data="mvst_answer_confirm:edit"
-        )
-        btn_menu = types.InlineKeyboardButton(
-            "📍 Меню",
-            callback_data="menu:show"
-        )
-
-        markup.add(btn_confirm)
-        if text:
-            markup.add(btn_edit)
-        markup.add(btn_menu)
+        markup = FINAL_ANSWER_PREVIEW_MARKUPS[bool(text)]
 
         await bot.send_message(message.chat.id, preview_text, reply_markup=markup)
 
-    except Exception as e:
-        print(f"Error handling final answer input: {e}")
+    except Exception:
+        logger.exception("Error handling final answer input")
 
 
 async def handle_answer_confirm(bot, callback_query, action):
@@ -631,34 +671,35 @@ async def handle_answer_confirm(bot, callback_query, action):
             return
 
         state = user_mvst_states[user_id]
-        pending_answer = state.get('pending_final_answer', '')
-        question_idx = state['current_final_question']
+        state.last_touch = time.monotonic()
+        pending_answer = state.pending_final_answer or ''
+        question_idx = state.current_final_question
 
         if action == "yes":
             # Save the answer
-            state['final_answers'][question_idx] = pending_answer
+            state.final_answers[question_idx] = pending_answer
 
             await bot.answer_callback_query(callback_query.id, "Спасибо! Записано.")
 
             # Move to next final question
-            state['current_final_question'] += 1
-            state['awaiting_final_answer'] = False
-            state['pending_final_answer'] = None
+            state.current_final_question += 1
+            state.awaiting_final_answer = False
+            state.pending_final_answer = None
 
             # Show next question or finish
             await show_final_question(bot, chat_id, user_id)
 
         elif action == "edit":
             # Ask to re-enter
-            state['pending_final_answer'] = None
+            state.pending_final_answer = None
             await bot.answer_callback_query(callback_query.id)
             await bot.send_message(
                 chat_id,
                 "Окей, введи свой ответ заново:"
             )
 
-    except Exception as e:
-        print(f"Error handling answer confirm: {e}")
+    except Exception:
+        logger.exception("Error handling answer confirm")
         await bot.answer_callback_query(callback_query.id)
 
 
@@ -679,8 +720,8 @@ async def handle_mark_practice_complete(bot, callback_query):
         # Finish the practice (save data)
         await finish_practice(bot, chat_id, user_id)
 
-    except Exception as e:
-        print(f"Error marking practice complete: {e}")
+    except Exception:
+        logger.exception("Error marking practice complete")
         await bot.answer_callback_query(callback_query.id)
 
 
@@ -5,22 +5,138 @@ Provides statistics from exercises and diaries with AI-generated summaries
 """
 
 import os
-import json
+import asyncio
 import hashlib
+import orjson
 from datetime import datetime, timedelta
 import pandas as pd
 from telebot import types
-from openrouter import OpenRouterClient
-from config import MODEL_SIMPLE, TEMPERATURE, TOP_P, TOP_K
-
-# Set pandas options for better handling of Excel files
-pd.set_option('display.max_columns', None)
-pd.set_option('display.max_rows', None)
+from openrouter import get_client
+from config import MODEL_SIMPLE, MODEL_STRUCTURED, TEMPERATURE, TOP_P, TOP_K
 
 # Cache for LLM responses (in memory cache with TTL)
 llm_cache = {}
 CACHE_TTL_HOURS = 24  # Cache for 24 hours
 
+# Below this number of entries a section gets a templated summary instead of an LLM call
+MIN_ENTRIES_FOR_LLM_SUMMARY = 3
+
+SHORT_SUMMARIES = {
+    ('diary', 1): "Есть одна запись в дневнике — это уже хороший старт. Продолжай фиксировать мысли и чувства, так будет легче увидеть динамику.",
+    ('diary', 2): "В дневнике уже две записи — отличное начало. Ещё несколько записей, и можно будет заметить первые закономерности.",
+    ('exercise', 1): "Выполнено первое упражнение — это важный шаг. Продолжай в своём темпе.",
+    ('exercise', 2): "Уже два упражнения позади — ты начинаешь выстраивать регулярную практику."
+}
+
+DEFAULT_MOTIVATIONAL_PHRASE = "Каждый шаг вперед - это твоя победа, продолжай двигаться в своем темпе."
+
+# Characters with special meaning in Telegram legacy Markdown, escaped in one str.translate pass
+MARKDOWN_ESCAPE_TABLE = str.maketrans({c: '\\' + c for c in '_*`['})
+
+# In-flight LLM requests: {cache_key: asyncio.Future}
+llm_in_flight = {}
+
+# Minimum seconds between edits of a streamed message (Telegram edit rate limit)
+STREAM_EDIT_INTERVAL = 1.0
+
+# Only the columns actually used are parsed from the xlsx files
+EXERCISE_COLUMNS = ('User ID', 'Exercise Name', 'Problem', 'Problem Rating', 'Date Time', 'Exercise Text')
+DIARY_COLUMNS = ('User ID', 'User Name', 'Entry Type', 'Entry Text', 'Date Time')
+
+# Column -> (record key, default used when the column is missing)
+EXERCISE_FIELDS = {
+    'Exercise Name': ('name', 'Unknown'),
+    'Problem': ('problem', ''),
+    'Problem Rating': ('rating', 0),
+    'Date Time': ('date', ''),
+    'Exercise Text': ('text', '')
+}
+DIARY_FIELDS = {
+    'Entry Type': ('type', 'Unknown'),
+    'Entry Text': ('text', ''),
+    'Date Time': ('date', '')
+}
+
+# Statistics message sent first in the progress report (Markdown)
+STATS_TEMPLATE = (
+    "📊 **Твой прогресс, {user_name}**\n\n"
+    "📈 **Статистика:**\n"
+    "✅ Выполнено упражнений: {exercise_count}\n"
+    "📖 Записей в дневнике: {diary_count}\n"
+)
+
+
+def escape_markdown(text):
+    """Escape user-provided text for messages sent with parse_mode='Markdown'"""
+    return str(text).translate(MARKDOWN_ESCAPE_TABLE)
+
+
+def select_fields(df, fields):
+    """Keep only the used columns renamed to short keys (missing columns get their defaults)"""
+    missing = {col: default for col, (_, default) in fields.items() if col not in df.columns}
+    if missing:
+        df = df.assign(**missing)
+    return df[list(fields)].rename(columns={col: key for col, (key, _) in fields.items()}).reset_index(drop=True)
+
+
+def format_entry_dates(dates):
+    """Format entry dates column for prompts (dd.mm.yyyy, raw value if it isn't a date)"""
+    parsed = pd.to_datetime(dates, errors='coerce', format='mixed')
+    raw = dates.where(dates.notna(), 'Без даты').astype(str)
+    return parsed.dt.strftime('%d.%m.%Y').where(parsed.notna(), raw)
+
+
+def format_diary_entries(diary_data):
+    """Format diary entries as prompt lines (vectorized over the DataFrame)"""
+    if len(diary_data) == 0:
+        return ""
+    lines = (
+        "\n- " + format_entry_dates(diary_data['date'])
+        + ": [" + diary_data['type'].fillna('').astype(str)
+        + "] " + diary_data['text'].fillna('').astype(str)
+    )
+    return lines.str.cat()
+
+
+def format_exercise_entries(exercise_data):
+    """Format completed exercises as prompt lines (vectorized over the DataFrame)"""
+    if len(exercise_data) == 0:
+        return ""
+    ratings = pd.to_numeric(exercise_data['rating'], errors='coerce').fillna(0).astype(int).astype(str)
+    lines = (
+        "\n- " + format_entry_dates(exercise_data['date'])
+        + ": " + exercise_data['name'].fillna('Упражнение').astype(str)
+        + " для проблемы '" + exercise_data['problem'].fillna('').astype(str)
+        + "' (важность: " + ratings + "/3)"
+    )
+    return lines.str.cat()
+
+
+def get_short_summary(data_type, data):
+    """Templated summary for too few entries (no LLM call), None if LLM analysis is worthwhile"""
+    if len(data) < MIN_ENTRIES_FOR_LLM_SUMMARY:
+        return SHORT_SUMMARIES.get((data_type, len(data)))
+    return None
+
+
+def hash_default(obj):
+    """orjson fallback: nested DataFrames by content hash, anything else via str"""
+    if isinstance(obj, pd.DataFrame):
+        return get_data_hash(obj)
+    return str(obj)
+
+
+def get_data_hash(data):
+    """Fingerprint cache data (orjson serializes straight to bytes, DataFrames are hashed by content)"""
+    if isinstance(data, str):
+        data_bytes = data.encode()
+    elif isinstance(data, pd.DataFrame):
+        data_bytes = pd.util.hash_pandas_object(data, index=False).values.tobytes()
+    else:
+        data_bytes = orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=hash_default)
+    # Full 256-bit digest: a truncated hash could hand one user's summary to another on collision
+    return hashlib.blake2b(data_bytes, digest_size=32).hexdigest()
+
 
 def get_cache_key(user_id, data_type, data_hash):
     """Generate cache key for LLM responses"""
@@ -48,13 +164,13 @@ def set_cached_response(cache_key, response):
 def count_completed_exercises(user_id):
     """
     Count number of completed exercises for a user
-    Returns: tuple (count, list of exercise data)
+    Returns: tuple (count, DataFrame of exercise data)
     """
     try:
         if not os.path.exists('exercises.xlsx'):
-            return 0, []
+            return 0, select_fields(pd.DataFrame(), EXERCISE_FIELDS)
 
-        df = pd.read_excel('exercises.xlsx')
+        df = pd.read_excel('exercises.xlsx', usecols=lambda c: c in EXERCISE_COLUMNS)
 
         # Filter by user_id
         user_exercises = df[df['User ID'] == user_id]
@@ -62,95 +178,61 @@ def count_completed_exercises(user_id):
         # Group by exercise name and get unique exercises
         if len(user_exercises) > 0:
             # Get unique exercise completions
-            exercises_list = []
-            for _, row in user_exercises.iterrows():
-                exercises_list.append({
-                    'name': row.get('Exercise Name', 'Unknown'),
-                    'problem': row.get('Problem', ''),
-                    'rating': row.get('Problem Rating', 0),
-                    'date': row.get('Date Time', ''),
-                    'text': row.get('Exercise Text', '')
-                })
+            exercises_df = select_fields(user_exercises, EXERCISE_FIELDS)
 
             # Count unique exercise names
             unique_exercises = user_exercises['Exercise Name'].nunique() if 'Exercise Name' in user_exercises.columns else len(user_exercises)
-            return unique_exercises, exercises_list
+            return unique_exercises, exercises_df
 
-        return 0, []
+        return 0, select_fields(pd.DataFrame(), EXERCISE_FIELDS)
 
     except Exception as e:
         print(f"Error counting exercises: {e}")
-        return 0, []
+        return 0, select_fields(pd.DataFrame(), EXERCISE_FIELDS)
 
 
-def count_diary_entries(user_id):
+def load_user_diary_rows(user_id):
     """
-    Count number of diary entries for a user
-    Returns: tuple (count, list of diary data)
+    Load diary rows of a user (used columns only)
+    Returns: DataFrame (empty if there is no diary file)
     """
     try:
         if not os.path.exists('diary.xlsx'):
-            return 0, []
+            return pd.DataFrame(columns=list(DIARY_COLUMNS))
 
-        df = pd.read_excel('diary.xlsx')
+        df = pd.read_excel('diary.xlsx', usecols=lambda c: c in DIARY_COLUMNS)
 
         # Filter by user_id
-        user_diaries = df[df['User ID'] == user_id]
-
-        if len(user_diaries) > 0:
-            diaries_list = []
-            for _, row in user_diaries.iterrows():
-                diaries_list.append({
-                    'type': row.get('Entry Type', 'Unknown'),
-                    'text': row.get('Entry Text', ''),
-                    'date': row.get('Date Time', '')
-                })
-
-            return len(user_diaries), diaries_list
-
-        return 0, []
+        return df[df['User ID'] == user_id]
 
     except Exception as e:
-        print(f"Error counting diary entries: {e}")
-        return 0, []
+        print(f"Error loading diary entries: {e}")
+        return pd.DataFrame(columns=list(DIARY_COLUMNS))
 
 
-def generate_diary_summary(diary_data, user_problems=None, user_id=None):
+def count_diary_entries(user_id, user_diaries=None):
     """
-    Generate summary of diary entries using LLM
+    Count number of diary entries for a user
+    user_diaries: already loaded diary rows of the user (read from diary.xlsx if None)
+    Returns: tuple (count, DataFrame of diary data)
     """
     try:
-        if not diary_data:
-            return "Пока нет записей в дневнике для анализа."
+        if user_diaries is None:
+            user_diaries = load_user_diary_rows(user_id)
 
-        # Create data hash for caching (include problems in hash for personalization)
-        cache_data = {
-            'data': diary_data,
-            'problems': user_problems or []
-        }
-        data_str = json.dumps(cache_data, ensure_ascii=False, sort_keys=True)
-        data_hash = hashlib.md5(data_str.encode()).hexdigest()[:8]
-        cache_key = get_cache_key(user_id or 'unknown', 'diary_summary', data_hash)
+        if len(user_diaries) > 0:
+            diaries_df = select_fields(user_diaries, DIARY_FIELDS)
 
-        # Check cache
-        cached = get_cached_response(cache_key)
-        if cached:
-            print(f"Using cached diary summary for user {user_id}")
-            return cached
+            return len(user_diaries), diaries_df
 
-        # Prepare diary entries for analysis
-        entries_text = ""
-        for entry in diary_data:
-            date_str = entry.get('date', 'Без даты')
-            if isinstance(date_str, pd.Timestamp):
-                date_str = date_str.strftime('%d.%m.%Y')
-            entries_text += f"\n- {date_str}: [{entry.get('type', '')}] {entry.get('text', '')}"
+        return 0, select_fields(pd.DataFrame(), DIARY_FIELDS)
+
+    except Exception as e:
+        print(f"Error counting diary entries: {e}")
+        return 0, select_fields(pd.DataFrame(), DIARY_FIELDS)
 
-        problems_text = ""
-        if user_problems:
-            problems_text = f"Изначальные проблемы клиента: {', '.join(user_problems)}\n\n"
 
-        system_prompt = """Ты опытный психолог по когнитивно-поведенческой терапии с 15-летним стажем.
+DIARY_SUMMARY_SYSTEM_PROMPT = """Ты опытный психолог по когнитивно-поведенческой терапии с 15-летним стажем.
 Твоя задача - проанализировать дневниковые записи клиента и дать краткое профессиональное саммари.
 
 Важно:
@@ -160,7 +242,27 @@ def generate_diary_summary(diary_data, user_problems=None, user_id=None):
 - Отмечай позитивную динамику, если она есть
 - Формулируй кратко (3-4 предложения)"""
 
-        user_prompt = f"""{problems_text}Проанализируй дневниковые записи клиента:
+
+def get_diary_summary_cache_key(diary_data, user_problems=None, user_id=None):
+    """Cache key for diary summary (problems are included for personalization)"""
+    cache_data = {
+        'data': diary_data,
+        'problems': user_problems or []
+    }
+    data_hash = get_data_hash(cache_data)
+    return get_cache_key(user_id or 'unknown', 'diary_summary', data_hash)
+
+
+def build_diary_summary_prompt(diary_data, user_problems=None):
+    """Build user prompt for diary summary"""
+    # Prepare diary entries for analysis
+    entries_text = format_diary_entries(diary_data)
+
+    problems_text = ""
+    if user_problems:
+        problems_text = f"Изначальные проблемы клиента: {', '.join(user_problems)}\n\n"
+
+    return f"""{problems_text}Проанализируй дневниковые записи клиента:
 {entries_text}
 
 Оцени:
@@ -171,10 +273,31 @@ def generate_diary_summary(diary_data, user_problems=None, user_id=None):
 
 Дай краткое саммари (3-4 предложения), отражая и валидируя переживания."""
 
-        client = OpenRouterClient()
+
+def generate_diary_summary(diary_data, user_problems=None, user_id=None):
+    """
+    Generate summary of diary entries using LLM
+    """
+    try:
+        if len(diary_data) == 0:
+            return "Пока нет записей в дневнике для анализа."
+
+        short_summary = get_short_summary('diary', diary_data)
+        if short_summary:
+            return short_summary
+
+        cache_key = get_diary_summary_cache_key(diary_data, user_problems, user_id)
+
+        # Check cache
+        cached = get_cached_response(cache_key)
+        if cached:
+            print(f"Using cached diary summary for user {user_id}")
+            return cached
+
+        client = get_client()
         response, usage = client.get_simple_response(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
+            system_prompt=DIARY_SUMMARY_SYSTEM_PROMPT,
+            user_prompt=build_diary_summary_prompt(diary_data, user_problems),
             model=MODEL_SIMPLE,
             temperature=TEMPERATURE,
             top_p=TOP_P,
@@ -192,17 +315,87 @@ def generate_diary_summary(diary_data, user_problems=None, user_id=None):
         return "Не удалось создать анализ дневниковых записей."
 
 
+async def stream_diary_summary(bot, chat_id, message_id, diary_data, user_problems=None, user_id=None):
+    """
+    Generate diary summary while streaming it into an existing message
+    Falls back to the blocking generator if streaming fails
+    """
+    try:
+        short_summary = get_short_summary('diary', diary_data)
+        if short_summary:
+            return short_summary
+
+        cache_key = get_diary_summary_cache_key(diary_data, user_problems, user_id)
+        cached = get_cached_response(cache_key)
+        if cached:
+            print(f"Using cached diary summary for user {user_id}")
+            return cached
+
+        chunks = get_client().stream_simple_response(
+            system_prompt=DIARY_SUMMARY_SYSTEM_PROMPT,
+            user_prompt=build_diary_summary_prompt(diary_data, user_problems),
+            model=MODEL_SIMPLE,
+            temperature=TEMPERATURE,
+            top_p=TOP_P,
+            top_k=TOP_K
+        )
+
+        loop = asyncio.get_running_loop()
+        buffer = ""
+        last_edit = 0.0
+        while True:
+            # Each chunk is read in a worker thread so the event loop isn't blocked
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            buffer += chunk
+
+            # Telegram limits message edits, so update at most once per interval
+            now = loop.time()
+            if buffer.strip() and now - last_edit >= STREAM_EDIT_INTERVAL:
+                try:
+                    await bot.edit_message_text(f"💭 Анализ дневника:\n{buffer}", chat_id, message_id)
+                except Exception as e:
+                    print(f"Error updating streamed summary: {e}")
+                last_edit = now
+
+        summary = buffer.strip()
+        if not summary:
+            raise Exception("Empty streamed response")
+
+        set_cached_response(cache_key, summary)
+        print(f"Cached diary summary for user {user_id}")
+        return summary
+
+    except Exception as e:
+        print(f"Error streaming diary summary: {e}")
+        return await asyncio.to_thread(generate_diary_summary, diary_data, user_problems, user_id)
+
+
+EXERCISE_SUMMARY_SYSTEM_PROMPT = """Ты опытный психолог по когнитивно-поведенческой терапии с 15-летним стажем.
+Твоя задача - проанализировать выполненные клиентом упражнения и дать краткое профессиональное саммари.
+
+Важно:
+- Подчеркивай достижения и усилия клиента
+- Отмечай вовлеченность в процесс
+- Будь поддерживающим и мотивирующим
+- Формулируй кратко (2-3 предложения)"""
+
+
 def generate_exercise_summary(exercise_data, user_id=None):
     """
     Generate summary of completed exercises using LLM
     """
     try:
-        if not exercise_data:
+        if len(exercise_data) == 0:
             return "Пока нет выполненных упражнений для анализа."
 
+        short_summary = get_short_summary('exercise', exercise_data)
+        if short_summary:
+            return short_summary
+
         # Create data hash for caching
-        data_str = json.dumps(exercise_data, ensure_ascii=False, sort_keys=True)
-        data_hash = hashlib.md5(data_str.encode()).hexdigest()[:8]
+        data_hash = get_data_hash(exercise_data)
         cache_key = get_cache_key(user_id or 'unknown', 'exercise_summary', data_hash)
 
         # Check cache
@@ -212,21 +405,7 @@ def generate_exercise_summary(exercise_data, user_id=None):
             return cached
 
         # Prepare exercise data for analysis
-        exercises_text = ""
-        for ex in exercise_data:
-            date_str = ex.get('date', 'Без даты')
-            if isinstance(date_str, pd.Timestamp):
-                date_str = date_str.strftime('%d.%m.%Y')
-            exercises_text += f"\n- {date_str}: {ex.get('name', 'Упражнение')} для проблемы '{ex.get('problem', '')}' (важность: {ex.get('rating', 0)}/3)"
-
-        system_prompt = """Ты опытный психолог по когнитивно-поведенческой терапии с 15-летним стажем.
-Твоя задача - проанализировать выполненные клиентом упражнения и дать краткое профессиональное саммари.
-
-Важно:
-- Подчеркивай достижения и усилия клиента
-- Отмечай вовлеченность в процесс
-- Будь поддерживающим и мотивирующим
-- Формулируй кратко (2-3 предложения)"""
+        exercises_text = format_exercise_entries(exercise_data)
 
         user_prompt = f"""Проанализируй выполненные упражнения:
 {exercises_text}
@@ -238,9 +417,9 @@ def generate_exercise_summary(exercise_data, user_id=None):
 
 Дай краткое саммари (2-3 предложения), подчеркивая сильные стороны и достижения."""
 
-        client = OpenRouterClient()
+        client = get_client()
         response, usage = client.get_simple_response(
-            system_prompt=system_prompt,
+            system_prompt=EXERCISE_SUMMARY_SYSTEM_PROMPT,
             user_prompt=user_prompt,
             model=MODEL_SIMPLE,
             temperature=TEMPERATURE,
@@ -259,6 +438,17 @@ def generate_exercise_summary(exercise_data, user_id=None):
         return "Не удалось создать анализ упражнений."
 
 
+MOTIVATIONAL_PHRASE_SYSTEM_PROMPT = """Ты опытный психолог по когнитивно-поведенческой терапии.
+Твоя задача - создать персонализированную мотивирующую фразу для клиента.
+
+Требования к фразе:
+- Персонализированная (учитывает прогресс клиента)
+- Позитивно-реалистичная (не токсично позитивная)
+- Поддерживающая дальнейшую работу
+- Краткая (1 предложение, максимум 15-20 слов)
+- Теплая и искренняя"""
+
+
 def generate_motivational_phrase(user_name, diary_summary, exercise_summary, stats):
     """
     Generate personalized motivational phrase using LLM
@@ -266,7 +456,7 @@ def generate_motivational_phrase(user_name, diary_summary, exercise_summary, sta
     try:
         # Create data hash for caching
         data_str = f"{user_name}{diary_summary}{exercise_summary}{stats}"
-        data_hash = hashlib.md5(data_str.encode()).hexdigest()[:8]
+        data_hash = get_data_hash(data_str)
         cache_key = get_cache_key(user_name, 'motivation', data_hash)
 
         # Check cache (shorter TTL for motivational phrases)
@@ -275,16 +465,6 @@ def generate_motivational_phrase(user_name, diary_summary, exercise_summary, sta
             if datetime.now() - cached_data['timestamp'] < timedelta(hours=12):
                 return cached_data['response']
 
-        system_prompt = """Ты опытный психолог по когнитивно-поведенческой терапии.
-Твоя задача - создать персонализированную мотивирующую фразу для клиента.
-
-Требования к фразе:
-- Персонализированная (учитывает прогресс клиента)
-- Позитивно-реалистичная (не токсично позитивная)
-- Поддерживающая дальнейшую работу
-- Краткая (1 предложение, максимум 15-20 слов)
-- Теплая и искренняя"""
-
         context = ""
         if stats['exercises'] > 0 or stats['diaries'] > 0:
             context = f"Клиент выполнил {stats['exercises']} упражнений и сделал {stats['diaries']} записей в дневнике. "
@@ -299,9 +479,9 @@ def generate_motivational_phrase(user_name, diary_summary, exercise_summary, sta
 - Поддерживает продолжение работы
 - Звучит тепло и персонально"""
 
-        client = OpenRouterClient()
+        client = get_client()
         response, usage = client.get_simple_response(
-            system_prompt=system_prompt,
+            system_prompt=MOTIVATIONAL_PHRASE_SYSTEM_PROMPT,
             user_prompt=user_prompt,
             model=MODEL_SIMPLE,
             temperature=TEMPERATURE + 0.2,  # Slightly higher temperature for creativity
@@ -316,7 +496,158 @@ def generate_motivational_phrase(user_name, diary_summary, exercise_summary, sta
 
     except Exception as e:
         print(f"Error generating motivational phrase: {e}")
-        return "Каждый шаг вперед - это твоя победа, продолжай двигаться в своем темпе."
+        return DEFAULT_MOTIVATIONAL_PHRASE
+
+
+# JSON schema for the combined progress report (one LLM call instead of three)
+PROGRESS_REPORT_SCHEMA = {
+    "name": "progress_report",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "diary_summary": {
+                "type": "string",
+                "description": "Саммари дневниковых записей (3-4 предложения) или пустая строка, если записей нет"
+            },
+            "exercise_summary": {
+                "type": "string",
+                "description": "Саммари выполненных упражнений (2-3 предложения) или пустая строка, если упражнений нет"
+            },
+            "motivational_phrase": {
+                "type": "string",
+                "description": "Одна короткая мотивирующая фраза (максимум 15-20 слов)"
+            }
+        },
+        "required": ["diary_summary", "exercise_summary", "motivational_phrase"],
+        "additionalProperties": False
+    }
+}
+
+
+# Static system prefix of the report call; bump PROGRESS_REPORT_PROMPT_CACHE_KEY version when it changes
+PROGRESS_REPORT_PROMPT_CACHE_KEY = "progress_report_v1"
+PROGRESS_REPORT_SYSTEM_MESSAGE = """Ты опытный психолог по когнитивно-поведенческой терапии с 15-летним стажем.
+Твоя задача - проанализировать прогресс клиента и подготовить три части отчёта:
+
+1. diary_summary - краткое саммари дневниковых записей (3-4 предложения):
+- Отражай и валидируй переживания клиента
+- Нормализуй без обесценивания
+- Отмечай позитивную динамику, если она есть
+
+2. exercise_summary - краткое саммари выполненных упражнений (2-3 предложения):
+- Подчеркивай достижения и усилия клиента
+- Отмечай вовлеченность в процесс
+
+3. motivational_phrase - персонализированная мотивирующая фраза:
+- Позитивно-реалистичная (не токсично позитивная)
+- Краткая (1 предложение, максимум 15-20 слов)
+- Теплая и искренняя
+
+Если данных для части нет, верни для неё пустую строку."""
+
+
+def get_progress_report_cache_key(user_name, user_problems, diary_data, exercise_data, user_id=None):
+    """Cache key for the combined progress report"""
+    cache_data = {
+        'name': user_name,
+        'problems': user_problems or [],
+        'diary': diary_data,
+        'exercises': exercise_data
+    }
+    return get_cache_key(user_id or 'unknown', 'full_report', get_data_hash(cache_data))
+
+
+async def run_coalesced(cache_key, func, *args):
+    """
+    Run a blocking LLM generator in a worker thread
+    Concurrent calls with the same cache key await the one in-flight request instead of repeating it
+    """
+    if cache_key in llm_in_flight:
+        print(f"Awaiting in-flight LLM request {cache_key}")
+        return await asyncio.shield(llm_in_flight[cache_key])
+
+    future = asyncio.get_running_loop().create_future()
+    llm_in_flight[cache_key] = future
+    try:
+        result = await asyncio.to_thread(func, *args)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark as retrieved in case nobody else is waiting
+        raise
+    finally:
+        llm_in_flight.pop(cache_key, None)
+        # Cancelled (CancelledError isn't an Exception) - release the callers awaiting this request
+        if not future.done():
+            future.cancel()
+
+
+def generate_full_progress_report(user_name, user_problems, diary_data, exercise_data, stats, user_id=None):
+    """
+    Generate diary summary, exercise summary and motivational phrase in one structured LLM call
+    Returns: dict with 'diary_summary', 'exercise_summary', 'motivational_phrase' or None on failure
+    """
+    try:
+        cache_key = get_progress_report_cache_key(user_name, user_problems, diary_data, exercise_data, user_id)
+
+        # Check cache
+        cached = get_cached_response(cache_key)
+        if cached:
+            print(f"Using cached progress report for user {user_id}")
+            return cached
+
+        problems_text = ""
+        if user_problems:
+            problems_text = f"Изначальные проблемы клиента: {', '.join(user_problems)}\n"
+
+        prompt = f"""Имя клиента: {user_name}
+{problems_text}Клиент выполнил {stats['exercises']} упражнений и сделал {stats['diaries']} записей в дневнике.
+
+Дневниковые записи:{format_diary_entries(diary_data) or " нет"}
+
+Выполненные упражнения:{format_exercise_entries(exercise_data) or " нет"}
+
+Оцени динамику состояния, основные темы и паттерны, регулярность и разнообразие упражнений."""
+
+        client = get_client()
+        report, usage = client.get_structured_response(
+            prompt=prompt,
+            json_schema=PROGRESS_REPORT_SCHEMA,
+            model=MODEL_STRUCTURED,
+            temperature_structured=TEMPERATURE,
+            top_p=TOP_P,
+            top_k=TOP_K,
+            system_message=PROGRESS_REPORT_SYSTEM_MESSAGE,
+            prompt_cache_key=PROGRESS_REPORT_PROMPT_CACHE_KEY
+        )
+
+        report = {key: (report.get(key) or '').strip() for key in PROGRESS_REPORT_SCHEMA['schema']['required']}
+        if not report['motivational_phrase']:
+            return None
+
+        # Cache the response
+        set_cached_response(cache_key, report)
+        print(f"Cached progress report for user {user_id}")
+
+        return report
+
+    except Exception as e:
+        print(f"Error generating progress report: {e}")
+        return None
+
+
+# Progress screen keyboards (built once at import; universal_menu imports this module, so they are defined here)
+BTN_BACK_TO_MENU = types.InlineKeyboardButton("🔙 Назад в меню", callback_data="menu:show")
+
+BACK_TO_MENU_MARKUP = types.InlineKeyboardMarkup()
+BACK_TO_MENU_MARKUP.add(BTN_BACK_TO_MENU)
+
+# Shown when there is no data yet
+STARTER_MARKUP = types.InlineKeyboardMarkup()
+STARTER_MARKUP.add(types.InlineKeyboardButton("🎯 Выбрать упражнение", callback_data="menu:select_exercise"))
+STARTER_MARKUP.add(types.InlineKeyboardButton("📝 Открыть дневник", callback_data="menu:diary"))
+STARTER_MARKUP.add(BTN_BACK_TO_MENU)
 
 
 async def show_my_progress(bot, chat_id, user_id, username):
@@ -329,29 +660,37 @@ async def show_my_progress(bot, chat_id, user_id, username):
         user_name = 'Друг'
         user_problems = []
 
+        # Write buffered exercise rows and diary entries first so the report includes the latest ones
+        from exercise import flush_exercises_excel
+        from diary import flush_diary_csv
+        flush_exercises_excel()
+        flush_diary_csv()
+
+        # Read exercises and diary concurrently in worker threads
+        # (diary rows are shared by the name fallback and the entry count)
+        (exercise_count, exercise_data), diary_rows = await asyncio.gather(
+            asyncio.to_thread(count_completed_exercises, user_id),
+            asyncio.to_thread(load_user_diary_rows, user_id)
+        )
+
         if user_id in user_states:
             user_name = user_states[user_id].get('user_name', 'Друг')
             user_problems = user_states[user_id].get('problems', [])
         else:
             # Try to get user name from diary.xlsx as fallback (take the latest entry)
             try:
-                if os.path.exists('diary.xlsx'):
-                    df = pd.read_excel('diary.xlsx')
-                    user_rows = df[df['User ID'] == user_id]
-                    if len(user_rows) > 0 and 'User Name' in df.columns:
-                        # Get the last (most recent) non-empty name
-                        for idx in range(len(user_rows) - 1, -1, -1):
-                            name_from_diary = user_rows.iloc[idx]['User Name']
-                            if pd.notna(name_from_diary) and name_from_diary and name_from_diary != 'User':
-                                user_name = name_from_diary
-                                print(f"Got user name from diary: {user_name}")
-                                break
+                if len(diary_rows) > 0 and 'User Name' in diary_rows.columns:
+                    # Get the last (most recent) non-empty name
+                    names = diary_rows['User Name'].dropna()
+                    names = names[(names.astype(str) != '') & (names.astype(str) != 'User')]
+                    if not names.empty:
+                        user_name = names.iloc[-1]
+                        print(f"Got user name from diary: {user_name}")
             except Exception as e:
                 print(f"Could not get name from diary: {e}")
 
-        # Count exercises and diaries
-        exercise_count, exercise_data = count_completed_exercises(user_id)
-        diary_count, diary_data = count_diary_entries(user_id)
+        # Count diary entries
+        diary_count, diary_data = count_diary_entries(user_id, diary_rows)
 
         # Prepare statistics
         stats = {
@@ -360,10 +699,11 @@ async def show_my_progress(bot, chat_id, user_id, username):
         }
 
         # STEP 1: Send statistics immediately
-        stats_text = f"📊 **Твой прогресс, {user_name}**\n\n"
-        stats_text += "📈 **Статистика:**\n"
-        stats_text += f"✅ Выполнено упражнений: {exercise_count}\n"
-        stats_text += f"📖 Записей в дневнике: {diary_count}\n"
+        stats_text = STATS_TEMPLATE.format(
+            user_name=escape_markdown(user_name),
+            exercise_count=exercise_count,
+            diary_count=diary_count
+        )
 
         await bot.send_message(
             chat_id,
@@ -374,48 +714,63 @@ async def show_my_progress(bot, chat_id, user_id, username):
         # STEP 2: Send loading message if there's data to analyze
         if exercise_count > 0 or diary_count > 0:
             loading_text = "Провожу анализ... ⌛"
-            await bot.send_message(chat_id, loading_text)
+            loading_message = await bot.send_message(chat_id, loading_text)
+
+            # STEP 3: Generate analysis (single structured call) and send as separate message
+            if len(diary_data) < MIN_ENTRIES_FOR_LLM_SUMMARY and len(exercise_data) < MIN_ENTRIES_FOR_LLM_SUMMARY:
+                # Too little data for a meaningful analysis - skip the LLM round-trip
+                diary_summary = get_short_summary('diary', diary_data) if diary_count > 0 else ""
+                exercise_summary = get_short_summary('exercise', exercise_data) if exercise_count > 0 else ""
+                motivational = DEFAULT_MOTIVATIONAL_PHRASE
+            else:
+                report = await run_coalesced(
+                    get_progress_report_cache_key(user_name, user_problems, diary_data, exercise_data, user_id),
+                    generate_full_progress_report,
+                    user_name, user_problems, diary_data, exercise_data, stats, user_id
+                )
+
+                if report:
+                    diary_summary = ""
+                    if diary_count > 0:
+                        diary_summary = report['diary_summary'] or await asyncio.to_thread(
+                            generate_diary_summary, diary_data, user_problems, user_id
+                        )
+                    exercise_summary = ""
+                    if exercise_count > 0:
+                        exercise_summary = report['exercise_summary'] or await asyncio.to_thread(
+                            generate_exercise_summary, exercise_data, user_id
+                        )
+                    motivational = report['motivational_phrase']
+                else:
+                    # Fallback: separate calls per section, diary summary is streamed into the loading message
+                    diary_summary = ""
+                    if diary_count > 0:
+                        diary_summary = await stream_diary_summary(
+                            bot, chat_id, loading_message.message_id, diary_data, user_problems, user_id
+                        )
+                    exercise_summary = ""
+                    if exercise_count > 0:
+                        exercise_summary = await asyncio.to_thread(generate_exercise_summary, exercise_data, user_id)
+                    motivational = await asyncio.to_thread(
+                        generate_motivational_phrase,
+                        user_name,
+                        diary_summary or "Нет записей",
+                        exercise_summary or "Нет упражнений",
+                        stats
+                    )
 
-            # STEP 3: Generate analysis and send as separate message
             analysis_text = ""
-
-            # Generate summaries only if there is data
             if diary_count > 0:
-                analysis_text += "💭 **Анализ дневника:**\n"
-                diary_summary = generate_diary_summary(diary_data, user_problems, user_id)
-                analysis_text += f"{diary_summary}\n\n"
-            else:
-                diary_summary = ""
-
+                analysis_text += f"💭 **Анализ дневника:**\n{diary_summary}\n\n"
             if exercise_count > 0:
-                analysis_text += "🎯 **Анализ упражнений:**\n"
-                exercise_summary = generate_exercise_summary(exercise_data, user_id)
-                analysis_text += f"{exercise_summary}\n\n"
-            else:
-                exercise_summary = ""
-
-            # Generate motivational phrase
-            motivational = generate_motivational_phrase(
-                user_name,
-                diary_summary or "Нет записей",
-                exercise_summary or "Нет упражнений",
-                stats
-            )
+                analysis_text += f"🎯 **Анализ упражнений:**\n{exercise_summary}\n\n"
             analysis_text += f"💪 **Напутствие:**\n{motivational}"
 
-            # Add navigation buttons
-            markup = types.InlineKeyboardMarkup()
-            btn_back = types.InlineKeyboardButton(
-                "🔙 Назад в меню",
-                callback_data="menu:show"
-            )
-            markup.add(btn_back)
-
             # Send analysis with back button
             await bot.send_message(
                 chat_id,
                 analysis_text,
-                reply_markup=markup,
+                reply_markup=BACK_TO_MENU_MARKUP,
                 parse_mode='Markdown'
             )
 
@@ -424,30 +779,10 @@ async def show_my_progress(bot, chat_id, user_id, username):
             starter_text = "💪 **С чего начать:**\n"
             starter_text += "Попробуй выполнить первое упражнение или записать свои мысли в дневник - каждый маленький шаг важен!"
 
-            markup = types.InlineKeyboardMarkup()
-
-            btn_exercise = types.InlineKeyboardButton(
-                "🎯 Выбрать упражнение",
-                callback_data="menu:select_exercise"
-            )
-            markup.add(btn_exercise)
-
-            btn_diary = types.InlineKeyboardButton(
-                "📝 Открыть дневник",
-                callback_data="menu:diary"
-            )
-            markup.add(btn_diary)
-
-            btn_back = types.InlineKeyboardButton(
-                "🔙 Назад в меню",
-                callback_data="menu:show"
-            )
-            markup.add(btn_back)
-
             await bot.send_message(
                 chat_id,
                 starter_text,
-                reply_markup=markup,
+                reply_markup=STARTER_MARKUP,
                 parse_mode='Markdown'
             )
 
@@ -455,12 +790,5 @@ async def show_my_progress(bot, chat_id, user_id, username):
         print(f"Error showing progress: {e}")
 
         # Fallback message
-        markup = types.InlineKeyboardMarkup()
-        btn_back = types.InlineKeyboardButton(
-            "🔙 Назад в меню",
-            callback_data="menu:show"
-        )
-        markup.add(btn_back)
-
         error_text = "Не удалось загрузить прогресс. Попробуй позже."
-        await bot.send_message(chat_id, error_text, reply_markup=markup)
\ No newline at end of file
+        await bot.send_message(chat_id, error_text, reply_markup=BACK_TO_MENU_MARKUP)
\ No newline at end of file
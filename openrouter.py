@@ -1,7 +1,12 @@
+import atexit
+import threading
+import time
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import os
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Iterator, Optional, Tuple
 
 # Get API key and model parameters from config.py
 import sys
@@ -10,6 +15,32 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import OPENROUTER_API_KEY, TEMPERATURE, TEMPERATURE_STRUCTURED, TOP_P, TOP_K, MODEL_STRUCTURED
 
 
+# Providers that need explicit cache_control breakpoints for prompt caching
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+# OpenRouter sometimes answers 200 with an empty or truncated body; the adapter doesn't retry those
+MALFORMED_RESPONSE_RETRIES = 1
+MALFORMED_RESPONSE_RETRY_DELAY = 2  # seconds
+
+
+def build_system_message(system_message: str, model: str, prompt_cache_key: Optional[str]) -> Dict[str, Any]:
+    """System message, with an explicit cache breakpoint for providers that need one"""
+    if prompt_cache_key and model.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+        # Explicit cache breakpoint after the static system prefix
+        return {
+            "role": "system",
+            "content": [{
+                "type": "text",
+                "text": system_message,
+                "cache_control": {"type": "ephemeral"}
+            }]
+        }
+    return {
+        "role": "system",
+        "content": system_message
+    }
+
+
 class OpenRouterClient:
     def __init__(self, api_key: str = OPENROUTER_API_KEY):
         self.api_key = api_key
@@ -18,6 +49,25 @@ class OpenRouterClient:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # Keep-alive session: TLS connection to OpenRouter is reused between calls
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+        # Retries with exponential backoff (honouring Retry-After) happen inside the adapter
+        retry = Retry(
+            total=3,
+            backoff_factor=2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(['POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        # Blocking calls run in the bot's worker threads (up to 32 at once); a smaller pool would
+        # drop the extra connections after use and pay a new TLS handshake on the next call
+        self._session.mount('https://', HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=32))
+
+    def close(self):
+        """Close pooled connections"""
+        self._session.close()
 
     def get_structured_response(
         self,
@@ -28,7 +78,9 @@ class OpenRouterClient:
         temperature_structured: float = TEMPERATURE_STRUCTURED,
         top_p: float = TOP_P,
         top_k: Optional[int] = TOP_K,
-        system_message: Optional[str] = None
+        system_message: Optional[str] = None,
+        prompt_cache_key: Optional[str] = None,
+        max_tokens: Optional[int] = None
     ) -> Tuple[Dict[str, Any], Dict[str, int]]:
         """
         Get a structured response from OpenRouter API.
@@ -42,6 +94,9 @@ class OpenRouterClient:
             top_p: Nucleus sampling parameter
             top_k: Top-k sampling parameter
             system_message: Optional system message
+            prompt_cache_key: Optional key marking the system message as a reusable prompt prefix
+                (provider prompt caching; change the key when the prefix changes)
+            max_tokens: Optional limit on generated tokens (keep small for short JSON answers)
             
         Returns:
             Tuple containing (structured_response, usage_info)
@@ -50,10 +105,7 @@ class OpenRouterClient:
         messages = []
         
         if system_message:
-            messages.append({
-                "role": "system",
-                "content": system_message
-            })
+            messages.append(build_system_message(system_message, model, prompt_cache_key))
             
         messages.append({
             "role": "user",
@@ -75,13 +127,20 @@ class OpenRouterClient:
         if top_k is not None:
             data["top_k"] = top_k
 
+        if max_tokens is not None:
+            data["max_tokens"] = max_tokens
+
+        # OpenAI models route requests with the same key to the same prompt cache
+        if prompt_cache_key and model.startswith("openai/"):
+            data["prompt_cache_key"] = prompt_cache_key
+
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=data, timeout=60)
+            response = self._session.post(self.base_url, json=data, timeout=60)
             
             if response.status_code == 200:
                 try:
-                    result = response.json()
-                except json.JSONDecodeError as e:
+                    result = orjson.loads(response.content)
+                except orjson.JSONDecodeError as e:
                     print(f"JSON decode error in structured response: {e}")
                     print(f"Response content (first 1000 chars): {response.text[:1000]}")
                     print(f"Response content (last 1000 chars): {response.text[-1000:]}")
@@ -101,9 +160,9 @@ class OpenRouterClient:
                 if "choices" in result and len(result["choices"]) > 0:
                     content = result["choices"][0]["message"]["content"]
                     try:
-                        structured_response = json.loads(content)
+                        structured_response = orjson.loads(content)
                         return structured_response, usage_info
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         print(f"JSON decode error in message content: {e}")
                         print(f"Message content: {content}")
                         raise Exception(f"Invalid JSON in message content: {str(e)}")
@@ -127,22 +186,19 @@ class OpenRouterClient:
         temperature: float = TEMPERATURE,
         top_p: float = TOP_P,
         top_k: Optional[int] = TOP_K,
-        max_retries: int = 3
+        prompt_cache_key: Optional[str] = None
     ) -> Tuple[str, Dict[str, int]]:
         """
         Get a simple text response with token usage information.
+        Transient failures (429/5xx, dropped connections) are retried by the session adapter,
+        an empty or invalid JSON body with status 200 is retried here (MALFORMED_RESPONSE_RETRIES times).
+        prompt_cache_key marks the system prompt as a reusable prefix (see get_structured_response).
         
         Returns:
             Tuple containing (response_text, usage_info)
         """
-        import time
-        from requests.exceptions import Timeout, RequestException
-        
         messages = [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
+            build_system_message(system_prompt, model, prompt_cache_key),
             {
                 "role": "user",
                 "content": user_prompt
@@ -160,91 +216,144 @@ class OpenRouterClient:
         if top_k is not None:
             data["top_k"] = top_k
 
-        last_exception = None
-        
-        for attempt in range(max_retries):
+        # OpenAI models route requests with the same key to the same prompt cache
+        if prompt_cache_key and model.startswith("openai/"):
+            data["prompt_cache_key"] = prompt_cache_key
+
+        for attempt in range(MALFORMED_RESPONSE_RETRIES + 1):
             if attempt > 0:
-                wait_time = 2 ** attempt  # Exponential backoff: 2, 4, 8 seconds
-                print(f"Retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
-                time.sleep(wait_time)
-            
-            print(f"Making API request to {self.base_url} with model {model}... (attempt {attempt + 1}/{max_retries})")
-            
+                print(f"Retrying in {MALFORMED_RESPONSE_RETRY_DELAY} seconds... (attempt {attempt + 1})")
+                time.sleep(MALFORMED_RESPONSE_RETRY_DELAY)
+
+            print(f"Making API request to {self.base_url} with model {model}...")
+
             try:
-                response = requests.post(self.base_url, headers=self.headers, json=data, timeout=60)
-                print(f"API request completed with status code: {response.status_code}")
-                
-                if response.status_code == 200:
-                    # Check if response is empty or contains only whitespace
-                    response_text = response.text.strip()
-                    if not response_text:
-                        error_msg = "API returned empty response"
-                        print(error_msg)
-                        last_exception = Exception(error_msg)
-                        continue  # Retry
-                    
-                    # Check if response is only whitespace
-                    if response_text.isspace() or len(response_text.strip()) == 0:
-                        error_msg = f"API returned response containing only whitespace (length: {len(response.text)})"
-                        print(error_msg)
-                        last_exception = Exception(error_msg)
-                        continue  # Retry
-                    
-                    try:
-                        result = response.json()
-                    except json.JSONDecodeError as e:
-                        error_msg = f"Invalid JSON response from API: {str(e)}"
-                        print(f"JSON decode error: {e}")
-                        print(f"Response content (first 1000 chars): {response.text[:1000]}")
-                        print(f"Response content (last 1000 chars): {response.text[-1000:]}")
-                        print(f"Response headers: {dict(response.headers)}")
-                        last_exception = Exception(error_msg)
-                        continue  # Retry
-                    
-                    # Extract usage information
-                    usage_info = {}
-                    if "usage" in result:
-                        usage_info = {
-                            "prompt_tokens": result["usage"].get("prompt_tokens", 0),
-                            "completion_tokens": result["usage"].get("completion_tokens", 0),
-                            "total_tokens": result["usage"].get("total_tokens", 0)
-                        }
-                    else:
-                        usage_info = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
-                    
-                    if "choices" in result and len(result["choices"]) > 0:
-                        content = result["choices"][0]["message"]["content"].strip()
-                        print(f"Successfully received response of length: {len(content)}")
-                        return content, usage_info
-                    else:
-                        error_msg = "Unexpected response structure"
-                        print(f"Unexpected response structure: {result}")
-                        last_exception = Exception(error_msg)
-                        continue  # Retry
-                else:
-                    error_msg = f"API error - Status: {response.status_code}, Content: {response.text}"
-                    print(f"API error - Status: {response.status_code}")
-                    print(f"Response content: {response.text}")
-                    last_exception = Exception(error_msg)
-                    continue  # Retry
-                    
-            except Timeout:
-                error_msg = "Request timed out after 60 seconds"
-                print(error_msg)
-                last_exception = Exception(error_msg)
-                continue  # Retry
-            except RequestException as e:
-                error_msg = f"Request failed: {str(e)}"
-                print(error_msg)
-                last_exception = Exception(error_msg)
-                continue  # Retry
-        
-        # If we get here, all retries failed
-        print(f"All {max_retries} attempts failed")
-        if last_exception:
-            raise last_exception
+                response = self._session.post(self.base_url, json=data, timeout=60)
+            except requests.exceptions.Timeout:
+                raise Exception("Request timed out after 60 seconds")
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Request failed: {str(e)}")
+
+            print(f"API request completed with status code: {response.status_code}")
+
+            if response.status_code != 200:
+                print(f"API error - Status: {response.status_code}")
+                print(f"Response content: {response.text}")
+                raise Exception(f"API error - Status: {response.status_code}, Content: {response.text}")
+
+            # Check if response is empty or contains only whitespace
+            if not response.content.strip():
+                error = Exception(f"API returned empty response (length: {len(response.content)})")
+                print(error)
+                continue
+
+            try:
+                result = orjson.loads(response.content)
+                break
+            except orjson.JSONDecodeError as e:
+                print(f"JSON decode error: {e}")
+                print(f"Response content (first 1000 chars): {response.text[:1000]}")
+                print(f"Response content (last 1000 chars): {response.text[-1000:]}")
+                print(f"Response headers: {dict(response.headers)}")
+                error = Exception(f"Invalid JSON response from API: {str(e)}")
+        else:
+            raise error
+
+        # Extract usage information
+        if "usage" in result:
+            usage_info = {
+                "prompt_tokens": result["usage"].get("prompt_tokens", 0),
+                "completion_tokens": result["usage"].get("completion_tokens", 0),
+                "total_tokens": result["usage"].get("total_tokens", 0)
+            }
         else:
-            raise Exception("All retry attempts failed with unknown error")
+            usage_info = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+        if "choices" in result and len(result["choices"]) > 0:
+            content = result["choices"][0]["message"]["content"].strip()
+            print(f"Successfully received response of length: {len(content)}")
+            return content, usage_info
+
+        print(f"Unexpected response structure: {result}")
+        raise Exception("Unexpected response structure")
+
+    def stream_simple_response(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: str,
+        temperature: float = TEMPERATURE,
+        top_p: float = TOP_P,
+        top_k: Optional[int] = TOP_K
+    ) -> Iterator[str]:
+        """
+        Stream a simple text response (SSE), yielding content chunks as they arrive.
+        """
+        data = {
+            "model": model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": user_prompt
+                }
+            ],
+            "temperature": temperature,
+            "top_p": top_p,
+            "stream": True
+        }
+
+        # Добавляем top_k только если он не None
+        if top_k is not None:
+            data["top_k"] = top_k
+
+        try:
+            with self._session.post(self.base_url, json=data, timeout=60, stream=True) as response:
+                if response.status_code != 200:
+                    print(f"API error - Status: {response.status_code}")
+                    raise Exception(f"Error: {response.status_code}\nResponse content: {response.text}")
+
+                for line in response.iter_lines(decode_unicode=True):
+                    # Skip keep-alive comments and empty lines
+                    if not line or not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: "):]
+                    if payload == "[DONE]":
+                        break
+                    try:
+                        chunk = orjson.loads(payload)
+                    except orjson.JSONDecodeError:
+                        continue
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        content = choices[0].get("delta", {}).get("content")
+                        if content:
+                            yield content
+        except requests.exceptions.Timeout:
+            raise Exception("Request timed out after 60 seconds")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Request failed: {str(e)}")
+
+
+# Shared client so the HTTP session and headers survive between requests
+_client: Optional[OpenRouterClient] = None
+# LLM calls also run in worker threads (asyncio.to_thread) - only one of them may create the client
+_client_lock = threading.Lock()
+
+
+def get_client() -> OpenRouterClient:
+    """Return the process-wide OpenRouterClient instance"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = OpenRouterClient()
+                atexit.register(client.close)
+                _client = client
+    return _client
 
 
 # JSON schema for OKVED matching
@@ -4,83 +4,214 @@ Module for handling custom "other problems" in the goal setting process
 Allows users to describe problems in free text and get LLM suggestions
 """
 
-from typing import List, Tuple
+import asyncio
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+from dataclasses import dataclass, field
+import orjson
+import prometheus_client
+from typing import Final, List, Tuple
 from telebot import types
-from openrouter import OpenRouterClient
+from openrouter import get_client
+# None of these modules import other_problem at load time, so there is no import cycle
+from goal import PROBLEMS, user_goal_states
+from greeting import user_states
+from universal_menu import get_menu_button
+from exercise import show_exercise_recommendations
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class OtherProblemState:
+    """Per-user state of the other problem flow"""
+    step: str = 'awaiting_text'
+    username: str = ''
+    text: str = ''
+    suggestions: list = field(default_factory=list)  # [(display_name, problem_id)]
+    selected_problems: list = field(default_factory=list)  # display names added to goal
+    selected_suggestions: set = field(default_factory=set)  # problem_ids toggled in current round
+    other_count: int = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restore state from its serialized form"""
+        data['suggestions'] = [tuple(item) for item in data.get('suggestions', [])]
+        data['selected_suggestions'] = set(data.get('selected_suggestions', []))
+        return cls(**data)
+
+
+def json_default(obj):
+    """orjson fallback for types it can't serialize natively (sets become sorted lists)"""
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError
+
+
+class StateStore:
+    """
+    Per-user state storage
+    Keeps states in process memory; if REDIS_URL is set, Redis holds the authoritative copy
+    (shared between bot workers and kept across restarts) and local memory is only a fallback
+    for when Redis is unreachable
+    """
+
+    def __init__(self, prefix, state_cls, ttl=3600, local_size=1024):
+        self.prefix = prefix
+        self.state_cls = state_cls
+        self.ttl = ttl
+        self.local_size = local_size
+        self._local = OrderedDict()
+        self._redis = None
+        self._redis_checked = False
+
+    def _get_redis(self):
+        """Connect to Redis lazily (environment is loaded by main.py before first use)"""
+        if not self._redis_checked:
+            self._redis_checked = True
+            redis_url = os.getenv('REDIS_URL')
+            if redis_url:
+                import redis.asyncio as redis_asyncio
+                self._redis = redis_asyncio.from_url(redis_url)
+        return self._redis
+
+    def _remember(self, user_id, state):
+        self._local[user_id] = state
+        self._local.move_to_end(user_id)
+        # Evict only when Redis holds the authoritative copy
+        if self._get_redis() is not None and len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def get(self, user_id):
+        """Return user state or None"""
+        redis = self._get_redis()
+        if redis is None:
+            return self._local.get(user_id)
+
+        # Another worker may have changed the state - Redis is read every time
+        try:
+            raw = await redis.get(f"{self.prefix}:{user_id}")
+        except Exception as e:
+            logger.warning("Error reading state from Redis: %s", e)
+            state = self._local.get(user_id)
+            if state is not None:
+                self._local.move_to_end(user_id)
+            return state
+
+        if raw is None:
+            self._local.pop(user_id, None)
+            return None
+
+        state = self.state_cls.from_dict(orjson.loads(raw))
+        self._remember(user_id, state)
+        return state
+
+    async def set(self, user_id, state):
+        """Save user state (call after mutating it)"""
+        self._remember(user_id, state)
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.set(f"{self.prefix}:{user_id}", orjson.dumps(state, default=json_default), ex=self.ttl)
+            except Exception as e:
+                logger.warning("Error writing state to Redis: %s", e)
+
+    async def delete(self, user_id):
+        """Remove user state"""
+        self._local.pop(user_id, None)
+
+        redis = self._get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(f"{self.prefix}:{user_id}")
+            except Exception as e:
+                logger.warning("Error deleting state from Redis: %s", e)
 
-# Initialize OpenRouter client
-openrouter_client = OpenRouterClient()
 
 # Store user states for other problem flow
-# Format: {user_id: {'step': str, 'text': str, 'suggestions': [str], 'selected_problems': [str], 'selected_suggestions': [str], 'other_count': int}}
-user_other_problem_states = {}
+# Format: {user_id: OtherProblemState}
+user_other_problem_states = StateStore('oprob', OtherProblemState)
+
+# Pending suggestion markup edits (debounced so a burst of toggles results in one edit)
+# Format: {user_id: asyncio.Task}
+pending_suggestion_updates = {}
+SUGGESTION_EDIT_DEBOUNCE = 0.15  # seconds
+
+# Selection currently rendered in each chat's suggestions message (to skip no-op edits)
+# Format: {chat_id: (message_id, (suggestions, frozenset of selected problem_ids))}
+shown_suggestion_markups = {}
 
 # Maximum number of "other problems" a user can add
 MAX_OTHER_PROBLEMS = 3
 
-# Import PROBLEMS list from goal.py for reference
-from goal import PROBLEMS
-
+# Lookup tables derived from PROBLEMS, built once at import and never modified
 # Map problem IDs to display names for easy lookup
-PROBLEM_MAP = {p_id: display_name for display_name, p_id in PROBLEMS}
-
-
-async def classify_user_problem(user_text: str) -> List[Tuple[str, str]]:
-    """
-    Use LLM to classify user's problem text into 1-3 categories from PROBLEMS
-    Returns list of tuples (display_name, problem_id)
-    """
-    try:
-        # Create JSON schema for structured response
-        json_schema = {
-            "name": "problem_classification",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "suggested_problems": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "problem_id": {
-                                    "type": "string",
-                                    "enum": [p_id for _, p_id in PROBLEMS if p_id != "other"],
-                                    "description": "Problem ID from the predefined list"
-                                },
-                                "confidence": {
-                                    "type": "number",
-                                    "minimum": 0,
-                                    "maximum": 1,
-                                    "description": "Confidence score for this classification"
-                                }
-                            },
-                            "required": ["problem_id", "confidence"],
-                            "additionalProperties": False
+PROBLEM_MAP: Final = {p_id: display_name for display_name, p_id in PROBLEMS}
+
+# Display names of standard problems for O(1) membership checks
+PROBLEM_DISPLAY_NAMES: Final = frozenset(display_name for display_name, _ in PROBLEMS)
+
+# Problem IDs the classifier may return
+PROBLEM_IDS_NO_OTHER: Final = tuple(p_id for _, p_id in PROBLEMS if p_id != "other")
+
+# JSON schema for structured classification response (built once at import)
+CLASSIFY_SCHEMA = {
+    "name": "problem_classification",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "suggested_problems": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "problem_id": {
+                            "type": "string",
+                            "enum": PROBLEM_IDS_NO_OTHER,
+                            "description": "Problem ID from the predefined list"
                         },
-                        "minItems": 1,
-                        "maxItems": 3,
-                        "description": "1-3 most relevant problems from the list"
+                        "confidence": {
+                            "type": "number",
+                            "minimum": 0,
+                            "maximum": 1,
+                            "description": "Confidence score for this classification"
+                        }
                     },
-                    "reasoning": {
-                        "type": "string",
-                        "description": "Brief explanation of why these categories were chosen"
-                    }
+                    "required": ["problem_id", "confidence"],
+                    "additionalProperties": False
                 },
-                "required": ["suggested_problems", "reasoning"],
-                "additionalProperties": False
+                "minItems": 1,
+                "maxItems": 3,
+                "description": "1-3 most relevant problems from the list"
             }
-        }
-
-        # Create system message for context
-        system_message = """You are a psychological assistant helping to categorize user problems.
-        The user will describe their problem in Russian, and you need to suggest 1-3 most relevant categories.
-        Focus on the core psychological issue, not surface symptoms.
-        Return categories ordered by relevance (highest confidence first)."""
-
-        # Create user prompt
-        prompt = f"""Пользователь описал свою проблему: "{user_text}"
-
-Проанализируй текст и предложи 1-3 наиболее подходящие категории из списка:
+        },
+        "required": ["suggested_problems"],
+        "additionalProperties": False
+    }
+}
+
+# Static instructions and the category list live in the system message so the prompt prefix
+# is identical on every call and can be served from the provider's prompt cache.
+# Bump CLASSIFY_PROMPT_CACHE_KEY version when the prompt or categories change.
+CLASSIFY_PROMPT_CACHE_KEY = "classify_problem_v1"
+
+# Up to 3 {problem_id, confidence} items fit well within this limit
+CLASSIFY_MAX_TOKENS = 128
+
+CLASSIFY_SYSTEM_MESSAGE = """You are a psychological assistant helping to categorize user problems.
+The user will describe their problem in Russian, and you need to suggest 1-3 most relevant categories.
+Focus on the core psychological issue, not surface symptoms.
+Return categories ordered by relevance (highest confidence first).
+
+Проанализируй текст пользователя и предложи 1-3 наиболее подходящие категории из списка:
 - anxiety: Тревога, беспокойство
 - apathy: Потеря интереса, апатия / Сниженное настроение
 - mood: Пониженное настроение
@@ -99,66 +230,289 @@ async def classify_user_problem(user_text: str) -> List[Tuple[str, str]]:
 
 Выбери категории, которые лучше всего описывают суть проблемы пользователя."""
 
-        # Get structured response from LLM
-        response, _ = openrouter_client.get_structured_response(
-            prompt=prompt,
-            json_schema=json_schema,
-            system_message=system_message
-        )
+# User turn carries only the dynamic part (single {user_text} placeholder)
+CLASSIFY_PROMPT_TEMPLATE = 'Текст пользователя: "{user_text}"'
+
+# Similarity cache for classifications: similar descriptions reuse a previous LLM result
+# Format: deque of (ngram_counts, norm, suggestions), oldest entries are dropped first
+CLASSIFY_CACHE_MAX_SIZE = 1024
+CLASSIFY_SIMILARITY_THRESHOLD = 0.9
+classification_cache = deque(maxlen=CLASSIFY_CACHE_MAX_SIZE)
+# Classification runs in worker threads: the deque is only read or changed under this lock
+classification_cache_lock = threading.Lock()
+
+
+def get_text_ngrams(text: str) -> Counter:
+    """Character trigram counts of normalized text (cheap stand-in for a sentence embedding)"""
+    normalized = f" {' '.join(text.lower().split())} "
+    return Counter(normalized[i:i + 3] for i in range(len(normalized) - 2))
+
+
+def find_similar_classification(user_text: str):
+    """Return cached suggestions for a text similar enough to user_text, or None"""
+    ngrams = get_text_ngrams(user_text)
+    norm = math.sqrt(sum(c * c for c in ngrams.values()))
+    if not norm:
+        return None
+
+    # Snapshot, so other threads can store results while this one compares
+    with classification_cache_lock:
+        cached_entries = tuple(classification_cache)
+
+    best_score, best_suggestions = 0.0, None
+    for cached_ngrams, cached_norm, suggestions in cached_entries:
+        dot = sum(count * cached_ngrams[gram] for gram, count in ngrams.items() if gram in cached_ngrams)
+        score = dot / (norm * cached_norm)
+        if score > best_score:
+            best_score, best_suggestions = score, suggestions
+
+    if best_score >= CLASSIFY_SIMILARITY_THRESHOLD:
+        return list(best_suggestions)
+    return None
+
+
+def store_classification(user_text: str, suggestions: List[Tuple[str, str]]):
+    """Remember LLM classification result for similar future texts"""
+    ngrams = get_text_ngrams(user_text)
+    norm = math.sqrt(sum(c * c for c in ngrams.values()))
+    if norm:
+        with classification_cache_lock:
+            classification_cache.append((ngrams, norm, tuple(suggestions)))
+
+
+# Unambiguous keywords routed without the LLM (matched against normalized lowercase text)
+# More specific categories go before the general ones they overlap with (panic before anxiety)
+KEYWORD_RULES: Final = (
+    (re.compile(r"бессонниц|не\s+могу\s+(?:за)?снуть|плохо\s+сплю|не\s+высыпаюсь"), "sleep"),
+    (re.compile(r"паник|паническ"), "panic"),
+    (re.compile(r"социофоб|социальн\w*\s+тревог"), "social_anxiety"),
+    (re.compile(r"\bокр\b|навязчив"), "ocd"),
+    (re.compile(r"тревог|тревожн"), "anxiety"),
+    (re.compile(r"прокрастин"), "procrastination"),
+    (re.compile(r"выгора|выгорел"), "burnout"),
+    (re.compile(r"перфекцион"), "perfectionism"),
+    (re.compile(r"апати"), "apathy"),
+    (re.compile(r"самокрити|чувств\w*\s+вин"), "self_criticism"),
+    (re.compile(r"вспышк\w*\s+гнева|раздражительн"), "anger"),
+)
+
+
+def match_keyword_problems(user_text: str) -> Tuple[Tuple[str, str], ...]:
+    """Return up to 3 categories whose keywords occur in normalized text (empty if none)"""
+    suggestions = []
+    for pattern, problem_id in KEYWORD_RULES:
+        if pattern.search(user_text):
+            suggestions.append((PROBLEM_MAP[problem_id], problem_id))
+            if len(suggestions) == 3:
+                break
+    return tuple(suggestions)
+
+
+# Classification metrics (exposed on /metrics, see main.py)
+# kind: keyword (rule match) | exact (LRU hit) | semantic (similar text) | miss (LLM call)
+CLASSIFY_CACHE_LOOKUPS = prometheus_client.Counter(
+    "classify_cache_lookups_total", "Problem classification cache lookups", ["kind"]
+)
+CLASSIFY_LATENCY = prometheus_client.Histogram(
+    "classify_seconds", "Problem classification latency", ["outcome"]
+)
+
+# Outcome of the current classification, set by classify_normalized_text in the worker thread
+classify_outcome = threading.local()
+
+
+def normalize_problem_text(user_text: str) -> str:
+    """Normalize text for exact-match caching (lowercase, collapsed whitespace)"""
+    return unicodedata.normalize('NFC', ' '.join(user_text.lower().split()))[:512]
+
+
+@lru_cache(maxsize=4096)
+def classify_normalized_text(user_text: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    Classify normalized problem text into 1-3 categories from PROBLEMS
+    Results are LRU-cached by exact text; errors propagate so they are never cached
+    """
+    # Similar text was already classified - skip the LLM round-trip
+    cached = find_similar_classification(user_text)
+    if cached:
+        logger.info("Classify cache hit (similar text)")
+        classify_outcome.kind = 'semantic'
+        return tuple(cached)
+
+    logger.info("Classify cache miss, calling LLM")
+    classify_outcome.kind = 'miss'
+
+    # Get structured response from LLM
+    response, _ = get_client().get_structured_response(
+        prompt=CLASSIFY_PROMPT_TEMPLATE.format(user_text=user_text),
+        json_schema=CLASSIFY_SCHEMA,
+        system_message=CLASSIFY_SYSTEM_MESSAGE,
+        prompt_cache_key=CLASSIFY_PROMPT_CACHE_KEY,
+        temperature_structured=0,  # Deterministic output for identical inputs
+        max_tokens=CLASSIFY_MAX_TOKENS
+    )
+
+    # Convert response to list of tuples
+    suggestions = []
+    for item in response.get("suggested_problems", []):
+        problem_id = item["problem_id"]
+        if problem_id in PROBLEM_MAP:
+            display_name = PROBLEM_MAP[problem_id]
+            suggestions.append((display_name, problem_id))
+
+    # Return at least one suggestion, fallback to general anxiety if empty
+    if not suggestions:
+        return ((PROBLEM_MAP["anxiety"], "anxiety"),)
+
+    suggestions = suggestions[:3]  # Ensure max 3 suggestions
+    store_classification(user_text, suggestions)
+
+    return tuple(suggestions)
+
+
+def classify_with_metrics(user_text: str) -> Tuple[Tuple[str, str], ...]:
+    """Run classify_normalized_text and record cache outcome and latency"""
+    # Stays 'exact' if the LRU cache answers without running the function body
+    classify_outcome.kind = 'exact'
+    start = time.perf_counter()
+    try:
+        suggestions = classify_normalized_text(user_text)
+    except Exception:
+        CLASSIFY_LATENCY.labels('error').observe(time.perf_counter() - start)
+        raise
+
+    kind = classify_outcome.kind
+    CLASSIFY_CACHE_LOOKUPS.labels(kind).inc()
+    CLASSIFY_LATENCY.labels(kind).observe(time.perf_counter() - start)
+    return suggestions
 
-        # Convert response to list of tuples
-        suggestions = []
-        for item in response.get("suggested_problems", []):
-            problem_id = item["problem_id"]
-            if problem_id in PROBLEM_MAP:
-                display_name = PROBLEM_MAP[problem_id]
-                suggestions.append((display_name, problem_id))
 
-        # Return at least one suggestion, fallback to general anxiety if empty
-        if not suggestions:
-            suggestions = [(PROBLEM_MAP["anxiety"], "anxiety")]
+def clear_classification_cache():
+    """Drop all cached classifications (e.g. after changing the prompt or categories)"""
+    classify_normalized_text.cache_clear()
+    with classification_cache_lock:
+        classification_cache.clear()
+
+
+async def classify_user_problem(user_text: str) -> List[Tuple[str, str]]:
+    """
+    Use LLM to classify user's problem text into 1-3 categories from PROBLEMS
+    Returns list of tuples (display_name, problem_id)
+    """
+    try:
+        normalized_text = normalize_problem_text(user_text)
+
+        # Obvious cases are resolved by keywords without any cache lookup or LLM call
+        suggestions = match_keyword_problems(normalized_text)
+        if suggestions:
+            CLASSIFY_CACHE_LOOKUPS.labels('keyword').inc()
+            return list(suggestions)
 
-        return suggestions[:3]  # Ensure max 3 suggestions
+        # Blocking LLM call runs in a worker thread so the event loop keeps serving other users
+        suggestions = await asyncio.to_thread(classify_with_metrics, normalized_text)
+        return list(suggestions)
 
-    except Exception as e:
-        print(f"Error classifying problem: {e}")
+    except Exception:
+        logger.exception("Error classifying problem")
         # Return default suggestion on error
         return [(PROBLEM_MAP["anxiety"], "anxiety")]
 
 
+# Static buttons shared by all suggestion keyboards
+BTN_CONFIRM_SELECTED = types.InlineKeyboardButton("✅ Подтвердить выбранные", callback_data="other_confirm_selected:confirm")
+BTN_CUSTOM = types.InlineKeyboardButton("✏️ Указать своё название проблемы", callback_data="other_custom:name")
+BTN_ANOTHER = types.InlineKeyboardButton("➕ Другая проблема", callback_data="other_another:add")
+BTN_DONE = types.InlineKeyboardButton("✅ Готово", callback_data="other_done:finish")
+BTN_MENU = types.InlineKeyboardButton("📱 Главное меню", callback_data="menu:show")
+BTN_ADD_MORE = types.InlineKeyboardButton("➕ Добавить ещё проблему", callback_data="other_another:add")
+
+MAX_PROBLEMS_REACHED_TEXT = (
+    f"Ты уже добавил(а) максимальное количество дополнительных проблем ({MAX_OTHER_PROBLEMS}).\n"
+    "Нажми 'Готово', чтобы продолжить."
+)
+
+
+@lru_cache(maxsize=512)
+def build_suggestion_rows(suggestions: tuple, selected: frozenset) -> tuple:
+    """
+    Build button rows for suggestions keyboard (memoized per suggestions/selection combination)
+    suggestions: ((display_name, problem_id), ...), selected: frozenset of selected problem_ids
+    """
+    rows = []
+
+    # Suggested problem buttons with checkmarks for selected items
+    for display_name, problem_id in suggestions:
+        button_text = f"{'✓ ' if problem_id in selected else ''}{display_name}"
+        rows.append((types.InlineKeyboardButton(button_text, callback_data=f"other_suggest:{problem_id}"),))
+
+    # Only show "Confirm selected" if at least one suggestion is selected,
+    # navigation options only when nothing is selected
+    if selected:
+        rows.append((BTN_CONFIRM_SELECTED,))
+        rows.append((BTN_CUSTOM,))
+    else:
+        rows.append((BTN_CUSTOM,))
+        rows.append((BTN_ANOTHER,))
+        rows.append((BTN_DONE,))
+
+    # Menu button at the bottom
+    rows.append((BTN_MENU,))
+    return tuple(rows)
+
+
+def suggestion_markup_signature(state: OtherProblemState) -> tuple:
+    """Everything the suggestions keyboard is rendered from"""
+    return tuple(state.suggestions), frozenset(state.selected_suggestions)
+
+
+def build_suggestion_markup(state: OtherProblemState) -> types.InlineKeyboardMarkup:
+    """Fresh markup for the suggestions keyboard built from cached button rows"""
+    rows = build_suggestion_rows(*suggestion_markup_signature(state))
+    return types.InlineKeyboardMarkup(keyboard=[list(row) for row in rows])
+
+
+def build_added_options_markup(can_add_more: bool) -> types.InlineKeyboardMarkup:
+    """Markup shown after problems were added: add more (if allowed), done, menu"""
+    rows = [[BTN_ADD_MORE]] if can_add_more else []
+    rows.append([BTN_DONE])
+    rows.append([BTN_MENU])
+    return types.InlineKeyboardMarkup(keyboard=rows)
+
+
+async def keep_typing(bot, chat_id, interval=4):
+    """Re-send typing action until cancelled (Telegram shows it for about 5 seconds)"""
+    while True:
+        try:
+            await bot.send_chat_action(chat_id, 'typing')
+        except Exception as e:
+            logger.warning("Error sending typing action: %s", e)
+        await asyncio.sleep(interval)
+
+
 async def start_other_problem_flow(bot, chat_id, user_id, username):
     """
     Start the "other problem" flow when user selects "➕ Другая проблема"
     """
     try:
         # Check if user has already added max number of other problems
-        if user_id in user_other_problem_states:
-            other_count = user_other_problem_states[user_id].get('other_count', 0)
-            if other_count >= MAX_OTHER_PROBLEMS:
+        state = await user_other_problem_states.get(user_id)
+        if state:
+            if state.other_count >= MAX_OTHER_PROBLEMS:
                 await bot.send_message(
                     chat_id,
-                    f"Ты уже добавил(а) максимальное количество дополнительных проблем ({MAX_OTHER_PROBLEMS}).\n"
-                    "Нажми 'Готово', чтобы продолжить."
+                    MAX_PROBLEMS_REACHED_TEXT
                 )
                 return False
 
         # Initialize or update user state
-        if user_id not in user_other_problem_states:
-            user_other_problem_states[user_id] = {
-                'step': 'awaiting_text',
-                'username': username,
-                'text': '',
-                'suggestions': [],
-                'selected_problems': [],
-                'selected_suggestions': [],  # Track which suggestions are selected
-                'other_count': 0
-            }
+        if not state:
+            state = OtherProblemState(username=username)
         else:
-            user_other_problem_states[user_id]['step'] = 'awaiting_text'
-            user_other_problem_states[user_id]['selected_suggestions'] = []  # Reset selections
+            state.step = 'awaiting_text'
+            state.selected_suggestions = set()  # Reset selections
+        await user_other_problem_states.set(user_id, state)
 
         # Request problem description from user
-        from universal_menu import get_menu_button
         markup = get_menu_button()
 
         await bot.send_message(
@@ -169,8 +523,8 @@ async def start_other_problem_flow(bot, chat_id, user_id, username):
 
         return True
 
-    except Exception as e:
-        print(f"Error starting other problem flow: {e}")
+    except Exception:
+        logger.exception("Error starting other problem flow")
         return False
 
 
@@ -183,109 +537,59 @@ async def handle_other_problem_text(bot, message):
         chat_id = message.chat.id
 
         # Check if user is in other problem flow
-        if user_id not in user_other_problem_states:
+        state = await user_other_problem_states.get(user_id)
+        if not state:
             return False
 
-        state = user_other_problem_states[user_id]
-
-        if state['step'] != 'awaiting_text' and state['step'] != 'awaiting_custom_name':
+        if state.step != 'awaiting_text' and state.step != 'awaiting_custom_name':
             return False
 
         text = message.text.strip()
 
-        if state['step'] == 'awaiting_text':
+        if state.step == 'awaiting_text':
             # Store user's problem description
-            state['text'] = text
+            state.text = text
 
-            # Show typing indicator while processing
-            await bot.send_chat_action(chat_id, 'typing')
-
-            # Get LLM suggestions
-            suggestions = await classify_user_problem(text)
-            state['suggestions'] = suggestions
+            # Show typing indicator while processing (concurrently with classification)
+            typing_task = asyncio.create_task(keep_typing(bot, chat_id))
+            try:
+                # Get LLM suggestions
+                suggestions = await classify_user_problem(text)
+            finally:
+                typing_task.cancel()
+            state.suggestions = suggestions
 
             # Create response message
             response_text = f"Спасибо, я услышал(а): {text}\n\nПохоже на (можешь выбрать несколько):"
 
             # Create inline keyboard with suggestions and actions
-            markup = types.InlineKeyboardMarkup()
+            markup = build_suggestion_markup(state)
 
-            # Add suggested problem buttons with checkmarks for selected items
-            for display_name, problem_id in suggestions:
-                # Check if this suggestion is already selected
-                is_selected = problem_id in state.get('selected_suggestions', [])
-                button_text = f"{'✓ ' if is_selected else ''}{display_name}"
-
-                btn = types.InlineKeyboardButton(
-                    button_text,
-                    callback_data=f"other_suggest:{problem_id}"
-                )
-                markup.add(btn)
-
-            # Add action buttons
-            # Only show "Confirm selected" if at least one suggestion is selected
-            if state.get('selected_suggestions'):
-                btn_confirm_selected = types.InlineKeyboardButton(
-                    "✅ Подтвердить выбранные",
-                    callback_data="other_confirm_selected:confirm"
-                )
-                markup.add(btn_confirm_selected)
-
-                btn_custom = types.InlineKeyboardButton(
-                    "✏️ Указать своё название проблемы",
-                    callback_data="other_custom:name"
-                )
-                markup.add(btn_custom)
-            else:
-                # Show navigation options only when nothing is selected
-                btn_custom = types.InlineKeyboardButton(
-                    "✏️ Указать своё название проблемы",
-                    callback_data="other_custom:name"
-                )
-                btn_another = types.InlineKeyboardButton(
-                    "➕ Другая проблема",
-                    callback_data="other_another:add"
-                )
-                btn_done = types.InlineKeyboardButton(
-                    "✅ Готово",
-                    callback_data="other_done:finish"
-                )
-
-                markup.add(btn_custom)
-                markup.add(btn_another)
-                markup.add(btn_done)
-
-            # Add menu button at the bottom
-            btn_menu = types.InlineKeyboardButton(
-                "📱 Главное меню",
-                callback_data="menu:show"
-            )
-            markup.add(btn_menu)
-
-            await bot.send_message(chat_id, response_text, reply_markup=markup)
+            sent = await bot.send_message(chat_id, response_text, reply_markup=markup)
+            shown_suggestion_markups[chat_id] = (sent.message_id, suggestion_markup_signature(state))
 
             # Update step
-            state['step'] = 'choosing_option'
+            state.step = 'choosing_option'
+            await user_other_problem_states.set(user_id, state)
 
-        elif state['step'] == 'awaiting_custom_name':
+        elif state.step == 'awaiting_custom_name':
             # Handle custom problem name
             custom_name = text
 
             # Add to selected problems
-            if 'selected_problems' not in state:
-                state['selected_problems'] = []
-            state['selected_problems'].append(custom_name)
+            state.selected_problems.append(custom_name)
 
             # Increment other problem count
-            state['other_count'] = state.get('other_count', 0) + 1
+            state.other_count += 1
+            await user_other_problem_states.set(user_id, state)
 
             # Show confirmation and next options
             await show_problem_added_options(bot, chat_id, user_id, custom_name)
 
         return True
 
-    except Exception as e:
-        print(f"Error handling other problem text: {e}")
+    except Exception:
+        logger.exception("Error handling other problem text")
         return False
 
 
@@ -301,53 +605,50 @@ async def handle_other_problem_callback(bot, callback_query, action, data):
         # Answer callback immediately
         await bot.answer_callback_query(callback_query.id, show_alert=False)
 
-        if user_id not in user_other_problem_states:
+        state = await user_other_problem_states.get(user_id)
+        if not state:
             return
 
-        state = user_other_problem_states[user_id]
-
         if action == "other_suggest":
             # Toggle selection of the suggested problem
             problem_id = data
 
-            # Initialize selected_suggestions if not exists
-            if 'selected_suggestions' not in state:
-                state['selected_suggestions'] = []
-
             # Toggle the selection
-            if problem_id in state['selected_suggestions']:
-                state['selected_suggestions'].remove(problem_id)
-            else:
-                state['selected_suggestions'].append(problem_id)
+            state.selected_suggestions ^= {problem_id}
+            await user_other_problem_states.set(user_id, state)
 
             # Update the message to show current selection state
-            await update_suggestion_buttons(bot, callback_query, state)
+            schedule_suggestion_update(bot, callback_query, user_id)
 
         elif action == "other_confirm_selected":
+            # Selection is final, pending markup edit is no longer needed
+            cancel_suggestion_update(user_id)
+
             # User confirmed selected suggestions
-            if 'selected_suggestions' in state and state['selected_suggestions']:
-                # Add all selected problems to the selected_problems list
-                if 'selected_problems' not in state:
-                    state['selected_problems'] = []
+            if state.selected_suggestions:
+                # Keep the order in which suggestions were shown
+                selected_names = [
+                    display_name for display_name, p_id in state.suggestions
+                    if p_id in state.selected_suggestions
+                ]
 
-                for problem_id in state['selected_suggestions']:
-                    if problem_id in PROBLEM_MAP:
-                        display_name = PROBLEM_MAP[problem_id]
-                        if display_name not in state['selected_problems']:
-                            state['selected_problems'].append(display_name)
+                # Add all selected problems to the selected_problems list
+                for display_name in selected_names:
+                    if display_name not in state.selected_problems:
+                        state.selected_problems.append(display_name)
 
                 # Increment other problem count
-                state['other_count'] = state.get('other_count', 0) + 1
+                state.other_count += 1
+                await user_other_problem_states.set(user_id, state)
 
                 # Show confirmation
-                selected_names = [PROBLEM_MAP[p_id] for p_id in state['selected_suggestions'] if p_id in PROBLEM_MAP]
                 await show_problems_added_options(bot, chat_id, user_id, selected_names)
 
         elif action == "other_custom":
             # User wants to specify custom name
-            state['step'] = 'awaiting_custom_name'
+            state.step = 'awaiting_custom_name'
+            await user_other_problem_states.set(user_id, state)
 
-            from universal_menu import get_menu_button
             markup = get_menu_button()
 
             await bot.send_message(
@@ -359,12 +660,10 @@ async def handle_other_problem_callback(bot, callback_query, action, data):
         elif action == "other_another":
             # User wants to add another problem
             # Check limit
-            other_count = state.get('other_count', 0)
-            if other_count >= MAX_OTHER_PROBLEMS:
+            if state.other_count >= MAX_OTHER_PROBLEMS:
                 await bot.send_message(
                     chat_id,
-                    f"Ты уже добавил(а) максимальное количество дополнительных проблем ({MAX_OTHER_PROBLEMS}).\n"
-                    "Нажми 'Готово', чтобы продолжить."
+                    MAX_PROBLEMS_REACHED_TEXT
                 )
             else:
                 # Always start a new full problem flow
@@ -376,71 +675,59 @@ async def handle_other_problem_callback(bot, callback_query, action, data):
             # Finish other problem flow and return to main goal flow
             await finish_other_problem_flow(bot, chat_id, user_id)
 
-    except Exception as e:
-        print(f"Error handling other problem callback: {e}")
+    except Exception:
+        logger.exception("Error handling other problem callback")
 
 
-async def update_suggestion_buttons(bot, callback_query, state):
+def cancel_suggestion_update(user_id):
+    """Cancel pending suggestion markup edit for the user"""
+    task = pending_suggestion_updates.pop(user_id, None)
+    if task and not task.done():
+        task.cancel()
+
+
+def schedule_suggestion_update(bot, callback_query, user_id):
     """
-    Update the suggestion buttons to reflect current selection state
+    Schedule suggestion markup edit; a newer toggle replaces the pending edit
+    """
+    cancel_suggestion_update(user_id)
+    pending_suggestion_updates[user_id] = asyncio.create_task(
+        debounced_suggestion_update(bot, callback_query, user_id)
+    )
+
+
+async def debounced_suggestion_update(bot, callback_query, user_id):
+    """
+    Wait for more toggles, then edit the markup once with the latest state
     """
     try:
-        chat_id = callback_query.message.chat.id
-        message_id = callback_query.message.message_id
+        await asyncio.sleep(SUGGESTION_EDIT_DEBOUNCE)
+    except asyncio.CancelledError:
+        return
 
-        # Recreate the markup with updated selection state
-        markup = types.InlineKeyboardMarkup()
+    if pending_suggestion_updates.get(user_id) is asyncio.current_task():
+        del pending_suggestion_updates[user_id]
 
-        # Add suggested problem buttons with checkmarks for selected items
-        for display_name, problem_id in state.get('suggestions', []):
-            is_selected = problem_id in state.get('selected_suggestions', [])
-            button_text = f"{'✓ ' if is_selected else ''}{display_name}"
+    state = await user_other_problem_states.get(user_id)
+    if state:
+        await update_suggestion_buttons(bot, callback_query, state)
 
-            btn = types.InlineKeyboardButton(
-                button_text,
-                callback_data=f"other_suggest:{problem_id}"
-            )
-            markup.add(btn)
-
-        # Add action buttons
-        # Only show "Confirm selected" if at least one suggestion is selected
-        if state.get('selected_suggestions'):
-            btn_confirm_selected = types.InlineKeyboardButton(
-                "✅ Подтвердить выбранные",
-                callback_data="other_confirm_selected:confirm"
-            )
-            markup.add(btn_confirm_selected)
 
-            btn_custom = types.InlineKeyboardButton(
-                "✏️ Указать своё название проблемы",
-                callback_data="other_custom:name"
-            )
-            markup.add(btn_custom)
-        else:
-            # Show navigation options only when nothing is selected
-            btn_custom = types.InlineKeyboardButton(
-                "✏️ Указать своё название проблемы",
-                callback_data="other_custom:name"
-            )
-            btn_another = types.InlineKeyboardButton(
-                "➕ Другая проблема",
-                callback_data="other_another:add"
-            )
-            btn_done = types.InlineKeyboardButton(
-                "✅ Готово",
-                callback_data="other_done:finish"
-            )
+async def update_suggestion_buttons(bot, callback_query, state):
+    """
+    Update the suggestion buttons to reflect current selection state
+    """
+    try:
+        chat_id = callback_query.message.chat.id
+        message_id = callback_query.message.message_id
 
-            markup.add(btn_custom)
-            markup.add(btn_another)
-            markup.add(btn_done)
+        # Toggles cancelled each other out - the message already shows this selection
+        shown = (message_id, suggestion_markup_signature(state))
+        if shown_suggestion_markups.get(chat_id) == shown:
+            return
 
-        # Add menu button at the bottom (for both cases)
-        btn_menu = types.InlineKeyboardButton(
-            "📱 Главное меню",
-            callback_data="menu:show"
-        )
-        markup.add(btn_menu)
+        # Recreate the markup with updated selection state
+        markup = build_suggestion_markup(state)
 
         # Update the message
         await bot.edit_message_reply_markup(
@@ -448,9 +735,10 @@ async def update_suggestion_buttons(bot, callback_query, state):
             message_id=message_id,
             reply_markup=markup
         )
+        shown_suggestion_markups[chat_id] = shown
 
-    except Exception as e:
-        print(f"Error updating suggestion buttons: {e}")
+    except Exception:
+        logger.exception("Error updating suggestion buttons")
 
 
 async def show_problems_added_options(bot, chat_id, user_id, problem_names):
@@ -458,12 +746,11 @@ async def show_problems_added_options(bot, chat_id, user_id, problem_names):
     Show options after problems have been added (supports multiple)
     """
     try:
-        state = user_other_problem_states.get(user_id)
+        state = await user_other_problem_states.get(user_id)
         if not state:
             return
 
-        other_count = state.get('other_count', 0)
-        remaining = MAX_OTHER_PROBLEMS - other_count
+        remaining = MAX_OTHER_PROBLEMS - state.other_count
 
         # Format message for single or multiple problems
         if isinstance(problem_names, list):
@@ -478,38 +765,18 @@ async def show_problems_added_options(bot, chat_id, user_id, problem_names):
         else:
             message += "Ты добавил(а) максимальное количество проблем."
 
-        # Create buttons
-        markup = types.InlineKeyboardMarkup()
-
-        if remaining > 0:
-            btn_another = types.InlineKeyboardButton(
-                "➕ Добавить ещё проблему",
-                callback_data="other_another:add"
-            )
-            markup.add(btn_another)
-
-        btn_done = types.InlineKeyboardButton(
-            "✅ Готово",
-            callback_data="other_done:finish"
-        )
-        markup.add(btn_done)
-
-        # Add menu button at the bottom
-        btn_menu = types.InlineKeyboardButton(
-            "📱 Главное меню",
-            callback_data="menu:show"
-        )
-        markup.add(btn_menu)
+        markup = build_added_options_markup(remaining > 0)
 
         await bot.send_message(chat_id, message, reply_markup=markup)
 
         # Reset step for potential next problem
-        state['step'] = 'choosing_option'
+        state.step = 'choosing_option'
         # Clear selected suggestions for next round
-        state['selected_suggestions'] = []
+        state.selected_suggestions = set()
+        await user_other_problem_states.set(user_id, state)
 
-    except Exception as e:
-        print(f"Error showing problems added options: {e}")
+    except Exception:
+        logger.exception("Error showing problems added options")
 
 
 async def show_problem_added_options(bot, chat_id, user_id, problem_name):
@@ -525,14 +792,11 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
     Finish the other problem flow and return to main goal flow
     """
     try:
-        from goal import user_goal_states
-        from greeting import user_states
-
-        if user_id not in user_other_problem_states:
+        state = await user_other_problem_states.get(user_id)
+        if not state:
             return
 
-        state = user_other_problem_states[user_id]
-        selected_problems = state.get('selected_problems', [])
+        selected_problems = state.selected_problems
 
         # Add selected problems to goal state
         if user_id in user_goal_states and selected_problems:
@@ -550,7 +814,7 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
                 if problem not in goal_state['problems']:
                     goal_state['problems'].append(problem)
                     # Check if this is a standard problem from PROBLEMS list
-                    if problem in [display_name for display_name, _ in PROBLEMS]:
+                    if problem in PROBLEM_DISPLAY_NAMES:
                         has_standard_problems = True
                         standard_problems.append(problem)
 
@@ -562,7 +826,7 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
             )
 
             # Get username for both cases
-            username = state.get('username', 'Unknown')
+            username = state.username or 'Unknown'
 
             # If we have standard problems, automatically set ratings and go to exercises
             if has_standard_problems:
@@ -582,9 +846,6 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
                 user_states[user_id]['problems'] = goal_state['problems']
                 user_states[user_id]['problem_ratings'] = goal_state['problem_ratings']
 
-                # Import and show exercise recommendations
-                from exercise import show_exercise_recommendations
-
                 # Show exercise recommendations for problems with ratings
                 await show_exercise_recommendations(
                     bot, chat_id, user_id, username,
@@ -592,9 +853,6 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
                 )
             else:
                 # For custom problems without exercises, show main menu directly
-                from universal_menu import show_main_menu
-                from greeting import user_states
-
                 # Save to persistent user states
                 if user_id not in user_states:
                     user_states[user_id] = {'username': username}
@@ -609,7 +867,6 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
                 form_of_address = user_states[user_id].get('form', 'ты')
 
                 # Show main menu with menu button
-                from universal_menu import get_menu_button
                 markup = get_menu_button()
 
                 await bot.send_message(
@@ -619,10 +876,11 @@ async def finish_other_problem_flow(bot, chat_id, user_id):
                 )
 
         # Clean up state
-        del user_other_problem_states[user_id]
+        cancel_suggestion_update(user_id)
+        await user_other_problem_states.delete(user_id)
 
-    except Exception as e:
-        print(f"Error finishing other problem flow: {e}")
+    except Exception:
+        logger.exception("Error finishing other problem flow")
 
 
 def register_handlers():
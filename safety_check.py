@@ -4,20 +4,28 @@ Safety and crisis detection module for therapy bot
 Provides unified safety checks across all user inputs
 """
 
-import json
-import hashlib
-from datetime import datetime, timedelta
-from typing import Tuple, Optional, Dict, Any, List
+import asyncio
+import atexit
+import csv
+import orjson
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from types import MappingProxyType
+from typing import Tuple, Optional, List
 from telebot import types
 import os
-from openpyxl import load_workbook
 
 # Import LLM client for analysis
-from openrouter import OpenRouterClient
+from openrouter import get_client
 from config import MODEL_SIMPLE, TEMPERATURE, TOP_P, TOP_K
 
 # Cache for LLM responses to avoid repeated checks
-safety_cache: Dict[str, Dict[str, Any]] = {}
+# Bounded LRU: least recently used entries are dropped first
+# Format: {cache_key: (result, time.monotonic() when stored)}
+safety_cache: "OrderedDict[str, Tuple[Tuple[bool, Optional[str]], float]]" = OrderedDict()
+SAFETY_CACHE_MAX_SIZE = 10000
 CACHE_TTL_MINUTES = 30  # Shorter cache for safety checks
 
 # Crisis keywords for quick detection (Russian)
@@ -47,6 +55,89 @@ CRISIS_KEYWORDS = [
     'энергия бьёт ключом', 'не могу остановиться'
 ]
 
+# Crisis type of a keyword: the first type with a fragment contained in the keyword
+CRISIS_TYPE_RULES = (
+    ("Суицидальные мысли", ('суицид', 'самоубийство', 'покончить', 'не хочу жить', 'умереть', 'убить себя')),
+    ("Самоповреждение", ('порезать', 'причинить себе боль', 'резать руки')),
+    ("Психотические симптомы", ('голоса', 'преследуют', 'следят', 'читают мысли', 'управляют', 'заговор')),
+    ("Диссоциация", ('не чувствую тело', 'это не я', 'не реально', 'как во сне')),
+    ("Кризис зависимости", ('передозировка', 'ломка', 'абстиненция')),
+    ("Маниакальное состояние", ('не сплю неделю', 'я бог', 'энергия бьёт'))
+)
+
+# All crisis keywords as one alternation - the regex engine finds any of them in a single pass
+# (case-insensitive, so the message doesn't need a lowercased copy)
+CRISIS_KEYWORDS_RE = re.compile('|'.join(map(re.escape, CRISIS_KEYWORDS)), re.IGNORECASE)
+
+# Crisis detections are appended to a CSV sidecar and moved into their Excel files in batches
+SAFETY_LOG_FILE = 'safety_log.xlsx'
+CRISIS_LOG_CSV_FILE = 'safety_log.csv'
+CRISIS_LOG_FLUSH_INTERVAL = 300  # seconds
+
+# Short conversational filler ("ок", "спасибо", "да, понятно") - never sent to the LLM check
+FILLER_MAX_LENGTH = 15
+FILLER_RE = re.compile(
+    r'^(?:(?:да|нет|ок|окей|ага|спасибо|понятно|хорошо|ладно|привет|пока)[\s.,!)]*)+$',
+    re.IGNORECASE
+)
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+# Texts without any letters once links and /commands are removed (emoji, digits, bare links, commands)
+# carry nothing for the LLM check; text in any script, including transliteration, is still checked
+LINK_OR_COMMAND_RE = re.compile(r'https?://\S+|www\.\S+|(?<!\S)/\w+(?:@\w+)?')
+LETTER_RE = re.compile(r'[^\W\d_]')
+
+# Context of a crisis detection -> Excel file its detection is logged to (safety_log.xlsx otherwise)
+CRISIS_LOG_FILES = MappingProxyType({
+    'exercise': 'exercises.xlsx',
+    'diary': 'diary.xlsx',
+    'checkin': 'check_in.xlsx',
+    'mvst': 'mvst.xlsx'
+})
+
+# Prompts of the LLM safety check (built once at import)
+# The system prompt is a byte-identical prefix of every call so providers can cache it;
+# the text and its context only go into the user prompt.
+# Bump SAFETY_CHECK_PROMPT_CACHE_KEY version when the system prompt changes.
+SAFETY_CHECK_PROMPT_CACHE_KEY = "safety_check_v1"
+
+# At most this many LLM safety checks in flight at once, so bursts don't flood the provider
+SAFETY_CHECK_MAX_CONCURRENT = 16
+safety_llm_semaphore = asyncio.Semaphore(SAFETY_CHECK_MAX_CONCURRENT)
+
+# LLM safety checks currently running
+# Format: {cache_key: asyncio.Task returning (crisis_detected, crisis_type, confidence)}
+safety_checks_in_flight = {}
+SAFETY_CHECK_SYSTEM_PROMPT = """Ты опытный кризисный психолог. Проанализируй текст на наличие кризисных индикаторов.
+
+КРИТИЧЕСКИЕ индикаторы (требуют немедленной помощи):
+1. Суицидальные мысли/намерения/планы
+2. Самоповреждение (порезы, ожоги, удары)
+3. Психотические симптомы (галлюцинации, бред, паранойя)
+4. Тяжёлая диссоциация/дереализация
+5. Острый кризис зависимости
+6. Маниакальные/экстремальные состояния
+
+ВАЖНО:
+- Будь внимателен к скрытым признакам (безнадёжность, ощущение ловушки)
+- Учитывай контекст: упоминание прошлого опыта vs текущее состояние
+- Избегай ложных срабатываний на обсуждение темы в общем
+
+Ответь JSON:
+{
+  "crisis_detected": boolean,
+  "crisis_type": "тип кризиса" или null,
+  "confidence": float (0.0-1.0),
+  "reasoning": "краткое обоснование"
+}"""
+
+SAFETY_CHECK_PROMPT_TEMPLATE = """Контекст: {context}
+
+Текст для анализа:
+{text}
+
+Определи наличие кризисных индикаторов."""
+
 # Help resources text
 HELP_TEXT = """
 🆘 **Экстренная помощь:**
@@ -68,27 +159,110 @@ HELP_TEXT = """
 """
 
 
+# Crisis support intro by crisis type ({name} is the user's name)
+CRISIS_INTRO_TEMPLATES = MappingProxyType({
+    "Суицидальные мысли": "{name}, я очень беспокоюсь за тебя. Эти мысли - сигнал о сильной боли.",
+    "Самоповреждение": "{name}, я вижу, что тебе очень тяжело. Боль, которую ты чувствуешь, реальна.",
+    "Психотические симптомы": "{name}, то, что ты описываешь, требует профессиональной поддержки.",
+    "Диссоциация": "{name}, ощущение отключения от реальности может быть очень пугающим.",
+    "Кризис зависимости": "{name}, борьба с зависимостью требует профессиональной помощи.",
+    "Маниакальное состояние": "{name}, важно стабилизировать твоё состояние с помощью специалиста.",
+    "Кризисное состояние": "{name}, я чувствую, что тебе сейчас очень трудно."
+})
+DEFAULT_CRISIS_INTRO = "{name}, я переживаю за тебя."
+
+# Everything in the crisis support message after the intro
+CRISIS_SUPPORT_TEXT_SUFFIX = (
+    "\n\n"
+    "Сейчас самое важное - получить поддержку. "
+    "Ты не один/одна в этом.\n\n"
+    f"{HELP_TEXT}"
+)
+
+# Default names that get replaced by a warmer address in crisis support
+PLACEHOLDER_USER_NAMES = frozenset({"User", "Друг"})
+
+HOTLINES_TEXT = (
+    "📞 **Горячие линии помощи:**\n\n"
+    "**Бесплатно и анонимно:**\n"
+    "☎️ **8-800-2000-122** - Детский телефон доверия\n"
+    "☎️ **8-800-100-0191** - Кризисная линия\n"
+    "☎️ **051** - С городского телефона\n\n"
+    "**Экстренно:**\n"
+    "🚨 **112** - Единая служба\n"
+    "🚑 **103** - Скорая помощь\n\n"
+    "Не стесняйся обращаться за помощью. "
+    "Специалисты готовы поддержать тебя. 💙"
+)
+
+# Buttons and static keyboards (built once at import)
+BTN_MENU = types.InlineKeyboardButton("📱 Главное меню", callback_data="menu:show")
+BTN_HOTLINES = types.InlineKeyboardButton("🆘 Горячие линии", callback_data="safety:hotlines")
+
+MENU_MARKUP = types.InlineKeyboardMarkup()
+MENU_MARKUP.add(BTN_MENU)
+
+
+def build_continue_markup(button_text: str, callback_data: str) -> types.InlineKeyboardMarkup:
+    """Keyboard to continue an activity after crisis support, plus the main menu button"""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
+    markup.add(BTN_MENU)
+    return markup
+
+
+# Context of "continue later" -> keyboard to continue it (MENU_MARKUP otherwise)
+CONTINUE_MARKUPS = MappingProxyType({
+    "goal_setting": build_continue_markup("➡️ Продолжить постановку цели", "goal_continue:after_safety"),
+    "exercise": build_continue_markup("➡️ Продолжить упражнение", "exercise_continue:after_safety")
+})
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase text without punctuation and with collapsed whitespace"""
+    return ' '.join(PUNCTUATION_RE.sub(' ', text.lower()).split())
+
+
 def get_cache_key(text: str, check_type: str) -> str:
-    """Generate cache key for safety check results"""
-    text_hash = hashlib.md5(text.encode()).hexdigest()[:8]
-    return f"safety_{check_type}_{text_hash}"
+    """Generate cache key for safety check results (texts differing only in case/punctuation share a key)"""
+    # The cache lives in this process only, so the built-in (per-process salted) str hash is enough
+    return f"safety_{check_type}_{hash(normalize_text(text)) & 0xffffffffffffffff:x}"
 
 
 def get_cached_result(cache_key: str) -> Optional[Tuple[bool, Optional[str]]]:
-    """Get cached safety check result if still valid"""
-    if cache_key in safety_cache:
-        cached_data = safety_cache[cache_key]
-        if datetime.now() - cached_data['timestamp'] < timedelta(minutes=CACHE_TTL_MINUTES):
-            return cached_data['result']
-    return None
+    """Get cached safety check result if still valid (expired entries are dropped)"""
+    cached = safety_cache.get(cache_key)
+    if cached is None:
+        return None
+
+    result, stored_at = cached
+    if time.monotonic() - stored_at >= CACHE_TTL_MINUTES * 60:
+        del safety_cache[cache_key]
+        return None
+
+    safety_cache.move_to_end(cache_key)
+    return result
 
 
 def set_cached_result(cache_key: str, result: Tuple[bool, Optional[str]]) -> None:
-    """Store safety check result in cache"""
-    safety_cache[cache_key] = {
-        'result': result,
-        'timestamp': datetime.now()
-    }
+    """Store safety check result in cache, evicting the least recently used entry when full"""
+    safety_cache[cache_key] = (result, time.monotonic())
+    safety_cache.move_to_end(cache_key)
+    if len(safety_cache) > SAFETY_CACHE_MAX_SIZE:
+        safety_cache.popitem(last=False)
+
+
+def get_keyword_crisis_type(keyword: str) -> str:
+    """Crisis type of a crisis keyword (first rule with a fragment inside the keyword)"""
+    for crisis_type, fragments in CRISIS_TYPE_RULES:
+        if any(fragment in keyword for fragment in fragments):
+            return crisis_type
+    return "Кризисное состояние"
+
+
+# Crisis type of every crisis keyword, labelled once at import
+# Format: {keyword: crisis_type}
+CRISIS_KEYWORD_TYPES = MappingProxyType({keyword: get_keyword_crisis_type(keyword) for keyword in CRISIS_KEYWORDS})
 
 
 def quick_keyword_check(text: str) -> Tuple[bool, Optional[str]]:
@@ -96,26 +270,10 @@ def quick_keyword_check(text: str) -> Tuple[bool, Optional[str]]:
     Quick check for crisis keywords without LLM
     Returns: (crisis_detected, crisis_type)
     """
-    text_lower = text.lower()
-
-    # Check each keyword
-    for keyword in CRISIS_KEYWORDS:
-        if keyword in text_lower:
-            # Determine crisis type
-            if any(word in keyword for word in ['суицид', 'самоубийство', 'покончить', 'не хочу жить', 'умереть', 'убить себя']):
-                return True, "Суицидальные мысли"
-            elif any(word in keyword for word in ['порезать', 'причинить себе боль', 'резать руки']):
-                return True, "Самоповреждение"
-            elif any(word in keyword for word in ['голоса', 'преследуют', 'следят', 'читают мысли', 'управляют', 'заговор']):
-                return True, "Психотические симптомы"
-            elif any(word in keyword for word in ['не чувствую тело', 'это не я', 'не реально', 'как во сне']):
-                return True, "Диссоциация"
-            elif any(word in keyword for word in ['передозировка', 'ломка', 'абстиненция']):
-                return True, "Кризис зависимости"
-            elif any(word in keyword for word in ['не сплю неделю', 'я бог', 'энергия бьёт']):
-                return True, "Маниакальное состояние"
-            else:
-                return True, "Кризисное состояние"
+    # One scan of the text for all keywords at once
+    match = CRISIS_KEYWORDS_RE.search(text)
+    if match:
+        return True, CRISIS_KEYWORD_TYPES.get(match.group().lower(), "Кризисное состояние")
 
     return False, None
 
@@ -134,63 +292,57 @@ async def check_text_safety(text: str, context: str = "general") -> Tuple[bool,
     if not text or len(text.strip()) < 3:
         return False, None, 0.0
 
-    # Check cache first
+    # Quick keyword check first - on every text, so a cached verdict never bypasses it
+    # (the cache key ignores case and punctuation, which the keyword patterns don't)
+    keyword_crisis, keyword_type = quick_keyword_check(text)
+    if keyword_crisis:
+        return True, keyword_type, 0.95
+
+    # Cached LLM verdict for the same normalized text
     cache_key = get_cache_key(text, context)
     cached = get_cached_result(cache_key)
     if cached:
         crisis_detected, crisis_type = cached
         return crisis_detected, crisis_type, 1.0 if crisis_detected else 0.0
 
-    # Quick keyword check first
-    keyword_crisis, keyword_type = quick_keyword_check(text)
-    if keyword_crisis:
-        set_cached_result(cache_key, (True, keyword_type))
-        return True, keyword_type, 0.95
+    # Conversational filler carries no risk worth an LLM round-trip
+    stripped = text.strip()
+    if len(stripped) < FILLER_MAX_LENGTH and FILLER_RE.match(stripped):
+        return False, None, 0.0
+
+    # No words to analyze
+    if not LETTER_RE.search(LINK_OR_COMMAND_RE.sub(' ', text)):
+        return False, None, 0.0
 
     # LLM analysis for more nuanced detection
+    # Identical texts checked at the same time share one LLM call
+    task = safety_checks_in_flight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(llm_safety_check(text, context, cache_key))
+        safety_checks_in_flight[cache_key] = task
+        task.add_done_callback(lambda _: safety_checks_in_flight.pop(cache_key, None))
+    # Shielded: a cancelled caller must not cancel the check the others are waiting for
+    return await asyncio.shield(task)
+
+
+async def llm_safety_check(text: str, context: str, cache_key: str) -> Tuple[bool, Optional[str], float]:
+    """LLM part of check_text_safety; caches its verdict under cache_key"""
     try:
-        system_prompt = """Ты опытный кризисный психолог. Проанализируй текст на наличие кризисных индикаторов.
-
-КРИТИЧЕСКИЕ индикаторы (требуют немедленной помощи):
-1. Суицидальные мысли/намерения/планы
-2. Самоповреждение (порезы, ожоги, удары)
-3. Психотические симптомы (галлюцинации, бред, паранойя)
-4. Тяжёлая диссоциация/дереализация
-5. Острый кризис зависимости
-6. Маниакальные/экстремальные состояния
-
-ВАЖНО:
-- Будь внимателен к скрытым признакам (безнадёжность, ощущение ловушки)
-- Учитывай контекст: упоминание прошлого опыта vs текущее состояние
-- Избегай ложных срабатываний на обсуждение темы в общем
-
-Ответь JSON:
-{
-  "crisis_detected": boolean,
-  "crisis_type": "тип кризиса" или null,
-  "confidence": float (0.0-1.0),
-  "reasoning": "краткое обоснование"
-}"""
-
-        user_prompt = f"""Контекст: {context}
-
-Текст для анализа:
-{text}
-
-Определи наличие кризисных индикаторов."""
-
-        client = OpenRouterClient()
-        response, _ = client.get_simple_response(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            model=MODEL_SIMPLE,
-            temperature=0.1,  # Low temperature for consistency
-            top_p=TOP_P,
-            top_k=TOP_K
-        )
+        # Blocking HTTP call - run it in a worker thread so other chats aren't stalled
+        async with safety_llm_semaphore:
+            response, _ = await asyncio.to_thread(
+                get_client().get_simple_response,
+                system_prompt=SAFETY_CHECK_SYSTEM_PROMPT,
+                user_prompt=SAFETY_CHECK_PROMPT_TEMPLATE.format(context=context, text=text),
+                model=MODEL_SIMPLE,
+                temperature=0.1,  # Low temperature for consistency
+                top_p=TOP_P,
+                top_k=TOP_K,
+                prompt_cache_key=SAFETY_CHECK_PROMPT_CACHE_KEY
+            )
 
         # Parse JSON response
-        result = json.loads(response.strip())
+        result = orjson.loads(response)
 
         crisis_detected = result.get('crisis_detected', False)
         crisis_type = result.get('crisis_type')
@@ -206,8 +358,8 @@ async def check_text_safety(text: str, context: str = "general") -> Tuple[bool,
 
     except Exception as e:
         print(f"Error in LLM safety check: {e}")
-        # On error, rely on keyword check only
-        return keyword_crisis, keyword_type, 0.5 if keyword_crisis else 0.0
+        # On error, rely on keyword check only (it found nothing if we got here)
+        return False, None, 0.0
 
 
 async def show_crisis_support(bot, chat_id: int, user_name: str, crisis_type: str,
@@ -225,39 +377,19 @@ async def show_crisis_support(bot, chat_id: int, user_name: str, crisis_type: st
     """
     try:
         # Ensure user_name is not empty or default
-        if not user_name or user_name == "User" or user_name == "Друг":
+        if not user_name or user_name in PLACEHOLDER_USER_NAMES:
             user_name = "Дорогой друг"
 
         # Personalized message based on crisis type
-        intro_messages = {
-            "Суицидальные мысли": f"{user_name}, я очень беспокоюсь за тебя. Эти мысли - сигнал о сильной боли.",
-            "Самоповреждение": f"{user_name}, я вижу, что тебе очень тяжело. Боль, которую ты чувствуешь, реальна.",
-            "Психотические симптомы": f"{user_name}, то, что ты описываешь, требует профессиональной поддержки.",
-            "Диссоциация": f"{user_name}, ощущение отключения от реальности может быть очень пугающим.",
-            "Кризис зависимости": f"{user_name}, борьба с зависимостью требует профессиональной помощи.",
-            "Маниакальное состояние": f"{user_name}, важно стабилизировать твоё состояние с помощью специалиста.",
-            "Кризисное состояние": f"{user_name}, я чувствую, что тебе сейчас очень трудно."
-        }
-
-        intro = intro_messages.get(crisis_type, f"{user_name}, я переживаю за тебя.")
-
-        text = (
-            f"{intro}\n\n"
-            f"Сейчас самое важное - получить поддержку. "
-            f"Ты не один/одна в этом.\n\n"
-            f"{HELP_TEXT}"
-        )
+        intro = CRISIS_INTRO_TEMPLATES.get(crisis_type, DEFAULT_CRISIS_INTRO).format(name=user_name)
+
+        text = intro + CRISIS_SUPPORT_TEXT_SUFFIX
 
         # Create buttons
         markup = types.InlineKeyboardMarkup()
 
         # Emergency help button
-        btn_help = types.InlineKeyboardButton(
-            "🆘 Горячие линии",
-            callback_data="safety:hotlines"
-        )
-
-        markup.add(btn_help)
+        markup.add(BTN_HOTLINES)
 
         # Add continue option if allowed
         if continue_after:
@@ -268,11 +400,7 @@ async def show_crisis_support(bot, chat_id: int, user_name: str, crisis_type: st
             markup.add(btn_continue)
 
         # Always add main menu button
-        btn_menu = types.InlineKeyboardButton(
-            "📱 Главное меню",
-            callback_data="menu:show"
-        )
-        markup.add(btn_menu)
+        markup.add(BTN_MENU)
 
         await bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
 
@@ -286,6 +414,7 @@ async def log_crisis_detection(user_id: int, username: str, crisis_type: str,
                                context: str, text_sample: str, file_path: str = None):
     """
     Log crisis detection to appropriate Excel file
+    (appended to a CSV sidecar, see flush_crisis_log_csv)
 
     Args:
         user_id: User's Telegram ID
@@ -298,62 +427,118 @@ async def log_crisis_detection(user_id: int, username: str, crisis_type: str,
     try:
         # Determine file based on context if not provided
         if not file_path:
-            file_map = {
-                'exercise': 'exercises.xlsx',
-                'diary': 'diary.xlsx',
-                'checkin': 'check_in.xlsx',
-                'mvst': 'mvst.xlsx'
-            }
-            file_path = file_map.get(context, 'safety_log.xlsx')
-
-        # Create safety log if needed
-        if file_path == 'safety_log.xlsx' and not os.path.exists(file_path):
-            from openpyxl import Workbook
-            wb = Workbook()
-            ws = wb.active
-            ws.title = 'Safety Log'
-
-            headers = [
-                'User ID', 'Username', 'Detection Time', 'Crisis Type',
-                'Context', 'Text Sample', 'Action Taken'
-            ]
-            for col, header in enumerate(headers, 1):
-                ws.cell(row=1, column=col, value=header)
-            wb.save(file_path)
-
-        # Log to file
-        if os.path.exists(file_path):
-            wb = load_workbook(file_path)
-
-            # Find or create safety sheet
-            if 'Safety' in wb.sheetnames:
-                ws = wb['Safety']
-            else:
-                ws = wb.create_sheet('Safety')
-                # Add headers if new sheet
-                headers = [
-                    'User ID', 'Username', 'Detection Time', 'Crisis Type',
-                    'Context', 'Text Sample'
-                ]
-                for col, header in enumerate(headers, 1):
-                    ws.cell(row=1, column=col, value=header)
-
-            # Add crisis record
-            next_row = ws.max_row + 1
-            ws.cell(row=next_row, column=1, value=user_id)
-            ws.cell(row=next_row, column=2, value=username)
-            ws.cell(row=next_row, column=3, value=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            ws.cell(row=next_row, column=4, value=crisis_type)
-            ws.cell(row=next_row, column=5, value=context)
-            ws.cell(row=next_row, column=6, value=text_sample[:200])  # Limit sample length
-
-            wb.save(file_path)
-            print(f"Logged crisis detection for user {user_id} in {file_path}")
+            file_path = CRISIS_LOG_FILES.get(context, SAFETY_LOG_FILE)
+
+        with open(CRISIS_LOG_CSV_FILE, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow([
+                file_path,
+                user_id,
+                username,
+                datetime.now().isoformat(sep=' ', timespec='seconds'),
+                crisis_type,
+                context,
+                text_sample[:200]  # Limit sample length
+            ])
+        print(f"Logged crisis detection for user {user_id} (pending write to {file_path})")
 
     except Exception as e:
         print(f"Error logging crisis detection: {e}")
 
 
+def init_safety_log_file():
+    """Create safety_log.xlsx with headers"""
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Safety Log'
+
+    headers = [
+        'User ID', 'Username', 'Detection Time', 'Crisis Type',
+        'Context', 'Text Sample', 'Action Taken'
+    ]
+    for col, header in enumerate(headers, 1):
+        ws.cell(row=1, column=col, value=header)
+    wb.save(SAFETY_LOG_FILE)
+
+
+def append_crisis_rows_to_excel(file_path: str, rows: List[list]):
+    """Append crisis records (sidecar rows without the file column) to the Safety sheet of an Excel file"""
+    from openpyxl import load_workbook
+    # Create safety log if needed
+    if file_path == SAFETY_LOG_FILE and not os.path.exists(file_path):
+        init_safety_log_file()
+
+    if not os.path.exists(file_path):
+        print(f"Skipped {len(rows)} crisis record(s): {file_path} does not exist")
+        return
+
+    wb = load_workbook(file_path)
+
+    # Find or create safety sheet
+    if 'Safety' in wb.sheetnames:
+        ws = wb['Safety']
+    else:
+        ws = wb.create_sheet('Safety')
+        # Add headers if new sheet
+        headers = [
+            'User ID', 'Username', 'Detection Time', 'Crisis Type',
+            'Context', 'Text Sample'
+        ]
+        for col, header in enumerate(headers, 1):
+            ws.cell(row=1, column=col, value=header)
+
+    for user_id, *values in rows:
+        ws.append((int(user_id) if user_id else None, *values))
+
+    wb.save(file_path)
+    print(f"Crisis detections flushed to {file_path}: {len(rows)} row(s)")
+
+
+def flush_crisis_log_csv():
+    """
+    Append crisis detections from the CSV sidecar to their Excel files.
+    Records whose workbook could not be written stay in the sidecar for the next flush,
+    so a failure on one file neither loses them nor duplicates the ones already saved elsewhere.
+    """
+    try:
+        if not os.path.exists(CRISIS_LOG_CSV_FILE) or os.path.getsize(CRISIS_LOG_CSV_FILE) == 0:
+            return
+
+        with open(CRISIS_LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+
+        # One load/save per workbook
+        rows_by_file = {}
+        for file_path, *values in rows:
+            rows_by_file.setdefault(file_path, []).append(values)
+
+        pending = []
+        for file_path, file_rows in rows_by_file.items():
+            try:
+                append_crisis_rows_to_excel(file_path, file_rows)
+            except Exception as e:
+                print(f"Error flushing crisis detections to {file_path}: {e}")
+                pending.extend([file_path, *values] for values in file_rows)
+
+        # Saved records are in the workbooks now - keep only the rest in the sidecar
+        with open(CRISIS_LOG_CSV_FILE, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(pending)
+
+    except Exception as e:
+        print(f"Error flushing crisis detections: {e}")
+
+
+# Don't leave crisis detections only in the sidecar on shutdown
+atexit.register(flush_crisis_log_csv)
+
+
+async def run_crisis_log_flusher():
+    """Background task: flush logged crisis detections every CRISIS_LOG_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(CRISIS_LOG_FLUSH_INTERVAL)
+        flush_crisis_log_csv()
+
+
 def register_safety_handlers(bot):
     """Register safety-related callback handlers"""
 
@@ -369,27 +554,7 @@ def register_safety_handlers(bot):
 
             if data == 'hotlines':
                 # Show hotlines again with emphasis
-                text = (
-                    "📞 **Горячие линии помощи:**\n\n"
-                    "**Бесплатно и анонимно:**\n"
-                    "☎️ **8-800-2000-122** - Детский телефон доверия\n"
-                    "☎️ **8-800-100-0191** - Кризисная линия\n"
-                    "☎️ **051** - С городского телефона\n\n"
-                    "**Экстренно:**\n"
-                    "🚨 **112** - Единая служба\n"
-                    "🚑 **103** - Скорая помощь\n\n"
-                    "Не стесняйся обращаться за помощью. "
-                    "Специалисты готовы поддержать тебя. 💙"
-                )
-
-                markup = types.InlineKeyboardMarkup()
-                btn_menu = types.InlineKeyboardButton(
-                    "📱 Главное меню",
-                    callback_data="menu:show"
-                )
-                markup.add(btn_menu)
-
-                await bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+                await bot.send_message(chat_id, HOTLINES_TEXT, reply_markup=MENU_MARKUP, parse_mode='Markdown')
 
 
             elif data.startswith('continue_'):
@@ -402,27 +567,8 @@ def register_safety_handlers(bot):
                     "Если почувствуешь ухудшение - сразу используй горячие линии."
                 )
 
-                markup = types.InlineKeyboardMarkup()
-                
-                # Add context-specific continue buttons
-                if context == "goal_setting":
-                    btn_continue = types.InlineKeyboardButton(
-                        "➡️ Продолжить постановку цели",
-                        callback_data="goal_continue:after_safety"
-                    )
-                    markup.add(btn_continue)
-                elif context == "exercise":
-                    btn_continue = types.InlineKeyboardButton(
-                        "➡️ Продолжить упражнение",
-                        callback_data="exercise_continue:after_safety"
-                    )
-                    markup.add(btn_continue)
-                
-                btn_menu = types.InlineKeyboardButton(
-                    "📱 Главное меню",
-                    callback_data="menu:show"
-                )
-                markup.add(btn_menu)
+                # Context-specific continue button, if any
+                markup = CONTINUE_MARKUPS.get(context, MENU_MARKUP)
 
                 await bot.send_message(chat_id, text, reply_markup=markup)
 
@@ -436,6 +582,8 @@ __all__ = [
     'check_text_safety',
     'show_crisis_support',
     'log_crisis_detection',
+    'flush_crisis_log_csv',
+    'run_crisis_log_flusher',
     'register_safety_handlers',
     'HELP_TEXT'
 ]
\ No newline at end of file
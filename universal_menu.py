@@ -4,7 +4,56 @@ Universal menu module accessible from any point in the bot
 Provides quick access to: switch protocol, emotion diary, help and hotlines
 """
 
+import asyncio
+import logging
+import time
+from types import MappingProxyType
+
+import orjson
 from telebot import types
+from greeting import user_states, get_user_name_and_form
+from goal import start_goal_setting, user_goal_states
+from diary import show_diary_prompt
+from mvst import show_mindfulness_practices
+from my_progress import show_my_progress
+from check_in import show_check_in_progress
+# exercise imports this module at load time, so it is imported where used
+
+logger = logging.getLogger(__name__)
+
+# Read-only stand-in for a user without saved state (one dict lookup per access, no KeyError)
+NO_USER_STATE = MappingProxyType({})
+
+# Callback data prefixes handled by this module (the action follows the prefix)
+MENU_CALLBACK_PREFIX = 'menu:'
+CHANGE_CALLBACK_PREFIX = 'change:'
+
+# Callback data of the buttons that open the main menu as a new message
+MENU_SHOW_CALLBACK = "menu:show"
+
+
+class StaticInlineKeyboardMarkup(types.InlineKeyboardMarkup):
+    """Inline keyboard that doesn't change once built: serialized (with orjson) on the first send only"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.json = None
+
+    def to_json(self):
+        if self.json is None:
+            self.json = orjson.dumps(self.to_dict()).decode()
+        return self.json
+
+
+# Navigation keyboards (built once at import and shared - callers must not add rows to them)
+BTN_MENU = types.InlineKeyboardButton("📱 Главное меню", callback_data=MENU_SHOW_CALLBACK)
+BTN_BACK = types.InlineKeyboardButton("⬅️ Назад", callback_data="go_back")
+
+MENU_BUTTON_MARKUP = StaticInlineKeyboardMarkup()
+MENU_BUTTON_MARKUP.add(BTN_MENU)
+
+BACK_AND_MENU_MARKUP = StaticInlineKeyboardMarkup()
+BACK_AND_MENU_MARKUP.row(BTN_BACK, BTN_MENU)
 
 
 def get_menu_button():
@@ -12,13 +61,7 @@ def get_menu_button():
     Returns inline keyboard markup with menu button
     Used to provide menu access from any point in the bot
     """
-    markup = types.InlineKeyboardMarkup()
-    btn_menu = types.InlineKeyboardButton(
-        "📱 Главное меню",
-        callback_data="menu:show"
-    )
-    markup.add(btn_menu)
-    return markup
+    return MENU_BUTTON_MARKUP
 
 
 def get_back_and_menu_buttons():
@@ -26,17 +69,7 @@ def get_back_and_menu_buttons():
     Returns inline keyboard markup with back and menu buttons
     Used in multi-step flows to provide navigation options
     """
-    markup = types.InlineKeyboardMarkup()
-    btn_back = types.InlineKeyboardButton(
-        "⬅️ Назад",
-        callback_data="go_back"
-    )
-    btn_menu = types.InlineKeyboardButton(
-        "📱 Главное меню",
-        callback_data="menu:show"
-    )
-    markup.row(btn_back, btn_menu)
-    return markup
+    return BACK_AND_MENU_MARKUP
 
 
 HELP_TEXT = (
@@ -65,40 +98,112 @@ HELP_TEXT = (
 )
 
 
-async def show_change_options(bot, chat_id, user_id, username):
+# Main menu buttons, one per row: (text, menu action)
+MAIN_MENU_BUTTONS = (
+    ("🧭 Выбрать упражнение", "select_exercise"),  # based on user problems
+    ("🎯 Изменить цель/проблемы", "set_goal"),
+    ("📖 Мой прогресс", "my_progress"),
+    ("🌙 Майндфулнесс-практика (MBCT)", "mindfulness"),
+    ("💬 Дневник эмоций и мыслей", "diary"),
+    ("📈 Оценить прогресс", "assess_progress"),
+    ("🆘 Помощь и горячие линии", "help"),
+    ("🚧 Обращение в техподдержку", "technical_support")
+)
+
+
+def build_main_menu_markup():
+    """Main menu keyboard"""
+    # Rows go to the constructor positionally: the keyword is keyboard= in older telebot, inline_keyboard= in newer
+    return StaticInlineKeyboardMarkup([
+        [types.InlineKeyboardButton(button_text, callback_data=f"{MENU_CALLBACK_PREFIX}{action}")]
+        for button_text, action in MAIN_MENU_BUTTONS
+    ])
+
+
+# Static keyboards (built once at import and shared between messages)
+MAIN_MENU_MARKUP = build_main_menu_markup()
+
+CHANGE_OPTIONS_MARKUP = StaticInlineKeyboardMarkup()
+CHANGE_OPTIONS_MARKUP.add(types.InlineKeyboardButton("🎯 Цель терапии", callback_data="change:goal_only"))
+CHANGE_OPTIONS_MARKUP.add(types.InlineKeyboardButton("🧭 Трудности", callback_data="change:problems_only"))
+CHANGE_OPTIONS_MARKUP.add(types.InlineKeyboardButton("↩️ Вернуться в меню", callback_data="menu:back"))
+
+BTN_BACK_TO_MENU = types.InlineKeyboardButton("🔙 Назад в меню", callback_data=MENU_SHOW_CALLBACK)
+
+BACK_TO_MENU_MARKUP = StaticInlineKeyboardMarkup()
+BACK_TO_MENU_MARKUP.add(BTN_BACK_TO_MENU)
+
+TECHNICAL_SUPPORT_TEXT = "🚧 Обращение в техподдержку\n\nСвяжись с нами по контакту ниже:"
+TECHNICAL_SUPPORT_MARKUP = StaticInlineKeyboardMarkup()
+TECHNICAL_SUPPORT_MARKUP.add(types.InlineKeyboardButton("👤 @zhuravlstrogo", url="https://t.me/zhuravlstrogo"))
+TECHNICAL_SUPPORT_MARKUP.add(BTN_BACK_TO_MENU)
+
+
+class SendRateLimiter:
     """
-    Show options to change goal and/or problems
-    Called from 'Изменить цель/проблемы' menu button
+    Spaces out outgoing messages: at most rate_per_second overall and one per chat_interval per chat.
+    Callers wait for their slot in call order, so messages to a chat keep their order.
     """
-    try:
-        text = "Что хочешь изменить?"
 
-        markup = types.InlineKeyboardMarkup()
+    def __init__(self, rate_per_second, chat_interval):
+        self.interval = 1 / rate_per_second
+        self.chat_interval = chat_interval
+        self.next_send = 0.0
+        # Format: {chat_id: time.monotonic() from which the chat may get its next message}
+        self.next_send_by_chat = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        # A chat waiting for its own slot doesn't hold up the other chats
+        global_slot = max(now, self.next_send)
+        send_at = max(global_slot, self.next_send_by_chat.get(chat_id, 0.0))
+        self.next_send = global_slot + self.interval
+        self.next_send_by_chat[chat_id] = send_at + self.chat_interval
+
+        # Forget chats whose slot has passed
+        if len(self.next_send_by_chat) > SEND_LIMITER_MAX_CHATS:
+            self.next_send_by_chat = {c: t for c, t in self.next_send_by_chat.items() if t > now}
+
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
 
-        btn_goal = types.InlineKeyboardButton(
-            "🎯 Цель терапии",
-            callback_data="change:goal_only"
-        )
-        btn_problems = types.InlineKeyboardButton(
-            "🧭 Трудности",
-            callback_data="change:problems_only"
-        )
-        btn_back = types.InlineKeyboardButton(
-            "↩️ Вернуться в меню",
-            callback_data="menu:show"
-        )
 
-        markup.add(btn_goal)
-        markup.add(btn_problems)
-        markup.add(btn_back)
+# Telegram limits: about 30 messages per second overall and 1 per second in a chat
+SEND_LIMITER_MAX_CHATS = 10000
+send_limiter = SendRateLimiter(rate_per_second=30, chat_interval=1.0)
+
+
+async def send_or_edit_message(bot, chat_id, text, markup, message_id=None):
+    """
+    Replace the text of message_id in place when given (new message if that fails or no id).
+    Paced by send_limiter to stay under Telegram's rate limits.
+    """
+    await send_limiter.wait(chat_id)
+    if message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+            return
+        except Exception as e:
+            logger.info("Could not edit menu message %s, sending a new one: %s", message_id, e)
+
+    await bot.send_message(chat_id, text, reply_markup=markup)
+
+
+async def show_change_options(bot, chat_id, user_id, username, message_id=None):
+    """
+    Show options to change goal and/or problems
+    Called from 'Изменить цель/проблемы' menu button (replaces the menu message when message_id is given)
+    """
+    try:
+        text = "Что хочешь изменить?"
 
-        await bot.send_message(chat_id, text, reply_markup=markup)
+        await send_or_edit_message(bot, chat_id, text, CHANGE_OPTIONS_MARKUP, message_id)
 
-    except Exception as e:
-        print(f"Error showing change options: {e}")
+    except Exception:
+        logger.exception("Error showing change options")
 
 
-async def show_main_menu(bot, chat_id, user_id, username, user_name, form_of_address='ты'):
+async def show_main_menu(bot, chat_id, user_id, username, user_name, form_of_address='ты', message_id=None):
     """
     Display the universal main menu with all options
 
@@ -109,73 +214,140 @@ async def show_main_menu(bot, chat_id, user_id, username, user_name, form_of_add
         username: Username
         user_name: User's name
         form_of_address: Form of address ('ты' or 'Вы')
+        message_id: Menu screen message to replace with the main menu (new message if None)
     """
     try:
         text = "🧭 Главное меню"
 
-        markup = types.InlineKeyboardMarkup()
-
-        # Select exercise button (based on user problems)
-        btn_exercise = types.InlineKeyboardButton(
-            "🧭 Выбрать упражнение",
-            callback_data="menu:select_exercise"
-        )
-
-        # Change goal/problems button
-        btn_goal = types.InlineKeyboardButton(
-            "🎯 Изменить цель/проблемы",
-            callback_data="menu:set_goal"
-        )
-
-        # My progress button
-        btn_progress = types.InlineKeyboardButton(
-            "📖 Мой прогресс",
-            callback_data="menu:my_progress"
-        )
-
-        # Mindfulness practice button
-        btn_mindfulness = types.InlineKeyboardButton(
-            "🌙 Майндфулнесс-практика (MBCT)",
-            callback_data="menu:mindfulness"
-        )
-
-        # Emotion diary button
-        btn_diary = types.InlineKeyboardButton(
-            "💬 Дневник эмоций и мыслей",
-            callback_data="menu:diary"
-        )
-
-        # Assess progress button
-        btn_assess = types.InlineKeyboardButton(
-            "📈 Оценить прогресс",
-            callback_data="menu:assess_progress"
-        )
-
-        # Help and hotlines button
-        btn_help = types.InlineKeyboardButton(
-            "🆘 Помощь и горячие линии",
-            callback_data="menu:help"
-        )
-
-        # Technical support button
-        btn_support = types.InlineKeyboardButton(
-            "🚧 Обращение в техподдержку",
-            callback_data="menu:technical_support"
-        )
-
-        markup.row(btn_exercise)
-        markup.row(btn_goal)
-        markup.row(btn_progress)
-        markup.row(btn_mindfulness)
-        markup.row(btn_diary)
-        markup.row(btn_assess)
-        markup.row(btn_help)
-        markup.row(btn_support)
-
-        await bot.send_message(chat_id, text, reply_markup=markup)
-
-    except Exception as e:
-        print(f"Error showing main menu: {e}")
+        await send_or_edit_message(bot, chat_id, text, MAIN_MENU_MARKUP, message_id)
+
+    except Exception:
+        logger.exception("Error showing main menu")
+
+
+async def handle_menu_show(bot, chat_id, user_id, username, message_id=None):
+    """Just show the menu when menu button is clicked"""
+    # Clear exercise state if user was in the middle of an exercise
+    from exercise import user_exercise_states
+    user_exercise_states.pop(user_id, None)
+
+    user_name, form_of_address = get_user_name_and_form(user_id)
+    await show_main_menu(bot, chat_id, user_id, username, user_name, form_of_address, message_id)
+
+
+async def handle_menu_select_exercise(bot, chat_id, user_id, username):
+    """Show exercises for the user's problems, or ask for the problems first"""
+    # Check both states for existing problems
+    user_problems = None
+    problem_ratings = {}
+
+    # First check persistent user_states
+    state = user_states.get(user_id)
+    if state is not None:
+        user_problems = state.get('problems')
+        problem_ratings = state.get('problem_ratings', {})
+
+    # If not found, check temporary goal states
+    goal_state = user_goal_states.get(user_id) if not user_problems else None
+    if goal_state is not None:
+        user_problems = goal_state.get('problems')
+        problem_ratings = goal_state.get('problem_ratings', {})
+
+    if user_problems:
+        # User has problems - filter exercises by their problems
+        from exercise import show_exercise_recommendations
+        await show_exercise_recommendations(bot, chat_id, user_id, username, problem_ratings)
+    else:
+        # No problems defined - ask user to select problems only (not full goal setting)
+        text = "Чтобы подобрать упражнения, мне нужно знать, над чем ты хочешь работать."
+        await send_or_edit_message(bot, chat_id, text, BACK_TO_MENU_MARKUP)
+
+        # Start goal setting process
+        await start_goal_setting(bot, chat_id, user_id, username)
+
+
+async def handle_menu_diary(bot, chat_id, user_id, username):
+    """Show diary prompt"""
+    # User's name from greeting
+    user_name = user_states.get(user_id, NO_USER_STATE).get('user_name', 'User')
+
+    await show_diary_prompt(bot, chat_id, user_id, username, user_name)
+
+
+def handle_menu_technical_support(bot, chat_id, user_id, username):
+    """Show technical support contact (returns the send to await)"""
+    return send_or_edit_message(bot, chat_id, TECHNICAL_SUPPORT_TEXT, TECHNICAL_SUPPORT_MARKUP)
+
+
+async def handle_menu_change_goal(bot, chat_id, user_id, username):
+    """Start goal setting to change goal only"""
+    # Clear old goal to force asking for new one
+    user_states.get(user_id, {}).pop('goal', None)
+
+    await start_goal_setting(bot, chat_id, user_id, username, skip_goal=False)
+
+
+def handle_menu_change_problems(bot, chat_id, user_id, username):
+    """Start goal setting to change problems only, skipping the goal (returns the coroutine to await)"""
+    return start_goal_setting(bot, chat_id, user_id, username, skip_goal=True)
+
+
+async def handle_menu_change_all(bot, chat_id, user_id, username):
+    """Start goal setting from beginning"""
+    # Clear all saved data
+    state = user_states.get(user_id)
+    if state is not None:
+        for key in ('goal', 'problems', 'problem_ratings'):
+            state.pop(key, None)
+
+    await start_goal_setting(bot, chat_id, user_id, username, skip_goal=False)
+
+
+def handle_menu_help(bot, chat_id, user_id, username):
+    """Show help and hotlines (returns the send to await)"""
+    return send_or_edit_message(bot, chat_id, HELP_TEXT, BACK_TO_MENU_MARKUP)
+
+
+# Callback acknowledgements still in flight (the event loop only keeps weak references to tasks)
+pending_callback_answers = set()
+
+
+def finish_callback_answer(task):
+    """Forget a finished acknowledgement and log it if it failed"""
+    pending_callback_answers.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Error answering callback query: %s", task.exception())
+
+
+def answer_callback_in_background(bot, callback_query):
+    """Acknowledge a callback query without waiting for Telegram's reply"""
+    task = asyncio.create_task(bot.answer_callback_query(callback_query.id))
+    pending_callback_answers.add(task)
+    task.add_done_callback(finish_callback_answer)
+
+
+# Menu action (callback data after "menu:") -> handler(bot, chat_id, user_id, username)
+# Handlers that only forward to another coroutine are plain functions returning it (one coroutine less per press)
+MENU_ACTIONS = {
+    'show': handle_menu_show,
+    'select_exercise': handle_menu_select_exercise,
+    'my_progress': show_my_progress,
+    'mindfulness': show_mindfulness_practices,
+    'diary': handle_menu_diary,
+    'assess_progress': show_check_in_progress,
+    'technical_support': handle_menu_technical_support,
+    'change_goal': handle_menu_change_goal,
+    'change_problems': handle_menu_change_problems,
+    'change_all': handle_menu_change_all,
+    'help': handle_menu_help
+}
+
+# Navigation between menu screens: these replace the menu message they were pressed on
+# Format: {menu action: handler(bot, chat_id, user_id, username, message_id)}
+MENU_SCREEN_ACTIONS = {
+    'set_goal': show_change_options,
+    'back': handle_menu_show
+}
 
 
 async def handle_menu_callback(bot, callback_query, menu_action):
@@ -192,154 +364,18 @@ async def handle_menu_callback(bot, callback_query, menu_action):
         username = callback_query.from_user.username or 'Unknown'
         chat_id = callback_query.message.chat.id
 
-        await bot.answer_callback_query(callback_query.id)
-
-        if menu_action == 'show':
-            # Just show the menu when menu button is clicked
-            from greeting import user_states
-
-            # Clear exercise state if user was in the middle of an exercise
-            from exercise import user_exercise_states
-            if user_id in user_exercise_states:
-                del user_exercise_states[user_id]
-
-            user_name = 'Друг'
-            form_of_address = 'ты'
-            if user_id in user_states and 'user_name' in user_states[user_id]:
-                user_name = user_states[user_id]['user_name']
-                form_of_address = user_states[user_id].get('form', 'ты')
-            await show_main_menu(bot, chat_id, user_id, username, user_name, form_of_address)
-
-        elif menu_action == 'select_exercise':
-            # Check if user has problems defined
-            from greeting import user_states
-            from goal import user_goal_states
-
-            # Check both states for existing problems
-            user_problems = None
-            problem_ratings = {}
-
-            # First check persistent user_states
-            if user_id in user_states:
-                user_problems = user_states[user_id].get('problems')
-                problem_ratings = user_states[user_id].get('problem_ratings', {})
-
-            # If not found, check temporary goal states
-            if not user_problems and user_id in user_goal_states:
-                user_problems = user_goal_states[user_id].get('problems')
-                problem_ratings = user_goal_states[user_id].get('problem_ratings', {})
-
-            if user_problems:
-                # User has problems - filter exercises by their problems
-                from exercise import show_exercise_recommendations
-                await show_exercise_recommendations(bot, chat_id, user_id, username, problem_ratings)
-            else:
-                # No problems defined - ask user to select problems only (not full goal setting)
-                text = "Чтобы подобрать упражнения, мне нужно знать, над чем ты хочешь работать."
-                markup = types.InlineKeyboardMarkup()
-                btn_back = types.InlineKeyboardButton(
-                    "🔙 Назад в меню",
-                    callback_data="menu:show"
-                )
-                markup.add(btn_back)
-                await bot.send_message(chat_id, text, reply_markup=markup)
-
-                # Start goal setting process
-                from goal import start_goal_setting
-                await start_goal_setting(bot, chat_id, user_id, username)
-
-        elif menu_action == 'set_goal':
-            # Show change options dialog
-            await show_change_options(bot, chat_id, user_id, username)
-
-        elif menu_action == 'my_progress':
-            # Show user progress
-            from my_progress import show_my_progress
-            await show_my_progress(bot, chat_id, user_id, username)
-
-        elif menu_action == 'mindfulness':
-            # Show mindfulness practices
-            from mvst import show_mindfulness_practices
-            await show_mindfulness_practices(bot, chat_id, user_id, username)
-
-        elif menu_action == 'diary':
-            # Import greeting to get user_name
-            from greeting import user_states
-            user_name = 'User'
-            if user_id in user_states:
-                user_name = user_states[user_id].get('user_name', 'User')
-
-            # Import and call diary prompt
-            from diary import show_diary_prompt
-            await show_diary_prompt(bot, chat_id, user_id, username, user_name)
-
-        elif menu_action == 'assess_progress':
-            # Show check-in progress
-            from check_in import show_check_in_progress
-            await show_check_in_progress(bot, chat_id, user_id, username)
-
-        elif menu_action == 'technical_support':
-            # Show technical support contact
-            markup = types.InlineKeyboardMarkup()
-            btn_contact = types.InlineKeyboardButton(
-                "👤 @zhuravlstrogo",
-                url="https://t.me/zhuravlstrogo"
-            )
-            btn_back = types.InlineKeyboardButton(
-                "🔙 Назад в меню",
-                callback_data="menu:show"
-            )
-            markup.add(btn_contact)
-            markup.add(btn_back)
-
-            support_text = "🚧 Обращение в техподдержку\n\nСвяжись с нами по контакту ниже:"
-            await bot.send_message(chat_id, support_text, reply_markup=markup)
-
-        elif menu_action == 'change_goal':
-            # Start goal setting to change goal only
-            from goal import start_goal_setting
-            from greeting import user_states
-
-            # Clear old goal to force asking for new one
-            if user_id in user_states and 'goal' in user_states[user_id]:
-                del user_states[user_id]['goal']
-
-            await start_goal_setting(bot, chat_id, user_id, username, skip_goal=False)
-
-        elif menu_action == 'change_problems':
-            # Start goal setting to change problems only (skip goal)
-            from goal import start_goal_setting
-            await start_goal_setting(bot, chat_id, user_id, username, skip_goal=True)
-
-        elif menu_action == 'change_all':
-            # Start goal setting from beginning
-            from goal import start_goal_setting
-            from greeting import user_states
-
-            # Clear all saved data
-            if user_id in user_states:
-                if 'goal' in user_states[user_id]:
-                    del user_states[user_id]['goal']
-                if 'problems' in user_states[user_id]:
-                    del user_states[user_id]['problems']
-                if 'problem_ratings' in user_states[user_id]:
-                    del user_states[user_id]['problem_ratings']
-
-            await start_goal_setting(bot, chat_id, user_id, username, skip_goal=False)
-
-        elif menu_action == 'help':
-            # Create markup with back to menu button
-            markup = types.InlineKeyboardMarkup()
-            btn_back = types.InlineKeyboardButton(
-                "🔙 Назад в меню",
-                callback_data="menu:show"
-            )
-            markup.add(btn_back)
-
-            await bot.send_message(chat_id, HELP_TEXT, reply_markup=markup)
-
-    except Exception as e:
-        print(f"Error handling menu callback: {e}")
+        # Acknowledge while the action runs instead of waiting for Telegram's reply first
+        answer_callback_in_background(bot, callback_query)
+
+        if menu_action in MENU_SCREEN_ACTIONS:
+            await MENU_SCREEN_ACTIONS[menu_action](bot, chat_id, user_id, username, callback_query.message.message_id)
+        else:
+            handler = MENU_ACTIONS.get(menu_action)
+            if handler:
+                await handler(bot, chat_id, user_id, username)
+
+    except Exception:
+        logger.exception("Error handling menu callback")
         await bot.answer_callback_query(callback_query.id, "Ошибка при обработке команды", show_alert=True)
 
 
@@ -357,20 +393,19 @@ async def handle_change_callback(bot, callback_query, action):
         username = callback_query.from_user.username or 'Unknown'
         chat_id = callback_query.message.chat.id
 
-        await bot.answer_callback_query(callback_query.id)
+        # Acknowledge while the action runs instead of waiting for Telegram's reply first
+        answer_callback_in_background(bot, callback_query)
 
         if action == 'goal_only':
             # Change only goal - skip to step 1 with existing goal cleared
-            from goal import start_goal_setting
             await start_goal_setting(bot, chat_id, user_id, username, skip_goal=False, force_change_goal=True)
 
         elif action == 'problems_only':
             # Change only problems - skip to problem selection (step 2)
-            from goal import start_goal_setting
             await start_goal_setting(bot, chat_id, user_id, username, skip_goal=True, force_change_problems=True)
 
-    except Exception as e:
-        print(f"Error handling change callback: {e}")
+    except Exception:
+        logger.exception("Error handling change callback")
         await bot.answer_callback_query(callback_query.id, "Ошибка при обработке команды", show_alert=True)
 
 
@@ -381,14 +416,11 @@ def register_menu_handlers(bot):
     Args:
         bot: Telegram bot instance
     """
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('menu:'))
+    @bot.callback_query_handler(func=lambda call: call.data.startswith((MENU_CALLBACK_PREFIX, CHANGE_CALLBACK_PREFIX)))
     async def menu_callback_handler(callback_query):
-        """Handle menu button clicks"""
-        action = callback_query.data.split(':')[1]
-        await handle_menu_callback(bot, callback_query, action)
-
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('change:'))
-    async def change_callback_handler(callback_query):
-        """Handle change goal/problems buttons"""
-        action = callback_query.data.split(':')[1]
-        await handle_change_callback(bot, callback_query, action)
+        """Handle menu and change goal/problems button clicks"""
+        data = callback_query.data
+        if data.startswith(MENU_CALLBACK_PREFIX):
+            await handle_menu_callback(bot, callback_query, data[len(MENU_CALLBACK_PREFIX):])
+        else:
+            await handle_change_callback(bot, callback_query, data[len(CHANGE_CALLBACK_PREFIX):])